@@ -42,6 +42,16 @@ get_musicbox_pid() {
     echo `ps x | grep python | sed -n '/musicbox/s/ *//p' | cut -d ' ' -f 1`
 }
 
+get_supervisor_pid() {
+    echo `ps x | grep python | sed -n '/musicbox up/s/ *//p' | cut -d ' ' -f 1`
+}
+
+wait_no_pid() {
+    while [ ! -z "`$1`" ]; do
+        sleep 0.2
+    done
+}
+
 #
 # main
 #
@@ -58,42 +68,28 @@ done
 #
 # kill
 #
-echo_do "sudo pkill pigpiod"
-sleep 1
+# the supervisor (``MusicBox up``) stops its children in parallel
+PIDS=`get_supervisor_pid`
+if [ ! -z "$PIDS" ]; then
+    echo_do "kill $PIDS"
+    wait_no_pid get_supervisor_pid
+fi
 
 PIDS=`get_musicbox_pid`
-while [ ! -z "$PIDS" ]; do
+if [ ! -z "$PIDS" ]; then
     echo_do "kill $PIDS"
-    sleep 1
-    PIDS=`get_musicbox_pid`
-done
-sleep 2
+    wait_no_pid get_musicbox_pid
+fi
 
 if [ $BOOT_FLAG -eq 0 ]; then
     # don't boot, kill only
+    echo_do "sudo pkill pigpiod"
     exit 0
 fi
 
 #
 # boot
 #
-echo_do "sudo pigpiod"
-sleep 1
-
-echo_do "${MUSICBOX_CMD} webapp $DEBUG_FLAG >> $LOGDIR/webapp.log 2>&1 &"
-sleep 1
-
-echo_do "${MUSICBOX_CMD} server -w 0 -p 8880 $DEBUG_FLAG >> $LOGDIR/server0.log 2>&1 &"
-sleep 2
-echo_do "${MUSICBOX_CMD} server -w 1 -p 8881 $DEBUG_FLAG >> $LOGDIR/server1.log 2>&1 &"
-sleep 2
-echo_do "${MUSICBOX_CMD} server -w 2 -p 8882 $DEBUG_FLAG >> $LOGDIR/server2.log 2>&1 &"
-sleep 2
-echo_do "${MUSICBOX_CMD} server -w 3 -p 8883 $DEBUG_FLAG >> $LOGDIR/server3.log 2>&1 &"
-
-sleep 5
-
-echo_do "${MUSICBOX_CMD} send -p 8882 single_play 69"
-echo_do "${MUSICBOX_CMD} send -p 8882 single_play 73"
-echo_do "${MUSICBOX_CMD} send -p 8882 single_play 76"
-echo_do "${MUSICBOX_CMD} send -p 8882 single_play 69 73 76"
+# pigpiod, webapp, server (all wav modes in one process) and the chime:
+# each step waits for the previous one to be ready, not for a fixed time
+echo_do "${MUSICBOX_CMD} up -L $LOGDIR -a $DEBUG_FLAG >> $LOGDIR/up.log 2>&1 &"
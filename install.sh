@@ -57,6 +57,8 @@ WORKDIR="$HOME/${PKG_NAME}_work"
 UPLOAD_DIR="$WORKDIR/upload"
 MUSICDATA_DIR="$WORKDIR/music_data"
 LOG_DIR="$WORKDIR/log/"
+SNAPSHOT_DIR="$WORKDIR/snapshot"
+PLAN_DIR="$WORKDIR/plan"
 
 WRAPPER_SCRIPT="MusicBox"
 BOOT_SCRIPT="boot-musicbox.sh"
@@ -166,6 +168,8 @@ echo "export MUSICBOX_WEB_DIR=\$MUSICBOX_DIR/web-root" >> $HOME/$ENV_FILE
 echo "export MUSICBOX_UPLOAD_DIR=\$MUSICBOX_WORK/upload" >> $HOME/$ENV_FILE
 echo "export MUSICBOX_MUSICDATA_DIR=\$MUSICBOX_WORK/music_data" >> $HOME/$ENV_FILE
 echo "export MUSICBOX_LOG_DIR=\$MUSICBOX_WORK/log" >> $HOME/$ENV_FILE
+echo "export MUSICBOX_SNAPSHOT_DIR=\$MUSICBOX_WORK/snapshot" >> $HOME/$ENV_FILE
+echo "export MUSICBOX_PLAN_DIR=\$MUSICBOX_WORK/plan" >> $HOME/$ENV_FILE
 echo
 cat $HOME/$ENV_FILE
 echo
@@ -250,7 +254,8 @@ echo
 #
 # make work directories
 #
-mkdir -pv $WORKDIR $UPLOAD_DIR $MUSICDATA_DIR $LOG_DIR
+mkdir -pv $WORKDIR $UPLOAD_DIR $MUSICDATA_DIR $LOG_DIR $SNAPSHOT_DIR \
+    $PLAN_DIR
 
 #
 # display usage
@@ -3,27 +3,65 @@
 #
 """
 musicbox package
+
+Sub-modules are imported on first access (PEP 562),
+so that light commands (ex. ``MusicBox send ..``) don't pay
+for pygame, pigpio, tornado, websockets, etc.
 """
 __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021/01'
 
-from .papertape import PaperTape
-from .midi import Midi
-from .rotation_motor import RotationMotor
-from .servo import Servo
-from .movement import Movement, MovementWav1, MovementWav2, MovementWav3
-from .player import Player
-from .wsserver import WsServer
-from .wsclient import WsClient, WsClientHostPort
-from .webapp import WebServer
-from .calibration import CalibrationWebHandler
-from .upload import UploadWebHandler
+import importlib
+
+_SUBMODULE = {
+    'PaperTape': 'papertape',
+    'Midi': 'midi',
+    'RotationMotor': 'rotation_motor',
+    'RotationMotorWave': 'rotation_motor',
+    'Servo': 'servo',
+    'ChannelMap': 'channel_map',
+    'Movement': 'movement',
+    'MovementWav1': 'movement',
+    'MovementWav2': 'movement',
+    'MovementWav3': 'movement',
+    'MovementSim': 'movement',
+    'SimClock': 'clock',
+    'Song': 'song',
+    'Playlist': 'playlist',
+    'Player': 'player',
+    'WsServer': 'wsserver',
+    'WsClient': 'wsclient',
+    'WsClientHostPort': 'wsclient',
+    'WsStreamClient': 'wsclient',
+    'WebServer': 'webapp',
+    'CalibrationWebHandler': 'calibration',
+    'UploadWebHandler': 'upload',
+}
 
 __all__ = [
     'PaperTape', 'Midi',
-    'RotationMotor', 'Servo',
+    'RotationMotor', 'RotationMotorWave', 'Servo', 'ChannelMap',
     'Movement', 'MovementWav1', 'MovementWav2', 'MovementWav3',
+    'MovementSim', 'SimClock', 'Song', 'Playlist',
     'Player',
-    'WsServer', 'WsClient', 'WsClientHostPort',
+    'WsServer', 'WsClient', 'WsClientHostPort', 'WsStreamClient',
     'WebServer'
 ]
+
+
+def __getattr__(name):
+    """ import sub-module on demand """
+    try:
+        mod_name = _SUBMODULE[name]
+    except KeyError:
+        raise AttributeError(
+            'module %r has no attribute %r' % (__name__, name)) from None
+
+    mod = importlib.import_module('.' + mod_name, __name__)
+    obj = getattr(mod, name)
+    globals()[name] = obj
+    return obj
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_SUBMODULE.keys()))
@@ -5,13 +5,18 @@
 main for musicbox package
 """
 import os
+import sys
 import json
+import time
+import subprocess
 import click
-import cuilib
-from . import PaperTape, Midi, RotationMotor, Servo
-from . import Movement, MovementWav1, MovementWav2, MovementWav3, Player
-from . import WsServer, WsClient, WsClientHostPort, WebServer
+# only light-weight modules here.
+# heavy ones (hardware, web, parsers) are imported by each App
+from . import Servo, Player, WsServer, WebServer
+from .motion_profile import MotionProfile
+from .parser import COALESCE_MODES
 from .my_logger import get_logger
+from .my_logger import start_async_logging, dropped_count
 
 __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021/01'
@@ -25,8 +30,16 @@ DEF_WAV_DIR = os.environ.get('MUSICBOX_WAV_DIR', './wav')
 DEF_WEB_DIR = os.environ.get('MUSICBOX_WEB_DIR', './web-root')
 DEF_WEB_PORT = WebServer.DEF_PORT
 
+# ``Movement.ROTATION_BACKEND``: not to import movement for each command
+ROTATION_BACKENDS = ('thread', 'wave')
+
 DEF_UPLOAD_DIR = os.environ.get('MUSICBOX_UPLOAD_DIR', '/tmp')
 DEF_MUSICDATA_DIR = os.environ.get('MUSICBOX_MUSICDATA_DIR', '/tmp')
+DEF_MUSIC_DIR = os.environ.get('MUSICBOX_MUSICDATA_DIR')
+DEF_SNAPSHOT_DIR = os.environ.get('MUSICBOX_SNAPSHOT_DIR')
+DEF_PLAN_DIR = os.environ.get('MUSICBOX_PLAN_DIR')
+
+DEF_UP_ENDPOINTS = ('8880:0', '8881:1', '8882:2', '8883:3')
 
 
 class PaperTapeApp:
@@ -45,12 +58,16 @@ class PaperTapeApp:
         self._paper_tape_file = paper_tape_file
         self._dst = dst
 
+        from . import PaperTape
+
         self._parser = PaperTape(debug=self._dbg)
 
     def main(self):
         """ main """
         self._log.debug('')
 
+        from . import WsClient
+
         music_data = self._parser.parse(self._paper_tape_file)
 
         for dst in self._dst:
@@ -73,8 +90,8 @@ class MidiApp:
     """ MidiApp """
     def __init__(self, midi_file, dst=(), channel=[],
                  note_origin=-1, no_note_offset_flag=False,
-                 wav_mode=0,
-                 debug=False) -> None:
+                 wav_mode=0, coalesce_msec=0, coalesce_mode='first',
+                 ch_n=None, debug=False) -> None:
         """ Constructor
 
         Parameters
@@ -85,6 +102,10 @@ class MidiApp:
         note_origin: int
         no_note_offset_flag: bool
         wav_mode: int
+        coalesce_msec: float
+        coalesce_mode: str
+        ch_n: int
+            number of notes of the comb, None: ``Midi.CH_N``
         """
         self._dbg = debug
         self._log = get_logger(self.__class__.__name__, self._dbg)
@@ -99,8 +120,12 @@ class MidiApp:
         self._dst = dst
         self._channel = channel
         self._note_origin = note_origin
+        self._coalesce_msec = coalesce_msec
+        self._coalesce_mode = coalesce_mode
 
-        self._note_offset = Midi.NOTE_OFFSET
+        from . import Midi
+
+        self._note_offset = None  # the parser's offset (``ch_n``)
         if no_note_offset_flag:
             self._note_offset = []
 
@@ -110,15 +135,18 @@ class MidiApp:
             self._log.debug('[fix] note_origin=%s, note_offset=%s',
                             self._note_origin, self._note_offset)
 
-        self._parser = Midi(debug=self._dbg)
+        self._parser = Midi(ch_n=ch_n, debug=self._dbg)
 
     def main(self) -> None:
         """ main """
         self._log.debug('')
 
+        from . import WsClient
+
         music_data = self._parser.parse(
             self._midi_file, self._channel,
-            self._note_origin, self._note_offset)
+            self._note_origin, self._note_offset,
+            self._coalesce_msec, self._coalesce_mode)
 
         for dst in self._dst:
             print()
@@ -138,14 +166,18 @@ class MidiApp:
 
 class RotationMotorApp:
     """ RotationMotorApp """
-    def __init__(self, pin1, pin2, pin3, pin4, debug=False):
+    def __init__(self, pin1, pin2, pin3, pin4,
+                 backend=Player.ROTATION_BACKEND, debug=False):
         """ Constructor """
         self._dbg = debug
         self._log = get_logger(__class__.__name__, self._dbg)
         self._log.debug('pins=%s', (pin1, pin2, pin3, pin4))
+        self._log.debug('backend=%s', backend)
+
+        from . import Movement
 
-        self.mtr = RotationMotor(pin1, pin2, pin3, pin4,
-                                 debug=self._dbg)
+        mtr_class = Movement.ROTATION_BACKEND[backend]
+        self.mtr = mtr_class(pin1, pin2, pin3, pin4, debug=self._dbg)
 
     def main(self):
         """ main """
@@ -154,7 +186,7 @@ class RotationMotorApp:
         self.mtr.set_speed(1)
 
         while True:
-            prompt = '[0 <= speed <= 10 | NULL:end] '
+            prompt = '[0.0 <= speed <= 10.0 | NULL:end] '
             try:
                 line1 = input(prompt)
             except EOFError:
@@ -170,7 +202,7 @@ class RotationMotorApp:
                 break
 
             try:
-                speed = int(line1)
+                speed = float(line1)
             except Exception:
                 self._log.error('invalid speed: %a', line1)
                 continue
@@ -205,6 +237,8 @@ class ServoMotorApp:
                             pull_interval=pull_interval,
                             debug=self._dbg)
 
+        import cuilib
+
         self._cui = cuilib.Cui(debug=self._dbg)
 
         self._cui.add(self.SERVO_KEY, self.tap, 'tap')
@@ -264,6 +298,8 @@ class MovementApp:
         self._wav_mode = wav_mode
         self._rotation_speed = rotation_speed
 
+        from . import Movement, MovementWav1, MovementWav2, MovementWav3
+
         if self._wav_mode == 1:
             self._movement = MovementWav1(wav_topdir=wavdir,
                                           debug=self._dbg)
@@ -282,6 +318,8 @@ class MovementApp:
                                       pull_interval=pull_interval,
                                       debug=self._dbg)
 
+        import cuilib
+
         self._cui = cuilib.Cui(debug=self._dbg)
 
         self._cui.add(self.SERVO_KEY, self.single_play, 'single_play')
@@ -338,14 +376,16 @@ class PlayerApp:
         Player.WAVMODE_NONE: -1,
         Player.WAVMODE_PIANO: -1,
         Player.WAVMODE_PIANO_FULL: 21,
-        Player.WAVMODE_MIDI_FULL: 0
+        Player.WAVMODE_MIDI_FULL: 0,
+        Player.WAVMODE_SIM: -1
     }
 
     NOTE_N = {
         Player.WAVMODE_NONE: -1,
         Player.WAVMODE_PIANO: -1,
         Player.WAVMODE_PIANO_FULL: 88,
-        Player.WAVMODE_MIDI_FULL: 128
+        Player.WAVMODE_MIDI_FULL: 128,
+        Player.WAVMODE_SIM: -1
     }
 
     def __init__(self, music_file, channel,
@@ -385,6 +425,8 @@ class PlayerApp:
         self._note_n = self.NOTE_N[self._wav_mode]
         self._log.debug('note_n=%s', self._note_n)
 
+        from . import Midi
+
         self._parser = Midi(debug=self._dbg)
 
         self._player = Player(self._wav_mode,
@@ -392,6 +434,8 @@ class PlayerApp:
                               wavdir=self._wavdir,
                               debug=self._dbg)
 
+        import cuilib
+
         self._cui = cuilib.Cui(debug=self._dbg)
 
         self._cui.add(self.SERVO_KEY, self.single_play, 'single_play')
@@ -433,7 +477,12 @@ class PlayerApp:
                 self.NOTE_BASE[self._wav_mode],
                 self.NOTE_N[self._wav_mode])
 
-            self._player.music_load(music_data)
+            from .plan import ActuationPlan
+
+            self._player.music_load(
+                music_data,
+                plan_file=ActuationPlan.cache_path(self._music_file[0]),
+                copy=False)
 
         self._cui.start()
         print('*** Start ***')
@@ -449,7 +498,13 @@ class PlayerApp:
 
 class WsServerApp:
     """ Music Box Websocket Server App """
-    def __init__(self, port, wav_mode, wavdir, debug=False):
+    def __init__(self, port, wav_mode, wavdir,
+                 rotation_backend=Player.ROTATION_BACKEND,
+                 rotation_tempo=False, push_budget=Player.PUSH_BUDGET,
+                 actuator_proc=False, realtime=False, rt_cpu=None,
+                 coalesce_msec=0, coalesce_mode='first',
+                 boards=None, endpoints=(), snapshot_dir=None,
+                 plan_dir=None, music_dir=None, debug=False):
         """ Constructor
 
         Parameters
@@ -457,6 +512,25 @@ class WsServerApp:
         port: int
         wav_mode: int
         wavdir: str
+        rotation_backend: str
+        rotation_tempo: bool
+        push_budget: int
+        actuator_proc: bool
+        realtime: bool
+        rt_cpu: int
+        coalesce_msec: float
+        coalesce_mode: str
+        boards: str
+            servo boards (``musicbox.channel_map``)
+        endpoints: list of str
+            'port:wav_mode' .. several endpoints in this process
+            (``port`` and ``wav_mode`` are ignored)
+        snapshot_dir: str
+            warm restart (``musicbox.snapshot``), None: disabled
+        plan_dir: str
+            cache directory of the actuation plans, None: no cache
+        music_dir: str
+            music files of ``playlist_add`` (clients), None: not accepted
         """
         self._dbg = debug
         self._log = get_logger(self.__class__.__name__, self._dbg)
@@ -464,10 +538,31 @@ class WsServerApp:
         self._port = port
         self._wav_mode = wav_mode
         self._wavdir = wavdir
+        self._rotation_backend = rotation_backend
+
+        svr_kw = {'wavdir': self._wavdir,
+                  'rotation_backend': self._rotation_backend,
+                  'rotation_tempo': rotation_tempo,
+                  'push_budget': push_budget,
+                  'actuator_proc': actuator_proc,
+                  'realtime': realtime, 'rt_cpu': rt_cpu,
+                  'coalesce_msec': coalesce_msec,
+                  'coalesce_mode': coalesce_mode,
+                  'boards': boards,
+                  'snapshot_dir': snapshot_dir,
+                  'plan_dir': plan_dir,
+                  'music_dir': music_dir}
+
+        if endpoints:
+            from .wsserver import MultiWsServer
+
+            self._svr = MultiWsServer(endpoints, debug=self._dbg, **svr_kw)
+            for ep in self._svr.status()['endpoints']:
+                self._log.info('%s', ep)
+            return
 
-        self._svr = WsServer(wav_mode=self._wav_mode,
-                             port=self._port, wavdir=self._wavdir,
-                             debug=self._dbg)
+        self._svr = WsServer(wav_mode=self._wav_mode, port=self._port,
+                             debug=self._dbg, **svr_kw)
 
     def main(self):
         """ main """
@@ -507,6 +602,8 @@ class WsCmdApp:
         self._server_port = server_port
         self._cmd = cmd
 
+        from . import WsClientHostPort
+
         self._client = WsClientHostPort(self._server_host,
                                         self._server_port,
                                         debug=self._dbg)
@@ -532,15 +629,1345 @@ class WsCmdApp:
             self._client.send_music_file(music_data_file)
             return
 
+        if cmd_name == 'rotation_speed':
+            msg['speed'] = float(self._cmd[1])
+            self._client.send(msg)
+            return
+
+        if cmd_name in ('rotation_tempo', 'playlist_shuffle',
+                        'playlist_loop'):
+            msg['on'] = self._cmd[1:2] != ['off']
+            self._client.send(msg)
+            return
+
+        if cmd_name == 'playlist_add':
+            # file in music_dir of the server
+            for music_file in self._cmd[1:]:
+                if os.path.exists(music_file):
+                    music_file = os.path.abspath(music_file)
+                msg['music_file'] = music_file
+                self._client.send(msg)
+            return
+
+        if cmd_name == 'music_tempo':
+            msg['rate'] = self._cmd[1]
+            if msg['rate'] != 'auto':
+                msg['rate'] = float(msg['rate'])
+            self._client.send(msg)
+            return
+
         if cmd_name in ('music_seek', 'music_shift'):
             msg['pos'] = float(self._cmd[1])
             self._log.debug('msg=%s', msg)
             self._client.send(msg)
             return
 
+        if cmd_name in ('status', 'endpoints', 'playlist',
+                        'ensemble_status'):
+            print(json.dumps(self._client.request(msg), indent=2))
+            return
+
         self._client.send(msg)
 
 
+class EnsembleApp:
+    """ Start a song on several servers at the same time """
+    def __init__(self, music_file, urls, delay_sec=2.0, repeat=False,
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        music_file: str
+            MIDI, music data (JSON) or paper tape file
+        urls: list of str
+            urls[0]: leader
+        delay_sec: float
+            start this much later
+        repeat: bool
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('music_file=%s, urls=%s', music_file, urls)
+
+        self._music_file = music_file
+        self._urls = list(urls)
+        self._delay_sec = delay_sec
+        self._repeat = repeat
+
+    def main(self):
+        """ main """
+        self._log.debug('')
+
+        from . import WsStreamClient
+        from .playlist import load_music_file
+
+        music_data = load_music_file(self._music_file, debug=self._dbg)
+
+        leader_url = self._urls[0]
+        leader = WsStreamClient(leader_url, debug=self._dbg)
+        offset, rtt = min([leader.sync() for _ in range(8)],
+                          key=lambda p: p[1])
+        start = time.monotonic() + offset + self._delay_sec
+        leader.close()
+
+        print('start     : %.3f (leader clock)' % (start))
+        for url in self._urls:
+            msg = {'cmd': 'ensemble_start',
+                   'leader': None if url == leader_url else leader_url,
+                   'start': start,
+                   'music_data': music_data,
+                   'repeat': self._repeat}
+            client = WsStreamClient(url, debug=self._dbg)
+            client.send(msg)
+            client.close()
+
+        time.sleep(self._delay_sec + 0.5)
+
+        for url in self._urls:
+            client = WsStreamClient(url, debug=self._dbg)
+            status = client.request({'cmd': 'ensemble_status'})
+            client.close()
+
+            if status.get('error') or status.get('local_start') is None:
+                print('%s: %s' % (url, status))
+                continue
+
+            print('%s: local start %.3f, offset %+.3f msec '
+                  '(error < %.3f msec)' % (
+                      url, status['local_start'], status['offset'] * 1000,
+                      status['rtt'] / 2 * 1000))
+
+
+class LeadFitApp:
+    """ fit lead time table from recorded timestamps """
+    def __init__(self, timestamp_file, conf_file, lead_conf_file=None,
+                 servo_n=Servo.DEF_SERVO_N, dry_run=False, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        timestamp_file: str
+            CSV: ch,cmd_time,strike_time (sec)
+        conf_file: str
+            servo configuration file
+        lead_conf_file: str
+            None: next to ``conf_file``
+        servo_n: int
+        dry_run: bool
+            don't save
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('timestamp_file=%s', timestamp_file)
+        self._log.debug('conf_file=%s, lead_conf_file=%s',
+                        conf_file, lead_conf_file)
+
+        self._timestamp_file = timestamp_file
+        self._lead_conf_file = lead_conf_file
+        if self._lead_conf_file is None:
+            self._lead_conf_file = Servo.lead_conf_path(conf_file)
+        self._servo_n = servo_n
+        self._dry_run = dry_run
+
+    def main(self):
+        """ main """
+        self._log.debug('')
+
+        from .servo import fit_lead, save_lead_conf
+
+        samples = []
+        with open(self._timestamp_file) as f:
+            for line in f:
+                col = line.replace(' ', '').rstrip('\n').split(',')
+                if len(col) != 3 or col[0][0] == '#':
+                    continue
+                samples.append((int(col[0]), float(col[1]),
+                                float(col[2])))
+        self._log.debug('samples=%s', len(samples))
+
+        lead, count = fit_lead(samples, self._servo_n)
+
+        print('ch  lead[msec]  samples')
+        for ch in range(self._servo_n):
+            print('%02d  %10.1f  %7d' % (ch, lead[ch] * 1000, count[ch]))
+
+        if self._dry_run:
+            return
+
+        save_lead_conf(self._lead_conf_file, lead)
+        print('saved: %s' % (self._lead_conf_file))
+
+
+class TuneIntervalApp:
+    """ search the shortest reliable push/pull intervals """
+    def __init__(self, ch_list, conf_file, repeat=5, min_interval=0.02,
+                 ratio=0.85, margin=1.1, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        ch_list: list of int
+            empty: all channels
+        conf_file: str
+            servo configuration file
+        repeat: int
+            number of taps for each candidate
+        min_interval: float
+            sec
+        ratio: float
+        margin: float
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('ch_list=%s, conf_file=%s', ch_list, conf_file)
+
+        self._servo = Servo(conf_file=conf_file, debug=self._dbg)
+
+        self._ch_list = list(ch_list)
+        if not self._ch_list:
+            self._ch_list = list(range(self._servo.servo_n))
+
+        self._repeat = repeat
+        self._min_interval = min_interval
+        self._ratio = ratio
+        self._margin = margin
+
+    def judge(self, ch, push_interval, pull_interval):
+        """ ask user """
+        ans = input('ch=%02d push=%.0f pull=%.0f msec: '
+                    'sounded %s times? [Y/n] ' % (
+                        ch, push_interval * 1000, pull_interval * 1000,
+                        self._repeat))
+        return not ans.strip().lower().startswith('n')
+
+    def main(self):
+        """ main """
+        self._log.debug('')
+
+        result = {}
+        for ch in self._ch_list:
+            result[ch] = self._servo.tune_interval(
+                ch, self.judge, min_interval=self._min_interval,
+                ratio=self._ratio, repeat=self._repeat,
+                margin=self._margin)
+
+        print('ch  push[msec]  pull[msec]')
+        for ch, (push, pull) in result.items():
+            print('%02d  %10.0f  %10.0f' % (ch, push * 1000, pull * 1000))
+
+        print('saved: %s' % (self._servo.conf_file))
+
+    def end(self):
+        """ end """
+        self._log.debug('')
+        self._servo.end()
+
+
+class SimApp:
+    """ Play music with the simulation backend (no hardware) """
+    def __init__(self, music_file, fast, loop, push_budget,
+                 out_file=None, next_files=(), tempo=None, boards=None,
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        music_file: str
+            MIDI file or music data file (JSON)
+        next_files: list of str
+            played after ``music_file`` as a gapless playlist
+        tempo: str
+            playback rate (float or 'auto'), None: 1.0
+        fast: bool
+            True: as fast as possible, False: real time
+        loop: int
+            number of times to play
+        push_budget: int
+        out_file: str
+            CSV file of actuations (t, ch, push/pull)
+        boards: str
+            simulated servo boards (``musicbox.channel_map``)
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('music_file=%s, fast=%s, loop=%s',
+                        music_file, fast, loop)
+
+        self._music_file = music_file
+        self._loop = loop
+        self._out_file = out_file
+        self._next_files = list(next_files)
+        self._tempo = tempo
+
+        from .clock import SimClock
+
+        self._clock = SimClock(realtime=not fast)
+        self._player = Player(Player.WAVMODE_SIM,
+                              push_budget=push_budget,
+                              clock=self._clock,
+                              boards=boards,
+                              debug=self._dbg)
+
+    def load_music(self):
+        """
+        Returns
+        -------
+        music_data: list
+        """
+        if self._music_file.lower().endswith(('.mid', '.midi')):
+            from . import Midi
+            return Midi(ch_n=self._player.ch_n,
+                        debug=self._dbg).parse(self._music_file)
+
+        with open(self._music_file) as f:
+            return json.load(f)
+
+    @staticmethod
+    def check_order(actuations, servo_n):
+        """
+        every channel: push, pull, push, pull, ..
+
+        Returns
+        -------
+        errors: int
+        """
+        pushed = [False] * servo_n
+        prev_t = float('-inf')
+        errors = 0
+        for t, ch, push_flag in actuations:
+            if t < prev_t or push_flag == pushed[ch]:
+                errors += 1
+            prev_t = t
+            pushed[ch] = push_flag
+
+        return errors + sum(pushed)
+
+    def main(self):
+        """ main
+
+        Returns
+        -------
+        ok: bool
+            actuations are in order, and on time
+        """
+        self._log.debug('')
+
+        if self._tempo is not None:
+            self._player.music_tempo(self._tempo)
+
+        music_data = self.load_music()
+        if self._next_files:
+            return self.main_playlist(music_data)
+
+        self._player.music_load(music_data, start_flag=False, copy=False)
+
+        movement = self._player.movement()
+        movement.clear_actuations()
+
+        wall0 = time.perf_counter()
+        sim0 = self._clock.monotonic()
+        max_late = 0.0
+        for _ in range(self._loop):
+            self._player.music_play(repeat=False)
+            self._player.music_wait()
+            max_late = max(max_late,
+                           self._player.song_stats()['lateness']['max_msec'])
+        wall_sec = time.perf_counter() - wall0
+        sim_sec = self._clock.monotonic() - sim0
+
+        actuations = movement.actuations()
+        stats = self._player.song_stats()
+        servo_n = len(stats['dropped'])
+
+        order_err = self.check_order(actuations, servo_n)
+
+        pushes = len([a for a in actuations if a[2]])
+        notes = sum([len(d['ch']) for d in music_data if d['ch']])
+
+        print('music_data: %s entries, %s notes x %s' % (
+            len(music_data), notes, self._loop))
+        print('time      : %.1f sec simulated, %.2f sec wall' % (
+            sim_sec, wall_sec))
+        print('actuations: %s (%s pushes)' % (len(actuations), pushes))
+        print('dropped   : %s (last loop)' % (sum(stats['dropped'])))
+        print('retrigger : %s (last loop)' % (sum(stats['retriggered'])))
+        print('staggered : %s chords, max %.1f msec (last loop)' % (
+            stats['staggered_chords'], stats['max_stagger'] * 1000))
+        print('late      : max %.3f msec' % (max_late))
+        print('tempo     : x%s' % (stats['tempo']))
+        for board in stats.get('boards', []):
+            print('board     : %s ch %s..%s, %s writes in %s batches'
+                  ' (max %s), %.1f usec/batch' % (
+                      board['addr'], board['ch'][0], board['ch'][1],
+                      board['writes'], board['batches'],
+                      board['max_batch'], board['write_usec']['mean']))
+            if 'messages' in board:
+                print('            %s messages, queue max %.3f msec,'
+                      ' %s errors' % (board['messages'],
+                                      board['max_queue_msec'],
+                                      board['errors']))
+        print('order     : %s' % ('OK' if order_err == 0
+                                  else 'NG (%s errors)' % (order_err)))
+
+        if self._out_file:
+            with open(self._out_file, mode='w') as f:
+                f.write('t,ch,op\n')
+                for t, ch, push_flag in actuations:
+                    f.write('%.6f,%s,%s\n' % (
+                        t, ch, 'push' if push_flag else 'pull'))
+            print('out       : %s' % (self._out_file))
+
+        return order_err == 0 and max_late <= Player.RESYNC_SEC * 1000
+
+    def main_playlist(self, music_data):
+        """ play ``music_file`` and ``next_files`` as a playlist
+
+        Returns
+        -------
+        ok: bool
+            actuations are in order, and every track starts on time
+        """
+        movement = self._player.movement()
+
+        tracks = []
+        for _ in range(self._loop):
+            tracks.append(self._player.playlist_add(
+                music_data, name=self._music_file, copy=False))
+            for music_file in self._next_files:
+                tracks.append(self._player.playlist_add(
+                    music_file=music_file))
+
+        movement.clear_actuations()
+
+        wall0 = time.perf_counter()
+        sim0 = self._clock.monotonic()
+        self._player.music_play(repeat=False)
+        self._player.music_wait()
+        wall_sec = time.perf_counter() - wall0
+        sim_sec = self._clock.monotonic() - sim0
+
+        actuations = movement.actuations()
+        order_err = self.check_order(actuations, self._player.ch_n)
+
+        # the first push of each track should be on schedule
+        max_err = 0.0
+        for track in tracks:
+            if not track.plan.events:
+                continue
+            expected = track.start_time + track.plan.events[0][0]
+            first = min([t for t, ch, push_flag in actuations
+                         if push_flag and t >= expected - 0.0005])
+            err = first - expected
+            max_err = max(max_err, abs(err))
+            print('track     : %-24s start %9.3f sec, '
+                  'first note %+.3f msec' % (
+                      track.name, track.start_time - sim0, err * 1000))
+
+        print('time      : %.1f sec simulated, %.2f sec wall' % (
+            sim_sec, wall_sec))
+        print('first note: max error %.3f msec' % (max_err * 1000))
+        print('order     : %s' % ('OK' if order_err == 0
+                                  else 'NG (%s errors)' % (order_err)))
+
+        return order_err == 0 and max_err <= Player.RESYNC_SEC
+
+    def end(self):
+        """ end """
+        self._log.debug('')
+        self._player.end()
+
+
+class BenchStartupApp:
+    """ Startup time benchmark for each sub-command
+
+    Each sub-command is run as ``python -X importtime -m musicbox
+    <sub-command> --help`` in a fresh interpreter, so that the imports
+    done by the real entry point are measured (not a list of modules
+    that the sub-command is expected to import).
+    """
+    HELP = '(help)'
+    TOP_N = 3
+
+    def __init__(self, subcmd=(), repeat=3, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        subcmd: list of str
+            sub-commands to measure, e.g. 'send', 'bench plan'
+            (empty: all)
+        repeat: int
+            number of runs (the best one is reported)
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('subcmd=%s, repeat=%s', subcmd, repeat)
+
+        self._subcmd = list(subcmd) or self.all_subcmd()
+        self._repeat = max(repeat, 1)
+
+    @classmethod
+    def all_subcmd(cls):
+        """ all sub-commands of the CLI (including groups' commands)
+
+        Returns
+        -------
+        subcmd: list of str
+        """
+        subcmd = [cls.HELP]
+        for name, cmd in cli.commands.items():
+            subcmd.append(name)
+            if isinstance(cmd, click.Group):
+                subcmd += ['%s %s' % (name, sub) for sub in cmd.commands]
+        return subcmd
+
+    @staticmethod
+    def parse_importtime(stderr):
+        """ parse the output of ``-X importtime``
+
+        Parameters
+        ----------
+        stderr: str
+
+        Returns
+        -------
+        (import_sec, module_n, top): (float, int, list of (str, float))
+            total import time, number of imported modules and
+            top-level imports with their cumulative time
+        """
+        import_us = 0
+        module_n = 0
+        top = []
+        for line in stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            cols = line[len('import time:'):].split('|', 2)
+            if len(cols) != 3 or not cols[0].strip().isdigit():
+                continue  # header
+
+            import_us += int(cols[0])
+            module_n += 1
+
+            name = cols[2][1:]
+            if not name.startswith(' '):
+                top.append((name, int(cols[1]) / 1000000))
+
+        return import_us / 1000000, module_n, top
+
+    def measure(self, subcmd):
+        """ measure one sub-command
+
+        Parameters
+        ----------
+        subcmd: str
+
+        Returns
+        -------
+        (import_sec, process_sec, module_n, top, err):
+        (float, float, int, list of (str, float), str)
+        """
+        env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='hide')
+        args = [] if subcmd == self.HELP else subcmd.split()
+        cmd = [sys.executable, '-X', 'importtime', '-m', 'musicbox'
+               ] + args + ['--help']
+        self._log.debug('cmd=%s', cmd)
+
+        best = None
+        for _ in range(self._repeat):
+            t0 = time.perf_counter()
+            ret = subprocess.run(cmd, env=env, capture_output=True,
+                                 text=True)
+            process_sec = time.perf_counter() - t0
+
+            if ret.returncode != 0:
+                lines = [line for line in ret.stderr.splitlines()
+                         if not line.startswith('import time:')]
+                err = lines[-1] if lines else 'exit %s' % (ret.returncode)
+                return None, process_sec, 0, [], err
+
+            import_sec, module_n, top = self.parse_importtime(ret.stderr)
+            result = (import_sec, process_sec, module_n, top, '')
+            if best is None or result[0] < best[0]:
+                best = result
+
+        return best
+
+    def main(self):
+        """ main """
+        self._log.debug('')
+
+        print('%-20s %10s %10s %8s  %s' % (
+            'sub-command', 'import', 'process', 'modules', 'slowest'))
+
+        for subcmd in self._subcmd:
+            import_sec, process_sec, module_n, top, err = self.measure(
+                subcmd)
+            if err:
+                print('%-20s %10s %8.1fms  NG: %s' % (
+                    subcmd, '-', process_sec * 1000, err))
+                continue
+
+            top = sorted(top, key=lambda t: t[1], reverse=True)
+            slowest = ', '.join(['%s(%.0fms)' % (name, sec * 1000)
+                                 for name, sec in top[:self.TOP_N]])
+            print('%-20s %8.1fms %8.1fms %8d  %s' % (
+                subcmd, import_sec * 1000, process_sec * 1000, module_n,
+                slowest))
+
+
+class BenchRotationApp:
+    """ CPU usage of each rotation motor backend """
+    def __init__(self, pins, speed, sec, backend=(), debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        pins: list of int
+        speed: int
+        sec: float
+            measuring time for each backend
+        backend: list of str
+            backends to measure (empty: all)
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('pins=%s, speed=%s, sec=%s, backend=%s',
+                        pins, speed, sec, backend)
+
+        self._pins = pins
+        self._speed = speed
+        self._sec = sec
+        self._backend = backend or ROTATION_BACKENDS
+
+    def measure(self, backend):
+        """
+        Returns
+        -------
+        cpu_percent: float
+            CPU time of this process / wall time
+        """
+        from . import Movement
+
+        mtr = Movement.ROTATION_BACKEND[backend](*self._pins,
+                                                 debug=False)
+        try:
+            mtr.set_speed(self._speed)
+            time.sleep(0.5)
+
+            cpu0 = time.process_time()
+            t0 = time.perf_counter()
+            time.sleep(self._sec)
+            cpu_sec = time.process_time() - cpu0
+            wall_sec = time.perf_counter() - t0
+        finally:
+            mtr.end()
+
+        return cpu_sec / wall_sec * 100
+
+    def main(self):
+        """ main """
+        self._log.debug('')
+
+        from . import RotationMotor
+
+        print('speed=%s (interval=%ss), %s sec each' % (
+            self._speed, RotationMotor.SPEED2INTERVAL[self._speed],
+            self._sec))
+
+        for backend in self._backend:
+            cpu_percent = self.measure(backend)
+            print('%-8s CPU %6.2f %%' % (backend, cpu_percent))
+
+
+class BenchPlanApp:
+    """ Compile an actuation plan and measure the cost """
+    def __init__(self, music_file, push_budget, lead_conf_file=None,
+                 coalesce_msec=0, coalesce_mode='first', debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        music_file: str
+            MIDI file or music data file (JSON)
+        push_budget: int
+        lead_conf_file: str
+        coalesce_msec: float
+        coalesce_mode: str
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('music_file=%s, push_budget=%s',
+                        music_file, push_budget)
+
+        self._music_file = music_file
+        self._push_budget = push_budget
+        self._lead_conf_file = lead_conf_file
+        self._coalesce_msec = coalesce_msec
+        self._coalesce_mode = coalesce_mode
+
+    def load_music(self):
+        """
+        Returns
+        -------
+        music_data: list
+        """
+        if self._music_file.lower().endswith(('.mid', '.midi')):
+            from . import Midi
+            return Midi(debug=self._dbg).parse(self._music_file)
+
+        with open(self._music_file) as f:
+            return json.load(f)
+
+    def params(self):
+        """ default servo parameters """
+        from .servo import load_lead_conf
+
+        servo_n = Servo.DEF_SERVO_N
+        lead = [0.0] * servo_n
+        if self._lead_conf_file:
+            lead = load_lead_conf(self._lead_conf_file, servo_n)
+
+        return {
+            'servo_n': servo_n,
+            'lead': lead,
+            'push_interval': [Servo.DEF_PUSH_INTERVAL] * servo_n,
+            'pull_interval': [Servo.DEF_PULL_INTERVAL] * servo_n,
+            'push_budget': self._push_budget,
+            'push_window': Servo.DEF_PUSH_WINDOW,
+            'retrigger_tol': Servo.DEF_RETRIGGER_TOL,
+        }
+
+    def main(self):
+        """ main """
+        self._log.debug('')
+
+        from .plan import ActuationPlan
+        from .parser import coalesce
+
+        music_data = self.load_music()
+        params = self.params()
+        cache_file = ActuationPlan.cache_path(self._music_file)
+
+        coalesce_stats = None
+        if self._coalesce_msec > 0:
+            wakeups0 = len(set([ev[0] for ev in ActuationPlan.compile(
+                music_data, params).events]))
+
+            t0 = time.perf_counter()
+            music_data, coalesce_stats = coalesce(
+                music_data, self._coalesce_msec, self._coalesce_mode)
+            coalesce_sec = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        plan = ActuationPlan.compile(music_data, params)
+        compile_sec = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        plan.key = ActuationPlan.make_key(music_data, params,
+                                          Player.DEF_DELAY)
+        plan.save(cache_file)
+        save_sec = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        ActuationPlan.load(cache_file, plan.key)
+        load_sec = time.perf_counter() - t0
+
+        # executor loop without waiting (null device)
+        def actuate(op, ch):
+            pass
+
+        cpu0 = time.process_time()
+        for t, op, ch, idx in plan.events:
+            actuate(op, ch)
+        exec_sec = time.process_time() - cpu0
+
+        notes = sum([len(d['ch']) for d in music_data if d['ch']])
+        stats = plan.stats
+
+        print('music_data: %s entries, %s notes, %.1f sec' % (
+            len(music_data), notes, plan.length))
+        print('events    : %s' % (len(plan)))
+        print('compile   : %8.1f msec' % (compile_sec * 1000))
+        print('save      : %8.1f msec (%s)' % (save_sec * 1000,
+                                                cache_file))
+        print('load      : %8.1f msec' % (load_sec * 1000))
+        print('executor  : %8.2f usec/event (CPU, null device)' % (
+            exec_sec / max(len(plan), 1) * 1000000))
+        print('staggered : %s chords / %s, %s pushes, max %.1f msec' % (
+            stats['staggered_chords'], stats['chords'],
+            stats['staggered_pushes'], stats['max_stagger'] * 1000))
+        print('retrigger : %s, max late %.1f msec' % (
+            sum(stats['retriggered']), stats['max_late'] * 1000))
+        print('dropped   : %s' % (sum(stats['dropped'])))
+
+        wakeups = len(set([ev[0] for ev in plan.events]))
+        if coalesce_stats is None:
+            print('wakeups   : %s' % (wakeups))
+            return
+
+        print('coalesce  : %s msec (%s), %.1f msec' % (
+            self._coalesce_msec, self._coalesce_mode, coalesce_sec * 1000))
+        print('  chords  : %s -> %s (%s saved)' % (
+            coalesce_stats['events_in'], coalesce_stats['events_out'],
+            coalesce_stats['wakeups_saved']))
+        print('  merged  : %s notes (%s actuations saved)' % (
+            coalesce_stats['notes_merged'],
+            coalesce_stats['actuations_saved']))
+        print('wakeups   : %s -> %s (%.0f%%)' % (
+            wakeups0, wakeups, wakeups / max(wakeups0, 1) * 100))
+
+
+class BenchPigpiodApp:
+    """ Count pigpiod commands and round-trips with a local stand-in """
+    def __init__(self, music_file, push_budget, conf_file,
+                 rotation_backend=None, rotation_sec=5.0, rtt_n=1000,
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        music_file: str
+            MIDI file or music data file (JSON)
+        push_budget: int
+        conf_file: str
+            servo conf file
+        rotation_backend: str
+            None: no rotation motor
+        rotation_sec: float
+        rtt_n: int
+            number of round-trips to measure
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('music_file=%s, rotation_backend=%s',
+                        music_file, rotation_backend)
+
+        self._music_file = music_file
+        self._push_budget = push_budget
+        self._conf_file = conf_file
+        self._rotation_backend = rotation_backend
+        self._rotation_sec = rotation_sec
+        self._rtt_n = rtt_n
+
+        from .pigpiod_sim import PigpiodSim
+
+        if 'pigpio' in sys.modules:
+            self._log.warning('pigpio is already imported: '
+                              'PIGPIO_PORT may be ignored')
+
+        self._svr = PigpiodSim(port=0, debug=self._dbg)
+        self._svr.start()
+        # read by ``pigpio`` at import time
+        os.environ['PIGPIO_ADDR'] = 'localhost'
+        os.environ['PIGPIO_PORT'] = str(self._svr.port)
+
+    def load_music(self):
+        """
+        Returns
+        -------
+        music_data: list
+        """
+        if self._music_file.lower().endswith(('.mid', '.midi')):
+            from . import Midi
+            return Midi(debug=self._dbg).parse(self._music_file)
+
+        with open(self._music_file) as f:
+            return json.load(f)
+
+    @staticmethod
+    def print_counts(counts):
+        for name, n in counts.most_common():
+            print('  %-6s: %s' % (name, n))
+
+    def bench_rtt(self):
+        """ round-trip latency of a command without I/O (READ) """
+        import pigpio
+
+        pi = pigpio.pi()
+        rtt = []
+        for _ in range(self._rtt_n):
+            t0 = time.perf_counter()
+            pi.read(0)
+            rtt.append(time.perf_counter() - t0)
+        pi.stop()
+
+        rtt.sort()
+        print('round-trip: mean %.1f, p50 %.1f, p99 %.1f, max %.1f usec' % (
+            sum(rtt) / len(rtt) * 1000000,
+            rtt[len(rtt) // 2] * 1000000,
+            rtt[len(rtt) * 99 // 100] * 1000000,
+            rtt[-1] * 1000000))
+
+    def bench_servo(self, music_data):
+        """ servo commands of the song (as fast as possible) """
+        from .plan import ActuationPlan, PUSH
+
+        self._svr.clear_log()
+        servo = Servo(conf_file=self._conf_file,
+                      push_budget=self._push_budget, debug=self._dbg)
+        print('servo init: %s commands' % (len(self._svr.log)))
+        self.print_counts(self._svr.counts())
+
+        plan = ActuationPlan.compile(music_data, servo.plan_params())
+
+        self._svr.clear_log()
+        lat = []
+        for t, op, ch, idx in plan.events:
+            t0 = time.perf_counter()
+            servo.actuate(op == PUSH, ch)
+            lat.append(time.perf_counter() - t0)
+        log = list(self._svr.log)
+
+        servo.end()
+
+        notes = len([ev for ev in plan.events if ev[1] == PUSH])
+        written = sum([dev.writes for dev in self._svr.pca9685.values()])
+        lat.sort()
+
+        print('song      : %s notes, %s actuations' % (notes, len(lat)))
+        print('commands  : %s, %.2f / note' % (
+            len(log), len(log) / max(notes, 1)))
+        self.print_counts(self._svr.counts(log))
+        print('I2C bytes : %s written (incl. init)' % (written))
+        if lat:
+            print('actuation : mean %.1f, p99 %.1f, max %.1f usec' % (
+                sum(lat) / len(lat) * 1000000,
+                lat[len(lat) * 99 // 100] * 1000000,
+                lat[-1] * 1000000))
+
+    def bench_rotation(self):
+        """ rotation motor commands per second """
+        from . import Movement
+
+        mtr_class = Movement.ROTATION_BACKEND[self._rotation_backend]
+
+        self._svr.clear_log()
+        mtr = mtr_class(*Player.ROTATION_GPIO, debug=self._dbg)
+        mtr.start()
+        mtr.set_speed(Player.ROTATION_SPEED)
+        time.sleep(self._rotation_sec)
+        mtr.end()
+        log = self._svr.log
+
+        print('rotation  : %s, %s commands in %.1f sec (%.1f /sec)' % (
+            self._rotation_backend, len(log), self._rotation_sec,
+            len(log) / self._rotation_sec))
+        self.print_counts(self._svr.counts(log))
+
+    def main(self):
+        """ main """
+        self._log.debug('')
+
+        music_data = self.load_music()
+
+        self.bench_rtt()
+        self.bench_servo(music_data)
+        if self._rotation_backend:
+            self.bench_rotation()
+
+    def end(self):
+        """ end """
+        self._log.debug('')
+        self._svr.end()
+
+
+class BenchStreamApp:
+    """ Live streaming through a simulated server, with network jitter """
+    WARMUP_N = 32  # notes before the statistics
+    def __init__(self, port, note_n, nps, jitter_msec, batch,
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        port: int
+            port of the server (``MusicBox server -w 4``)
+        note_n: int
+            number of notes
+        nps: float
+            notes per second
+        jitter_msec: float
+            each batch is delayed randomly up to this
+        batch: int
+            notes per batch
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('port=%s, note_n=%s, nps=%s, jitter=%s, batch=%s',
+                        port, note_n, nps, jitter_msec, batch)
+
+        self._port = port
+        self._note_n = note_n
+        self._nps = nps
+        self._jitter_sec = jitter_msec / 1000
+        self._batch = batch
+
+        self._svr = subprocess.Popen(
+            [sys.executable, '-m', 'musicbox', 'server',
+             '-w', str(Player.WAVMODE_SIM), '-p', str(self._port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._client = None
+
+    def connect(self, timeout=10.0):
+        """ wait for the server """
+        from . import WsStreamClient
+
+        url = 'ws://localhost:%d/' % (self._port)
+        end_time = time.monotonic() + timeout
+        while True:
+            try:
+                return WsStreamClient(url, debug=self._dbg)
+            except OSError:
+                if time.monotonic() > end_time:
+                    raise
+                time.sleep(0.1)
+
+    def main(self):
+        """ main """
+        self._log.debug('')
+
+        import random
+
+        self._client = self.connect()
+
+        rtt = [self._client.sync()[1] for _ in range(20)]
+        print('rtt       : min %.3f, max %.3f msec' % (
+            min(rtt) * 1000, max(rtt) * 1000))
+
+        t0 = time.monotonic() + 0.5
+        interval = 1 / self._nps
+        for i in range(0, self._note_n, self._batch):
+            notes = [{'t': t0 + (i + j) * interval, 'ch': [(i + j) % 15]}
+                     for j in range(min(self._batch, self._note_n - i))]
+
+            # notes are sent after the last one of the batch is played
+            send_time = notes[-1]['t'] + random.uniform(0, self._jitter_sec)
+            wait_sec = send_time - time.monotonic()
+            if wait_sec > 0:
+                time.sleep(wait_sec)
+            self._client.send_notes(notes)
+
+            if i < self.WARMUP_N <= i + self._batch:
+                # the buffer has adapted to the jitter
+                self._client.stats(reset=True)
+
+        time.sleep(1.0)
+        stats = self._client.stats()
+
+        print('notes     : %s sent, %s played, %s late, %s dropped' % (
+            stats['notes'], stats['played'], stats['late'],
+            stats['dropped']))
+        print('jitter    : %s msec' % (stats['jitter_msec']))
+        print('buffer    : %s msec' % (stats['buffer_msec']))
+        print('latency   : %s msec' % (stats['latency_msec']))
+        spread = (stats['latency_msec']['max'] -
+                  stats['latency_msec']['min'])
+        print('spread    : %.3f msec (rhythmic jitter)' % (spread))
+
+    def end(self):
+        """ end """
+        self._log.debug('')
+        if self._client is not None:
+            self._client.close()
+        self._svr.terminate()
+        self._svr.wait()
+
+
+class BenchLoadApp:
+    """ Load time and peak memory of music data (copy vs reference) """
+    def __init__(self, music_file, entries=50000, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        music_file: str
+            MIDI file or music data file (JSON)
+        entries: int
+            the song is repeated up to this number of entries
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('music_file=%s, entries=%s', music_file, entries)
+
+        self._music_file = music_file
+        self._entries = entries
+
+    def load_music(self):
+        """
+        Returns
+        -------
+        music_data: list
+            repeated up to ``entries`` (independent objects)
+        """
+        if self._music_file.lower().endswith(('.mid', '.midi')):
+            from . import Midi
+            music_data = Midi(debug=self._dbg).parse(self._music_file)
+        else:
+            with open(self._music_file) as f:
+                music_data = json.load(f)
+
+        n = max(-(-self._entries // max(len(music_data), 1)), 1)
+        return json.loads(json.dumps(music_data * n))
+
+    @staticmethod
+    def rss():
+        """ current RSS (bytes) """
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    def measure(self, func, music_data, conn):
+        """ child process: time, peak RSS and peak allocation of func """
+        import gc
+        import resource
+        import tracemalloc
+
+        gc.collect()
+        rss0 = self.rss()
+        t0 = time.perf_counter()
+        ret = func(music_data)
+        sec = time.perf_counter() - t0
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        del ret
+
+        gc.collect()
+        tracemalloc.start()
+        ret = func(music_data)
+        _, peak_alloc = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        conn.send((sec, max(peak_rss - rss0, 0), peak_alloc))
+        conn.close()
+
+    def run(self, func, music_data):
+        """ run ``measure()`` in a forked child (fresh peak RSS) """
+        import multiprocessing
+
+        ctx = multiprocessing.get_context('fork')
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=self.measure,
+                           args=(func, music_data, child_conn))
+        proc.start()
+        ret = parent_conn.recv()
+        proc.join()
+        return ret
+
+    def main(self):
+        """ main """
+        self._log.debug('')
+
+        import copy
+        from .song import Song
+        from .clock import SimClock
+
+        music_data = self.load_music()
+        print('music_data: %s entries' % (len(music_data)))
+
+        player = Player(Player.WAVMODE_SIM, clock=SimClock(),
+                        debug=self._dbg)
+
+        def load_copy(md):
+            player.music_load(md, start_flag=False)
+
+        def load_ref(md):
+            player.music_load(md, start_flag=False, copy=False)
+
+        cases = [
+            ('deepcopy (old)', copy.deepcopy),
+            ('Song', Song.from_music_data),
+            ('reference', lambda md: md),
+            ('music_load()', load_copy),
+            ('music_load(copy=False)', load_ref),
+        ]
+
+        print('%-24s %10s %12s %12s' % ('', 'time', 'peak RSS', 'peak alloc'))
+        for name, func in cases:
+            sec, peak_rss, peak_alloc = self.run(func, music_data)
+            print('%-24s %7.1f ms %9.1f MB %9.1f MB' % (
+                name, sec * 1000, peak_rss / 1024 / 1024,
+                peak_alloc / 1024 / 1024))
+
+        player.end()
+
+
+class BenchMotionApp:
+    """ Simulate acceleration ramps and check the step timing
+
+    The ramp is checked twice: as ``MotionProfile`` computes it,
+    and as ``RotationMotorWave`` sends it (waveforms on ``PigpiodSim``).
+    """
+    PINS = (5, 6, 13, 19)  # ``Movement.ROTATION_GPIO``
+    WAVE_TIMEOUT = 1.0  # sec
+
+    def __init__(self, speed1, speed2, accel, decel, start_rate, curve,
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        speed1, speed2: float
+        accel, decel, start_rate: float
+        curve: str
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+
+        from .motion_profile import MotionProfile
+
+        self._speed1 = speed1
+        self._speed2 = speed2
+        self._profile = MotionProfile(accel, decel, start_rate, curve,
+                                      debug=self._dbg)
+
+    def main(self):
+        """ main
+
+        Returns
+        -------
+        ok: bool
+        """
+        self._log.debug('')
+
+        prof = self._profile
+        intervals = prof.ramp_intervals(self._speed1, self._speed2)
+        step_time = prof.simulate(intervals)
+
+        rate1 = max(prof.speed2rate(self._speed1), prof.start_rate)
+        rate2 = max(prof.speed2rate(self._speed2), prof.start_rate)
+        limit = prof.accel if rate2 > rate1 else prof.decel
+
+        print('speed %s -> %s (%.1f -> %.1f steps/sec), curve=%s' % (
+            self._speed1, self._speed2, rate1, rate2, prof.curve))
+
+        if not intervals:
+            print('no ramp')
+            ok = True
+        else:
+            ramp_sec = step_time[-1] + intervals[-1]
+            print('steps=%s, ramp=%.3f sec, segments=%s' % (
+                len(intervals), ramp_sec, len(prof.segments(intervals))))
+            ok = self.check(step_time, intervals[-1], rate1, rate2, limit)
+
+        print('wave:')
+        ok = self.check_wave(rate1, limit) and ok
+
+        print('OK' if ok else 'NG')
+        return ok
+
+    def check(self, step_time, last_interval, rate1, rate2, limit,
+              cycle=1):
+        """ check the step timing of a ramp
+
+        Parameters
+        ----------
+        step_time: list of float
+        last_interval: float
+            sec
+        rate1, rate2: float
+            steps/sec
+        limit: float
+            steps/sec^2
+        cycle: int
+            the acceleration is measured by ``cycle`` steps
+
+        Returns
+        -------
+        ok: bool
+        """
+        max_accel = self._profile.max_accel(step_time[::cycle]) * cycle
+        end_rate = 1 / last_interval
+        print('max accel=%.1f steps/sec^2 (limit %.1f)' % (
+            max_accel, limit))
+        print('last rate=%.1f steps/sec' % (end_rate))
+
+        # discrete steps: allow a little error
+        ok = max_accel <= limit * 1.05
+        ok = ok and abs(end_rate - rate2) <= max(abs(rate2 - rate1) * 0.1,
+                                                 1)
+        ok = ok and all(t2 > t1 for t1, t2 in zip(step_time,
+                                                   step_time[1:]))
+        return ok
+
+    def check_wave(self, rate1, limit):
+        """ run ``RotationMotorWave.set_speed()`` on ``PigpiodSim``,
+        and check the waveforms that it sends
+        (steady ``speed1``, ramp and steady ``speed2``, in order)
+
+        Parameters
+        ----------
+        rate1: float
+            steps/sec
+        limit: float
+            steps/sec^2
+
+        Returns
+        -------
+        ok: bool
+        """
+        from .pigpiod_sim import PigpiodSim, CMD_WVTXM
+
+        if 'pigpio' in sys.modules:
+            self._log.warning('pigpio is already imported: '
+                              'PIGPIO_PORT may be ignored')
+
+        svr = PigpiodSim(port=0, debug=self._dbg)
+        svr.start()
+        # read by ``pigpio`` at import time
+        os.environ['PIGPIO_ADDR'] = 'localhost'
+        os.environ['PIGPIO_PORT'] = str(svr.port)
+
+        from . import RotationMotorWave
+
+        mtr = RotationMotorWave(*self.PINS, profile=self._profile,
+                                debug=self._dbg)
+        try:
+            interval1 = self._profile.speed2interval(self._speed1)
+            if interval1 is not None:
+                mtr.set_interval(interval1)
+
+            mtr.set_speed(self._speed2)
+            if self._speed2 > 0 and mtr._ramp_th is not None:
+                # the steady wave follows the ramp
+                mtr._ramp_th.join(self.WAVE_TIMEOUT)
+
+            sent = [ev[3] for ev in svr.log if ev[2] == CMD_WVTXM]
+            pulses = []
+            for wid in sent:
+                pulses += svr.wave_pulses(wid)
+        finally:
+            mtr.end()
+            svr.end()
+
+        if not pulses:
+            print('no wave')
+            return self._speed2 <= 0
+
+        prof = self._profile
+        intervals = [p[2] / 1000000 for p in pulses]
+
+        # the phase of the step sequence is kept across the waves
+        seq_n = len(RotationMotorWave.SEQ_FULL)
+        masks = [p[0] for p in pulses]
+        phase_ok = all(m == masks[i % seq_n] for i, m in enumerate(masks))
+
+        print('steps=%s, waves=%s, phase %s' % (
+            len(pulses), len(sent), 'OK' if phase_ok else 'NG'))
+
+        # the motor jumps from/to ``start_rate``: slower steps count
+        # as ``start_rate``. The pulses are in usec: the rate is
+        # measured by sequence cycles, not to count the rounding.
+        ramp = [min(i, 1 / prof.start_rate) for i in intervals]
+        step_time = prof.simulate(ramp)
+
+        rate2 = prof.speed2rate(self._speed2)
+        if rate2 == 0:
+            # stop: from ``start_rate`` or slower
+            rate2 = min(1 / intervals[-1], prof.start_rate)
+        ok = self.check(step_time, intervals[-1], rate1, rate2, limit,
+                        cycle=seq_n)
+        return ok and phase_ok
+
+
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
 
@@ -597,18 +2024,26 @@ MIDI parser
 1: Simulate Music Box with wav file\n
 2: Piano sound (note: 21 .. 108)\n
 3: Full notes""")
+@click.option('--coalesce', '-C', 'coalesce_msec', type=float, default=0,
+              help='merge notes within this window (msec), default=0')
+@click.option('--coalesce_mode', 'coalesce_mode',
+              type=click.Choice(COALESCE_MODES), default='first',
+              help="time of a merged chord, default='first'")
+@click.option('--ch_n', 'ch_n', type=int, default=None,
+              help='number of notes of the comb (ex. 30: two boards),'
+              ' default=15')
 @click.option('--debug', '-d', 'dbg', is_flag=True, default=False,
               help='debug flag')
 def midi(midi_file, out_file_or_ws_url, channel,
          note_origin, no_note_offset_flag,
-         wav_mode,
+         wav_mode, coalesce_msec, coalesce_mode, ch_n,
          dbg) -> None:
     """ midi """
     log = get_logger(__name__, dbg)
 
     app = MidiApp(midi_file, out_file_or_ws_url, channel,
                   note_origin, no_note_offset_flag,
-                  wav_mode, debug=dbg)
+                  wav_mode, coalesce_msec, coalesce_mode, ch_n, debug=dbg)
     try:
         app.main()
     finally:
@@ -622,14 +2057,20 @@ Test Rotation motor
 @click.argument('pin2', type=int)
 @click.argument('pin3', type=int)
 @click.argument('pin4', type=int)
+@click.option('--rotation_backend', '-r', 'rotation_backend',
+              type=click.Choice(ROTATION_BACKENDS),
+              default=Player.ROTATION_BACKEND,
+              help='rotation motor backend, default=%a' % (
+                  Player.ROTATION_BACKEND))
 @click.option('--debug', '-d', 'debug', is_flag=True, default=False,
               help='debug flag')
-def z_rotation(pin1, pin2, pin3, pin4, debug):
+def z_rotation(pin1, pin2, pin3, pin4, rotation_backend, debug):
     """ rotation_motor """
     log = get_logger(__name__, debug)
     log.debug('pins=%s', (pin1, pin2, pin3, pin4))
 
-    app = RotationMotorApp(pin1, pin2, pin3, pin4, debug=debug)
+    app = RotationMotorApp(pin1, pin2, pin3, pin4, rotation_backend,
+                           debug=debug)
 
     try:
         app.main()
@@ -674,9 +2115,10 @@ Test Movement
 0: Real Music Box\n
 1: Simulate Music Box with wav file\n
 2: Piano sound (note: 21 .. 108)\n
-3: Full notes""")
+3: Full notes\n
+4: Simulation (no hardware)""")
 @click.option('--speed', '-s', 'speed', type=int,
-              default=Movement.ROTATION_SPEED,
+              default=Player.ROTATION_SPEED,
               help='rotation speed')
 @click.option('--push', '-p', 'push_interval', type=float,
               default=Servo.DEF_PUSH_INTERVAL,
@@ -718,7 +2160,8 @@ Test Player
 0: Real Music Box\n
 1: Simulate Music Box with wav file\n
 2: Piano sound (note: 21 .. 108)\n
-3: Full notes""")
+3: Full notes\n
+4: Simulation (no hardware)""")
 @click.option('--speed', '-s', 'speed', type=int,
               default=Player.ROTATION_SPEED,
               help='rotation speed')
@@ -763,23 +2206,142 @@ Music Box Server
 0: Real Music Box\n
 1: Simulate Music Box with wav file\n
 2: Piano sound (note: 21 .. 108)\n
-3: Full notes""")
+3: Full notes\n
+4: Simulation (no hardware)""")
 @click.option('--wavdir', '-D', 'wavdir', type=click.Path(exists=True),
               default=DEF_WAV_DIR,
               help='wav file directory, default=%a' % DEF_WAV_DIR)
+@click.option('--rotation_backend', '-r', 'rotation_backend',
+              type=click.Choice(ROTATION_BACKENDS),
+              default=Player.ROTATION_BACKEND,
+              help="""rotation motor backend, default=%a\n
+thread: StepMtrTh (python thread)\n
+wave: pigpio DMA waveform""" % (Player.ROTATION_BACKEND))
+@click.option('--rotation_tempo', '-T', 'rotation_tempo', is_flag=True,
+              default=False,
+              help='rotation speed follows the tempo of the song')
+@click.option('--push_budget', '-B', 'push_budget', type=int,
+              default=Player.PUSH_BUDGET,
+              help='max servos that start a push at once, default=%s'
+              ' (0: unlimited)' % (Player.PUSH_BUDGET))
+@click.option('--actuator_proc', '-X', 'actuator_proc', is_flag=True,
+              default=False,
+              help='servo writes run in a child process')
+@click.option('--realtime', '-R', 'realtime', is_flag=True,
+              default=False,
+              help='SCHED_FIFO, timer slack and mlockall for the music'
+              ' thread (falls back without privileges)')
+@click.option('--cpu', 'rt_cpu', type=int, default=None,
+              help='pin the music thread to this CPU')
+@click.option('--coalesce', '-C', 'coalesce_msec', type=float, default=0,
+              help='merge notes within this window (msec), default=0')
+@click.option('--coalesce_mode', 'coalesce_mode',
+              type=click.Choice(COALESCE_MODES), default='first',
+              help="time of a merged chord, default='first'")
+@click.option('--async_log', '-a', 'async_log', is_flag=True,
+              default=False,
+              help='asynchronous (non-blocking) logging')
+@click.option('--log_file', '-L', 'log_file', type=click.Path(),
+              default=None,
+              help='size-rotated log file (implies --async_log)')
+@click.option('--boards', '-b', 'boards', type=str, default=None,
+              help='servo boards, ex. "0x40=15,0x41=15,ws://pi2:8880/=15"'
+              ' default: one PCA9685 (0x40, 15ch)')
+@click.option('--endpoint', '-e', 'endpoints', type=str, multiple=True,
+              help='PORT:WAV_MODE, several endpoints in one process'
+              ' (ex. -e 8880:0 -e 8881:1), --port and --wav_mode'
+              ' are ignored')
+@click.option('--snapshot_dir', '-s', 'snapshot_dir',
+              type=click.Path(exists=True), default=DEF_SNAPSHOT_DIR,
+              help='save the state, and resume it at restart,'
+              ' default=$MUSICBOX_SNAPSHOT_DIR (none: disabled)')
+@click.option('--plan_dir', 'plan_dir',
+              type=click.Path(exists=True), default=DEF_PLAN_DIR,
+              help='cache directory of the actuation plans,'
+              ' default=$MUSICBOX_PLAN_DIR (none: no cache)')
+@click.option('--music_dir', 'music_dir',
+              type=click.Path(exists=True), default=DEF_MUSIC_DIR,
+              help='music files of playlist_add must be in it,'
+              ' default=$MUSICBOX_MUSICDATA_DIR (none: not accepted)')
 @click.option('--debug', '-d', 'debug', is_flag=True, default=False,
               help='debug flag')
-def server(port, wav_mode, wavdir, debug):
+def server(port, wav_mode, wavdir, rotation_backend, rotation_tempo,
+           push_budget, actuator_proc, realtime, rt_cpu,
+           coalesce_msec, coalesce_mode, async_log, log_file, boards,
+           endpoints, snapshot_dir, plan_dir, music_dir, debug):
     """ websocket server """
+    if async_log or log_file:
+        start_async_logging(log_file)
+
     log = get_logger(__name__, debug)
 
-    app = WsServerApp(port, wav_mode, wavdir, debug=debug)
+    app = WsServerApp(port, wav_mode, wavdir, rotation_backend,
+                      rotation_tempo, push_budget, actuator_proc,
+                      realtime, rt_cpu, coalesce_msec, coalesce_mode,
+                      boards, endpoints, snapshot_dir, plan_dir,
+                      music_dir, debug=debug)
+    try:
+        app.main()
+    finally:
+        log.debug('finally')
+        app.end()
+        log.info('end (dropped log records: %s)', dropped_count())
+
+
+@cli.command(help="""
+Boot the Music Box: check pigpiod, start the web application and
+the server as supervised children (restarted when they exit),
+and play a chime when the server is ready.
+Stop with SIGTERM or Ctrl-C.
+""")
+@click.option('--endpoint', '-e', 'endpoints', type=str, multiple=True,
+              default=DEF_UP_ENDPOINTS,
+              help='PORT:WAV_MODE of the server, default=%s' % (
+                  ' '.join(DEF_UP_ENDPOINTS)))
+@click.option('--server_args', '-S', 'server_args', type=str, default='',
+              help='other options of the server, ex. "-b 0x40,0x41 -R"')
+@click.option('--web_port', '-W', 'web_port', type=int,
+              default=WebServer.DEF_PORT,
+              help='port number of the web application, default=%s'
+              ' (0: no web application)' % (WebServer.DEF_PORT))
+@click.option('--web_args', 'web_args', type=str, default='',
+              help='other options of the web application')
+@click.option('--chime', '-c', 'chime_port', type=int, default=8882,
+              help='play a chime on this endpoint when ready,'
+              ' default=8882 (0: no chime)')
+@click.option('--no_pigpiod', 'no_pigpiod', is_flag=True, default=False,
+              help="don't check pigpiod (simulation)")
+@click.option('--log_dir', '-L', 'log_dir', type=click.Path(exists=True),
+              default=os.environ.get('MUSICBOX_LOG_DIR'),
+              help='log files of the children, default=$MUSICBOX_LOG_DIR'
+              ' (none: stdout)')
+@click.option('--async_log', '-a', 'async_log', is_flag=True,
+              default=False,
+              help='asynchronous (non-blocking) logging')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def up(endpoints, server_args, web_port, web_args, chime_port, no_pigpiod,
+       log_dir, async_log, debug):
+    """ supervisor """
+    import shlex
+    from .supervisor import Supervisor
+
+    if async_log:
+        start_async_logging()
+        server_args = '-a ' + server_args
+        web_args = '-a ' + web_args
+
+    log = get_logger(__name__, debug)
+
+    app = Supervisor(endpoints, shlex.split(server_args),
+                     web_port or None, shlex.split(web_args),
+                     chime_port or None, not no_pigpiod, log_dir,
+                     debug=debug)
     try:
         app.main()
     finally:
         log.debug('finally')
         app.end()
-        log.info('end')
 
 
 @cli.command(help="""
@@ -810,6 +2372,29 @@ def send(cmd, server_host, server_port, debug):
         log.debug('done')
 
 
+@cli.command(help="""
+Start MUSIC_FILE on several Music Box servers (URL ..) at the same time.
+The first URL is the leader: the others follow its clock.
+""")
+@click.argument('music_file', type=click.Path(exists=True))
+@click.argument('urls', type=str, nargs=-1, required=True)
+@click.option('--delay', '-t', 'delay_sec', type=float, default=2.0,
+              help='start after this (sec), default=2.0')
+@click.option('--repeat', '-r', 'repeat', is_flag=True, default=False,
+              help='repeat the song')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def ensemble(music_file, urls, delay_sec, repeat, debug):
+    """ ensemble """
+    log = get_logger(__name__, debug)
+
+    app = EnsembleApp(music_file, urls, delay_sec, repeat, debug=debug)
+    try:
+        app.main()
+    finally:
+        log.debug('done')
+
+
 @cli.command(help="""
 Web application
 """)
@@ -828,10 +2413,20 @@ Web application
               type=click.Path(exists=True), default=DEF_MUSICDATA_DIR,
               help='parsed files directory, default=%a' % (
                   DEF_MUSICDATA_DIR))
+@click.option('--async_log', '-a', 'async_log', is_flag=True,
+              default=False,
+              help='asynchronous (non-blocking) logging')
+@click.option('--log_file', '-L', 'log_file', type=click.Path(),
+              default=None,
+              help='size-rotated log file (implies --async_log)')
 @click.option('--debug', '-d', 'debug', is_flag=True, default=False,
               help='debug flag')
-def webapp(port, webdir, upload_dir, data_dir, debug):
+def webapp(port, webdir, upload_dir, data_dir, async_log, log_file,
+           debug):
     """ webapp """
+    if async_log or log_file:
+        start_async_logging(log_file)
+
     log = get_logger(__name__, debug)
 
     app = WebServer(port, webdir, upload_dir, data_dir, debug=debug)
@@ -841,5 +2436,323 @@ def webapp(port, webdir, upload_dir, data_dir, debug):
         log.debug('done')
 
 
+@cli.command(help="""
+Fit lead time table of servos from recorded timestamps
+
+TIMESTAMP_FILE: CSV of `ch,cmd_time,strike_time` (sec).
+cmd_time: push command was issued,
+strike_time: the tine sounded (ex. detected from a recording).
+The lead time of each channel is the median of (strike - cmd).
+""")
+@click.argument('timestamp_file', type=click.Path(exists=True))
+@click.option('--conf', '-c', 'conf_file', type=click.Path(),
+              default=Servo.DEF_CONFFILE,
+              help='servo conf file, default=%a' % (Servo.DEF_CONFFILE))
+@click.option('--out', '-o', 'lead_conf_file', type=click.Path(),
+              default=None,
+              help='lead time file, default: next to the servo conf file')
+@click.option('--dry_run', '-n', 'dry_run', is_flag=True, default=False,
+              help="don't save")
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def lead_fit(timestamp_file, conf_file, lead_conf_file, dry_run, debug):
+    """ fit lead time table """
+    log = get_logger(__name__, debug)
+
+    app = LeadFitApp(timestamp_file, conf_file, lead_conf_file,
+                     dry_run=dry_run, debug=debug)
+    try:
+        app.main()
+    finally:
+        log.debug('done')
+
+
+@cli.command(help="""
+Tune push/pull intervals of servos
+
+For each channel, taps REPEAT times with shorter and shorter
+intervals until you answer 'n' (not all taps sounded).
+The shortest reliable intervals (x margin) are saved
+to the servo conf file.
+""")
+@click.option('--channel', '-c', 'channel', type=int, multiple=True,
+              help='channel (multiple), default: all channels')
+@click.option('--conf', '-C', 'conf_file', type=click.Path(),
+              default=Servo.DEF_CONFFILE,
+              help='servo conf file, default=%a' % (Servo.DEF_CONFFILE))
+@click.option('--repeat', '-r', 'repeat', type=int, default=5,
+              help='taps for each candidate, default=5')
+@click.option('--min', '-m', 'min_interval', type=float, default=0.02,
+              help='minimum interval, default=0.02 sec')
+@click.option('--ratio', '-R', 'ratio', type=float, default=0.85,
+              help='interval *= ratio at each step, default=0.85')
+@click.option('--margin', '-M', 'margin', type=float, default=1.1,
+              help='safety margin, default=1.1')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def tune(channel, conf_file, repeat, min_interval, ratio, margin, debug):
+    """ tune push/pull intervals """
+    log = get_logger(__name__, debug)
+
+    app = TuneIntervalApp(channel, conf_file, repeat, min_interval,
+                          ratio, margin, debug=debug)
+    try:
+        app.main()
+    finally:
+        log.debug('finally')
+        app.end()
+        log.info('end')
+
+
+@cli.command(help="""
+Play MUSIC_FILE (MIDI or JSON music data) with the simulation backend
+(no hardware), and check timing, drops and ordering of actuations
+""")
+@click.argument('music_file', type=click.Path(exists=True))
+@click.option('--fast', '-f', 'fast', is_flag=True, default=False,
+              help='as fast as possible (virtual clock)')
+@click.option('--loop', '-n', 'loop', type=int, default=1,
+              help='number of times to play, default=1')
+@click.option('--push_budget', '-B', 'push_budget', type=int,
+              default=Player.PUSH_BUDGET,
+              help='max servos that start a push at once, default=%s' % (
+                  Player.PUSH_BUDGET))
+@click.option('--out', '-o', 'out_file', type=click.Path(), default=None,
+              help='CSV file of actuations')
+@click.option('--next', '-N', 'next_files', type=click.Path(exists=True),
+              multiple=True,
+              help='play after MUSIC_FILE as a gapless playlist')
+@click.option('--tempo', '-t', 'tempo', type=str, default=None,
+              help='playback rate %s .. %s, or "auto"' % (
+                  Player.TEMPO_MIN, Player.TEMPO_MAX))
+@click.option('--boards', '-b', 'boards', type=str, default=None,
+              help='simulated servo boards, ex. "0x40=15,0x41=15"')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def sim(music_file, fast, loop, push_budget, out_file, next_files, tempo,
+        boards, debug):
+    """ simulation """
+    log = get_logger(__name__, debug)
+
+    app = SimApp(music_file, fast, loop, push_budget, out_file,
+                 next_files, tempo, boards, debug=debug)
+    try:
+        ok = app.main()
+    finally:
+        log.debug('finally')
+        app.end()
+
+    sys.exit(0 if ok else 1)
+
+
+@cli.group(help="""
+Benchmarks
+""")
+def bench():
+    """ benchmark command group """
+
+
+@bench.command(help="""
+Startup time of each sub-command
+(`python -X importtime -m musicbox SUBCMD --help` in a fresh interpreter)
+""")
+@click.argument('subcmd', type=str, nargs=-1)
+@click.option('--repeat', '-r', 'repeat', type=int, default=3,
+              help='number of runs, default=3')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def startup(subcmd, repeat, debug):
+    """ startup benchmark """
+    log = get_logger(__name__, debug)
+
+    app = BenchStartupApp(subcmd, repeat, debug=debug)
+    try:
+        app.main()
+    finally:
+        log.debug('done')
+
+
+@bench.command(help="""
+CPU usage of rotation motor backends (StepMtrTh vs pigpio waveform)
+""")
+@click.argument('pins', type=int, nargs=4,
+                default=Player.ROTATION_GPIO)
+@click.option('--speed', '-s', 'speed', type=int, default=10,
+              help='rotation speed, default=10')
+@click.option('--sec', '-t', 'sec', type=float, default=10.0,
+              help='measuring time of each backend, default=10 sec')
+@click.option('--rotation_backend', '-r', 'rotation_backend',
+              type=click.Choice(ROTATION_BACKENDS), multiple=True,
+              help='backend to measure, default=all')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def rotation(pins, speed, sec, rotation_backend, debug):
+    """ rotation motor benchmark """
+    log = get_logger(__name__, debug)
+
+    app = BenchRotationApp(pins, speed, sec, rotation_backend,
+                           debug=debug)
+    try:
+        app.main()
+    finally:
+        log.debug('done')
+
+
+@bench.command(help="""
+Simulate an acceleration ramp of the rotation motor
+and check the step timing
+""")
+@click.argument('speed1', type=float)
+@click.argument('speed2', type=float)
+@click.option('--accel', '-a', 'accel', type=float,
+              default=MotionProfile.DEF_ACCEL,
+              help='acceleration, default=%s steps/sec^2' % (
+                  MotionProfile.DEF_ACCEL))
+@click.option('--decel', '-D', 'decel', type=float,
+              default=MotionProfile.DEF_DECEL,
+              help='deceleration, default=%s steps/sec^2' % (
+                  MotionProfile.DEF_DECEL))
+@click.option('--start_rate', '-s', 'start_rate', type=float,
+              default=MotionProfile.DEF_START_RATE,
+              help='start/stop rate, default=%s steps/sec' % (
+                  MotionProfile.DEF_START_RATE))
+@click.option('--curve', '-c', 'curve',
+              type=click.Choice(list(MotionProfile.CURVE.keys())),
+              default=MotionProfile.DEF_CURVE,
+              help='curve, default=%a' % (MotionProfile.DEF_CURVE))
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def motion(speed1, speed2, accel, decel, start_rate, curve, debug):
+    """ motion profile simulation """
+    log = get_logger(__name__, debug)
+
+    app = BenchMotionApp(speed1, speed2, accel, decel, start_rate, curve,
+                         debug=debug)
+    try:
+        ok = app.main()
+    finally:
+        log.debug('done')
+
+    sys.exit(0 if ok else 1)
+
+
+@bench.command(help="""
+Compile an actuation plan of MUSIC_FILE (MIDI or JSON music data)
+with default servo parameters, and save it next to MUSIC_FILE
+""")
+@click.argument('music_file', type=click.Path(exists=True))
+@click.option('--push_budget', '-B', 'push_budget', type=int,
+              default=Player.PUSH_BUDGET,
+              help='max servos that start a push at once, default=%s' % (
+                  Player.PUSH_BUDGET))
+@click.option('--lead', '-l', 'lead_conf_file',
+              type=click.Path(exists=True), default=None,
+              help='lead time file')
+@click.option('--coalesce', '-C', 'coalesce_msec', type=float, default=0,
+              help='merge notes within this window (msec), default=0')
+@click.option('--coalesce_mode', 'coalesce_mode',
+              type=click.Choice(COALESCE_MODES), default='first',
+              help="time of a merged chord, default='first'")
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def plan(music_file, push_budget, lead_conf_file, coalesce_msec,
+         coalesce_mode, debug):
+    """ actuation plan """
+    log = get_logger(__name__, debug)
+
+    app = BenchPlanApp(music_file, push_budget, lead_conf_file,
+                       coalesce_msec, coalesce_mode, debug=debug)
+    try:
+        app.main()
+    finally:
+        log.debug('done')
+
+
+@bench.command(help="""
+Play MUSIC_FILE (MIDI or JSON music data) through a local pigpiod
+stand-in, and count commands per note and round-trip latency
+""")
+@click.argument('music_file', type=click.Path(exists=True))
+@click.option('--push_budget', '-B', 'push_budget', type=int,
+              default=Player.PUSH_BUDGET,
+              help='max servos that start a push at once, default=%s' % (
+                  Player.PUSH_BUDGET))
+@click.option('--conf', '-c', 'conf_file', type=click.Path(exists=True),
+              default=Servo.DEF_CONFFILE,
+              help='servo conf file, default=%s' % (Servo.DEF_CONFFILE))
+@click.option('--rotation_backend', '-r', 'rotation_backend',
+              type=click.Choice(ROTATION_BACKENDS), default=None,
+              help='also measure the rotation motor')
+@click.option('--sec', '-t', 'rotation_sec', type=float, default=5.0,
+              help='rotation motor measurement time, default=5.0 sec')
+@click.option('--rtt', '-n', 'rtt_n', type=int, default=1000,
+              help='number of round-trips, default=1000')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def pigpiod(music_file, push_budget, conf_file, rotation_backend,
+            rotation_sec, rtt_n, debug):
+    """ pigpiod traffic """
+    log = get_logger(__name__, debug)
+
+    app = BenchPigpiodApp(music_file, push_budget, conf_file,
+                          rotation_backend, rotation_sec, rtt_n,
+                          debug=debug)
+    try:
+        app.main()
+    finally:
+        log.debug('finally')
+        app.end()
+
+
+@bench.command(help="""
+Load time and peak memory of MUSIC_FILE (MIDI or JSON music data):
+deepcopy (old music_load) vs frozen Song vs reference (copy=False)
+""")
+@click.argument('music_file', type=click.Path(exists=True))
+@click.option('--entries', '-n', 'entries', type=int, default=50000,
+              help='repeat the song up to this number of entries,'
+              ' default=50000')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def load(music_file, entries, debug):
+    """ music_load """
+    log = get_logger(__name__, debug)
+
+    app = BenchLoadApp(music_file, entries, debug=debug)
+    try:
+        app.main()
+    finally:
+        log.debug('done')
+
+
+@bench.command(help="""
+Stream notes with random network jitter to a simulated server
+(started as a child process), and show the jitter buffer statistics
+""")
+@click.option('--port', '-p', 'port', type=int, default=18880,
+              help='port number of the server, default=18880')
+@click.option('--notes', '-n', 'note_n', type=int, default=200,
+              help='number of notes, default=200')
+@click.option('--nps', 'nps', type=float, default=8.0,
+              help='notes per second, default=8.0')
+@click.option('--jitter', '-j', 'jitter_msec', type=float, default=30.0,
+              help='network jitter (msec), default=30.0')
+@click.option('--batch', '-b', 'batch', type=int, default=1,
+              help='notes per batch, default=1')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def stream(port, note_n, nps, jitter_msec, batch, debug):
+    """ live streaming """
+    log = get_logger(__name__, debug)
+
+    app = BenchStreamApp(port, note_n, nps, jitter_msec, batch,
+                         debug=debug)
+    try:
+        app.main()
+    finally:
+        log.debug('finally')
+        app.end()
+
+
 if __name__ == '__main__':
     cli(prog_name='MusicBox')
@@ -0,0 +1,494 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Actuation process
+
+The servo writes and their scheduler run in a dedicated child process,
+so that the websocket server (JSON decoding, etc.) in the parent process
+never delays a note (no GIL contention).
+
+```
+ parent (Player, WsServer)           child (Servo)
+ -------------------------           -------------
+   cmd ring    --[t, op, ch]-->       heap of events -> set_pw1()
+   wake (semaphore) ----------->      sleeps until the next event
+                                      or the next command
+   status ring <--[t, kind, a, b]--   lateness, ready, ..
+```
+
+Commands are timestamped (``time.monotonic()``, same clock on both sides),
+and sent ahead of time (``ActuatorProcess.LOOKAHEAD_SEC``).
+Taps (``OP_TAP``) are scheduled in the child as ``Servo.tap_at()`` does:
+the pushes of a chord are staggered within the power budget
+(``Servo.stagger()``), and a tap of a busy servo is queued
+after its current stroke (or dropped, if late more than ``retrigger_tol``).
+
+The child is started by ``spawn`` (not ``fork``):
+the parent has threads (ex. the log listener) when it starts the child.
+The child logs to stderr.
+
+### ShmRing
+
+Lock-free single-producer single-consumer ring buffer
+on ``multiprocessing.shared_memory``.
+Only the producer writes ``head``, only the consumer writes ``tail``.
+Both are 32bit counters (a 32bit aligned store is atomic also on ARM32).
+In the parent, several threads send commands and read the status:
+``ActuatorProcess`` serializes them with a lock per ring.
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import os
+import time
+import heapq
+import struct
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from .my_logger import get_logger
+
+# commands
+OP_PULL = 0
+OP_PUSH = 1
+OP_TAP = 2       # push and pull (after push interval)
+OP_CLEAR = 3     # cancel all pending events and pull all
+OP_RELOAD = 4    # reload servo conf file
+OP_QUIT = 5
+
+# status
+ST_READY = 0     # a: servo_n
+ST_DONE = 1      # a: ch, b: lateness (usec)
+ST_STOPPED = 2
+ST_RETRIGGERED = 3  # a: ch, b: late (usec)
+ST_DROPPED = 4      # a: ch
+ST_STAGGERED = 5    # a: number of staggered pushes, b: max stagger (usec)
+
+
+class ShmRing:
+    """
+    SPSC ring buffer of fixed size records (float, int, int)
+
+    Attributes
+    ----------
+    name: str
+        name of the shared memory
+    size: int
+        number of records
+    """
+    COUNTER = struct.Struct('<I')
+    RECORD = struct.Struct('<dii')
+
+    HEAD_OFFSET = 0
+    TAIL_OFFSET = 64     # another cache line
+    DATA_OFFSET = 128
+
+    MASK = 0xffffffff
+
+    DEF_SIZE = 4096
+
+    def __init__(self, name=None, size=DEF_SIZE):
+        """ Constructor
+
+        Parameters
+        ----------
+        name: str
+            None: create new shared memory
+        size: int
+            number of records (power of 2), ignored when attaching
+        """
+        if name is None:
+            if size & (size - 1):
+                raise ValueError('size must be power of 2: %s' % (size))
+
+            self._shm = shared_memory.SharedMemory(
+                create=True,
+                size=self.DATA_OFFSET + size * self.RECORD.size)
+            self._owner = True
+            self._shm.buf[:self.DATA_OFFSET] = bytes(self.DATA_OFFSET)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+
+        self.name = self._shm.name
+        self.size = (self._shm.size - self.DATA_OFFSET) // self.RECORD.size
+        # the OS may round up the shared memory size
+        self.size = 1 << (self.size.bit_length() - 1)
+
+        self._buf = self._shm.buf
+
+    def _head(self):
+        return self.COUNTER.unpack_from(self._buf, self.HEAD_OFFSET)[0]
+
+    def _tail(self):
+        return self.COUNTER.unpack_from(self._buf, self.TAIL_OFFSET)[0]
+
+    def __len__(self):
+        return (self._head() - self._tail()) & self.MASK
+
+    def put(self, t, a, b):
+        """ producer side
+
+        Parameters
+        ----------
+        t: float
+        a, b: int
+
+        Returns
+        -------
+        result: bool
+            False: full
+        """
+        head = self._head()
+        if (head - self._tail()) & self.MASK >= self.size:
+            return False
+
+        self.RECORD.pack_into(
+            self._buf,
+            self.DATA_OFFSET + (head % self.size) * self.RECORD.size,
+            t, a, b)
+        self.COUNTER.pack_into(self._buf, self.HEAD_OFFSET,
+                               (head + 1) & self.MASK)
+        return True
+
+    def get(self):
+        """ consumer side
+
+        Returns
+        -------
+        record: (float, int, int) or None
+            None: empty
+        """
+        tail = self._tail()
+        if tail == self._head():
+            return None
+
+        rec = self.RECORD.unpack_from(
+            self._buf,
+            self.DATA_OFFSET + (tail % self.size) * self.RECORD.size)
+        self.COUNTER.pack_into(self._buf, self.TAIL_OFFSET,
+                               (tail + 1) & self.MASK)
+        return rec
+
+    def close(self):
+        """ close (and unlink, if owner) """
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class ActuatorProcess:
+    """
+    Actuator child process (parent side)
+
+    Attributes
+    ----------
+    metrics: dict
+        events: number of executed events
+        late_max, late_mean: lateness (sec)
+        overflow: number of commands lost (cmd ring was full)
+        ready: child process is ready
+        retriggered, dropped: taps of busy servos (queued, dropped)
+        staggered_pushes: pushes of taps delayed by the power budget
+    """
+    LOOKAHEAD_SEC = 0.5
+    IDLE_SEC = 1.0        # the child checks the parent, when idle
+    START_TIMEOUT = 10.0  # sec
+
+    def __init__(self, servo_kw={}, ring_size=ShmRing.DEF_SIZE,
+                 rt_kw=None, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        servo_kw: dict
+            keyword arguments of ``Servo()`` in the child process
+        ring_size: int
+        rt_kw: dict
+            keyword arguments of ``rt.set_realtime()`` in the child process
+            None: not realtime
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('servo_kw=%s', servo_kw)
+
+        self._cmd = ShmRing(size=ring_size)
+        self._status = ShmRing(size=ring_size)
+
+        self.metrics = {
+            'events': 0,
+            'late_max': 0.0,
+            'late_mean': 0.0,
+            'overflow': 0,
+            'ready': False,
+            'retriggered': 0,
+            'dropped': 0,
+            'staggered_pushes': 0,
+        }
+        self._late_sum = 0.0
+
+        # several threads send commands (music thread, websocket handler)
+        self._cmd_lock = threading.Lock()
+        self._status_lock = threading.Lock()
+
+        ctx = multiprocessing.get_context('spawn')
+        self._wake = ctx.Semaphore(0)
+        self._proc = ctx.Process(target=actuator_main,
+                                 args=(self._cmd.name, self._status.name,
+                                       self._wake, servo_kw, rt_kw,
+                                       os.getpid(), self._dbg),
+                                 daemon=True)
+        self._proc.start()
+        self._log.info('pid=%s', self._proc.pid)
+
+    def wait_ready(self, timeout=START_TIMEOUT):
+        """
+        Returns
+        -------
+        ready: bool
+        """
+        end_time = time.monotonic() + timeout
+        while time.monotonic() < end_time:
+            self.poll_status()
+            if self.metrics['ready']:
+                return True
+            if not self._proc.is_alive():
+                break
+            time.sleep(0.01)
+
+        self._log.error('actuator process is not ready')
+        return False
+
+    def send(self, t, op, ch=0):
+        """
+        Parameters
+        ----------
+        t: float
+            ``time.monotonic()``
+        op: int
+            OP_*
+        ch: int
+        """
+        with self._cmd_lock:
+            if not self._cmd.put(t, op, ch):
+                self.metrics['overflow'] += 1
+                return
+
+        self._wake.release()
+
+    def poll_status(self):
+        """ read status ring and update ``metrics`` """
+        with self._status_lock:
+            while True:
+                rec = self._status.get()
+                if rec is None:
+                    break
+
+                t, b = rec[0], rec[2]
+                a, kind = divmod(rec[1], 0x100)
+                if kind == ST_DONE:
+                    late = b / 1000000
+                    self.metrics['events'] += 1
+                    self._late_sum += late
+                    self.metrics['late_max'] = max(
+                        self.metrics['late_max'], late)
+                    self.metrics['late_mean'] = (self._late_sum
+                                                 / self.metrics['events'])
+                elif kind == ST_RETRIGGERED:
+                    self.metrics['retriggered'] += 1
+                elif kind == ST_DROPPED:
+                    self.metrics['dropped'] += 1
+                elif kind == ST_STAGGERED:
+                    self.metrics['staggered_pushes'] += a
+                elif kind == ST_READY:
+                    self.metrics['ready'] = True
+                elif kind == ST_STOPPED:
+                    self.metrics['ready'] = False
+
+            return self.metrics
+
+    def end(self):
+        """ stop the child process """
+        self._log.debug('')
+
+        self.send(time.monotonic(), OP_QUIT)
+        self._proc.join(timeout=3)
+        if self._proc.is_alive():
+            self._log.warning('terminate')
+            self._proc.terminate()
+            self._proc.join()
+
+        self.poll_status()
+        self._cmd.close()
+        self._status.close()
+        self._log.debug('done')
+
+
+def _status_put(ring, t, kind, a=0, b=0):
+    """ status record: (t, a << 8 | kind, b) """
+    ring.put(t, (a << 8) | kind, b)
+
+
+def actuator_main(cmd_name, status_name, wake, servo_kw, rt_kw=None,
+                  parent_pid=None, debug=False):
+    """
+    child process main
+
+    Parameters
+    ----------
+    cmd_name, status_name: str
+        name of shared memory
+    wake: multiprocessing.Semaphore
+        released by the parent for each command
+    servo_kw: dict
+    rt_kw: dict
+    parent_pid: int
+        end, if the parent is gone
+    """
+    from .servo import Servo
+    from .rt import set_realtime, lock_memory
+
+    log = get_logger('actuator_main', debug)
+
+    if rt_kw is not None:
+        lock_memory()
+        set_realtime(**rt_kw)
+
+    cmd = ShmRing(cmd_name)
+    status = ShmRing(status_name)
+
+    servo = Servo(**servo_kw, debug=debug)
+    set_pw1 = servo._dev.set_pw1
+    monotonic = time.monotonic
+    idle_sec = ActuatorProcess.IDLE_SEC
+
+    heap = []
+    seq = 0
+    pushed = set()
+    free_time = [0.0] * servo.servo_n  # busy servos (taps)
+
+    def tap_chord(push_list):
+        """ schedule the taps of a chord (as ``Servo.tap_at()``) """
+        nonlocal seq
+
+        staggered = servo._staggered_pushes
+        push_list = servo.stagger(push_list)
+        if servo._staggered_pushes > staggered:
+            _status_put(status, monotonic(), ST_STAGGERED,
+                        servo._staggered_pushes - staggered,
+                        int(servo._max_stagger * 1000000))
+
+        for ch, push_time in push_list:
+            # busy or not: at the push time (``tap_push()``)
+            heapq.heappush(heap, (push_time, seq, OP_TAP, ch))
+            seq += 1
+
+    def tap_push(ch, now):
+        """ push of a tap (as ``Servo.tap1()``)
+
+        Returns
+        -------
+        pushed: bool
+            False: queued after the current stroke, or dropped
+        """
+        nonlocal seq
+
+        if now < free_time[ch]:
+            late = free_time[ch] - now
+            if late > servo.retrigger_tol:
+                _status_put(status, now, ST_DROPPED, ch)
+                return False
+
+            _status_put(status, now, ST_RETRIGGERED, ch,
+                        int(late * 1000000))
+            heapq.heappush(heap, (free_time[ch], seq, OP_TAP, ch))
+            seq += 1
+            return False
+
+        pull_time = now + servo._push_interval[ch]
+        free_time[ch] = pull_time + servo._pull_interval[ch]
+        heapq.heappush(heap, (pull_time, seq, OP_PULL, ch))
+        seq += 1
+        return True
+
+    _status_put(status, monotonic(), ST_READY, servo.servo_n)
+    log.info('ready: servo_n=%s', servo.servo_n)
+
+    active = True
+    while active:
+        # commands
+        chord = []     # taps of the same strike time
+        chord_t = None
+        while True:
+            rec = cmd.get()
+            if rec is None:
+                break
+
+            t, op, ch = rec
+            if chord and (op != OP_TAP or t != chord_t):
+                tap_chord(chord)
+                chord = []
+
+            if op in (OP_PUSH, OP_PULL):
+                heapq.heappush(heap, (t, seq, op, ch))
+                seq += 1
+            elif op == OP_TAP:
+                chord.append((ch, t - servo.lead[ch]))
+                chord_t = t
+            elif op == OP_CLEAR:
+                heap = []
+                now = monotonic()
+                free_time = [0.0] * servo.servo_n
+                for ch in pushed:
+                    set_pw1(ch, servo._off[ch])
+                    free_time[ch] = now + servo._pull_interval[ch]
+                pushed = set()
+            elif op == OP_RELOAD:
+                servo.load_conf(servo.conf_file)
+            elif op == OP_QUIT:
+                active = False
+                break
+
+        if chord:
+            tap_chord(chord)
+
+        # events
+        now = monotonic()
+        while heap and heap[0][0] <= now:
+            t, _, op, ch = heapq.heappop(heap)
+            if op == OP_TAP:
+                if not tap_push(ch, now):
+                    continue
+                set_pw1(ch, servo._on[ch])
+                pushed.add(ch)
+            elif op == OP_PUSH:
+                set_pw1(ch, servo._on[ch])
+                pushed.add(ch)
+            else:
+                set_pw1(ch, servo._off[ch])
+                pushed.discard(ch)
+
+            now = monotonic()
+            _status_put(status, now, ST_DONE, ch, int((now - t) * 1000000))
+
+        if not active:
+            break
+
+        # sleep until the next event, or the next command
+        if heap:
+            wake.acquire(timeout=max(heap[0][0] - monotonic(), 0))
+        elif not wake.acquire(timeout=idle_sec):
+            if parent_pid is not None and os.getppid() != parent_pid:
+                log.warning('parent process is gone')
+                active = False
+
+    for ch in pushed:
+        set_pw1(ch, servo._off[ch])
+
+    _status_put(status, monotonic(), ST_STOPPED)
+    servo.end()
+    cmd.close()
+    status.close()
+    log.info('done')
@@ -0,0 +1,379 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Channel map: one logical channel space over several boards
+
+A 30 or 45 note Music Box is built from several PCA9685 boards
+(different I2C addresses), or from several Raspberry Pis
+(remote nodes: ``MusicBox server`` on the other Pi).
+
+```
+boards spec: "0x40=15,0x41=15,ws://pi2:8880/=15"
+
+ logical ch   board                local ch
+ ----------   ------------------   --------
+  0 .. 14     PCA9685 0x40          0 .. 14
+ 15 .. 29     PCA9685 0x41          0 .. 14
+ 30 .. 44     ws://pi2:8880/        0 .. 14
+```
+
+``BoardGroup`` has the same interface as one device (``set_pw1()``),
+so ``Servo`` works as before, with ``servo_n`` = total number of channels.
+The conf file and the lead time file are of the logical channels.
+
+Writes are batched per board (``set_pw()``).
+A remote board sends its writes in one message
+(``{"cmd": "servo_pw", "pw": [[ch, pw], ..]}``);
+the writes requested while the previous message is being sent
+go together in the next one.
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import time
+import threading
+from .my_logger import get_logger
+
+DEF_BOARD_CH_N = 15
+
+
+def parse_boards(spec, ch_n=DEF_BOARD_CH_N):
+    """
+    Parameters
+    ----------
+    spec: str or list of (addr, ch_n)
+        "0x40=15,0x41=15,ws://pi2:8880/=15"
+        the number of channels can be omitted (``ch_n``)
+    ch_n: int
+        default number of channels of a board
+
+    Returns
+    -------
+    boards: list of (addr, ch_n)
+        addr: int (I2C address) or str (URL of a remote node)
+    """
+    if not isinstance(spec, str):
+        return [(addr, int(n)) for addr, n in spec]
+
+    boards = []
+    for item in spec.replace(' ', '').split(','):
+        if not item:
+            continue
+
+        addr, _, n = item.partition('=')
+        if '://' not in addr:
+            addr = int(addr, 0)
+
+        boards.append((addr, int(n) if n else ch_n))
+
+    if not boards:
+        raise ValueError('no boards: %a' % (spec))
+
+    return boards
+
+
+class ChannelMap:
+    """
+    logical channel <-> (board, local channel)
+
+    Attributes
+    ----------
+    boards: list of (addr, ch_n)
+    base: list of int
+        first logical channel of each board
+    ch_n: int
+        total number of channels
+    """
+    def __init__(self, boards):
+        """ Constructor
+
+        Parameters
+        ----------
+        boards: str or list of (addr, ch_n)
+            see ``parse_boards()``
+        """
+        self.boards = parse_boards(boards)
+
+        self.base = []
+        self._loc = []
+        for b, (addr, n) in enumerate(self.boards):
+            self.base.append(len(self._loc))
+            self._loc += [(b, ch) for ch in range(n)]
+
+        self.ch_n = len(self._loc)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ','.join(
+            ['%s=%s' % (self.addr_str(a), n) for a, n in self.boards]))
+
+    @staticmethod
+    def addr_str(addr):
+        return addr if isinstance(addr, str) else '0x%02x' % (addr)
+
+    def locate(self, ch):
+        """
+        Parameters
+        ----------
+        ch: int
+            logical channel
+
+        Returns
+        -------
+        (board, local_ch): (int, int)
+        """
+        return self._loc[ch]
+
+    def split(self, writes):
+        """ group writes by board
+
+        Parameters
+        ----------
+        writes: list of (ch, pw)
+            logical channels
+
+        Returns
+        -------
+        batches: dict
+            board -> list of (local_ch, pw) .. in the original order
+        """
+        batches = {}
+        for ch, pw in writes:
+            b, local_ch = self._loc[ch]
+            batches.setdefault(b, []).append((local_ch, pw))
+
+        return batches
+
+
+class RemoteBoard:
+    """
+    servo channels of a remote node (device interface)
+
+    Writes are sent by a thread; the writes that are queued
+    while a message is being sent go together in the next message.
+    """
+    def __init__(self, url, ch_n, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        url: str
+            ``MusicBox server`` on the remote node
+        ch_n: int
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('url=%s, ch_n=%s', url, ch_n)
+
+        from .wsclient import WsStreamClient
+
+        self.url = url
+        self.ch_n = ch_n
+        self._client = WsStreamClient(url, debug=self._dbg)
+
+        self._pending = []
+        self._queued_at = None
+        self._cond = threading.Condition()
+        self._active = True
+        self.messages = 0
+        self.max_queue_sec = 0.0
+        self.errors = 0
+
+        self._th = threading.Thread(target=self._send_th, daemon=True)
+        self._th.start()
+
+    def set_pw1(self, ch, pw):
+        self.set_pw([(ch, pw)])
+
+    def set_pw(self, writes):
+        """
+        Parameters
+        ----------
+        writes: list of (ch, pw)
+        """
+        with self._cond:
+            if not self._pending:
+                self._queued_at = time.monotonic()
+            self._pending += writes
+            self._cond.notify()
+
+    def _send_th(self):
+        from websocket import WebSocketException
+
+        while True:
+            with self._cond:
+                while self._active and not self._pending:
+                    self._cond.wait()
+                if not self._pending:
+                    break
+
+                writes, self._pending = self._pending, []
+                queue_sec = time.monotonic() - self._queued_at
+
+            self.max_queue_sec = max(self.max_queue_sec, queue_sec)
+            try:
+                self._client.send({'cmd': 'servo_pw',
+                                   'pw': [list(w) for w in writes]})
+                self.messages += 1
+            except (OSError, WebSocketException) as ex:
+                self.errors += 1
+                self._log.error('%s: %s: %s', self.url, type(ex).__name__,
+                                ex)
+
+    def end(self):
+        """ send the pending writes, and close """
+        self._log.debug('')
+
+        with self._cond:
+            self._active = False
+            self._cond.notify()
+        self._th.join()
+        self._client.close()
+
+
+class BoardGroup:
+    """
+    several boards as one device (``servoPCA9685.Servo`` interface)
+
+    ```python3
+    cmap = ChannelMap('0x40=15,0x41=15')
+    dev = BoardGroup(cmap, open_board)
+    dev.set_pw1(20, 1500)            # board 0x41, ch 5
+    dev.set_pw([(3, 1500), (20, 1000)])  # one batch per board
+    dev.stats()
+    ```
+    """
+    def __init__(self, channel_map, open_board, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        channel_map: ChannelMap
+        open_board: function(addr, ch_n) -> device
+            for I2C boards (remote boards: ``RemoteBoard``)
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('channel_map=%s', channel_map)
+
+        self.channel_map = channel_map
+        self._locate = channel_map.locate
+
+        self.devs = []
+        for addr, n in channel_map.boards:
+            if isinstance(addr, str):
+                self.devs.append(RemoteBoard(addr, n, debug=self._dbg))
+            else:
+                self.devs.append(open_board(addr, n))
+
+        self._lock = [threading.Lock() for _ in self.devs]
+        self.reset_stats()
+
+    def set_pw1(self, ch, pw):
+        """
+        Parameters
+        ----------
+        ch: int
+            logical channel
+        pw: int
+        """
+        b, local_ch = self._locate(ch)
+        t0 = time.perf_counter()
+        with self._lock[b]:
+            self.devs[b].set_pw1(local_ch, pw)
+        self._count(b, 1, time.perf_counter() - t0)
+
+    def set_pw(self, writes):
+        """ write to each board in one batch
+
+        Parameters
+        ----------
+        writes: list of (ch, pw)
+            logical channels
+        """
+        for b, batch in self.channel_map.split(writes).items():
+            dev = self.devs[b]
+            t0 = time.perf_counter()
+            with self._lock[b]:
+                if hasattr(dev, 'set_pw'):
+                    dev.set_pw(batch)
+                else:
+                    for local_ch, pw in batch:
+                        dev.set_pw1(local_ch, pw)
+            self._count(b, len(batch), time.perf_counter() - t0)
+
+    def _count(self, b, n, sec):
+        st = self._stat[b]
+        st['writes'] += n
+        st['batches'] += 1
+        st['max_batch'] = max(st['max_batch'], n)
+        st['write_sec'] += sec
+        st['max_write_sec'] = max(st['max_write_sec'], sec)
+
+    def reset_stats(self):
+        """ reset per board statistics """
+        self._stat = [{'writes': 0, 'batches': 0, 'max_batch': 0,
+                       'write_sec': 0.0, 'max_write_sec': 0.0}
+                      for _ in self.devs]
+
+    def stats(self):
+        """
+        Returns
+        -------
+        stats: list of dict (per board)
+            addr, ch: [first, last] logical channel,
+            writes, batches, max_batch,
+            write_usec: mean and max time of a batch (local call),
+            messages, max_queue_msec, errors: remote boards only
+        """
+        out = []
+        for b, (addr, n) in enumerate(self.channel_map.boards):
+            st = self._stat[b]
+            base = self.channel_map.base[b]
+            ent = {
+                'addr': self.channel_map.addr_str(addr),
+                'ch': [base, base + n - 1],
+                'writes': st['writes'],
+                'batches': st['batches'],
+                'max_batch': st['max_batch'],
+                'write_usec': {
+                    'mean': round(st['write_sec'] / max(st['batches'], 1)
+                                  * 1000000, 1),
+                    'max': round(st['max_write_sec'] * 1000000, 1),
+                },
+            }
+
+            dev = self.devs[b]
+            if isinstance(dev, RemoteBoard):
+                ent['messages'] = dev.messages
+                ent['max_queue_msec'] = round(dev.max_queue_sec * 1000, 3)
+                ent['errors'] = dev.errors
+
+            out.append(ent)
+
+        return out
+
+    @property
+    def log(self):
+        """ writes of simulated boards (``SimDevice.log``)
+
+        Returns
+        -------
+        log: list of (t, ch, pw)
+            logical channels, sorted by time
+        """
+        log = []
+        for b, dev in enumerate(self.devs):
+            base = self.channel_map.base[b]
+            if hasattr(dev, 'log'):
+                log += [(t, base + ch, pw) for t, ch, pw in dev.log]
+        return sorted(log, key=lambda w: w[0])
+
+    def clear_log(self):
+        for dev in self.devs:
+            if hasattr(dev, 'clear_log'):
+                dev.clear_log()
+
+    def end(self):
+        for dev in self.devs:
+            dev.end()
@@ -0,0 +1,113 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Clocks for the timing logic
+
+``Player`` and ``Servo`` take a clock object,
+and call ``clock.monotonic()`` and ``clock.sleep()``
+instead of ``time.monotonic()`` and ``time.sleep()``.
+``clock.wait(event, sec)`` is a sleep that is cut short by
+``event.set()`` (cooperative cancellation at the end).
+
+```python3
+clock = RealClock()             # default
+clock = SimClock(realtime=True) # real time, starts from 0.0
+clock = SimClock()              # virtual time: sleep() returns at once
+```
+
+``SimClock(realtime=False)`` is for one timing thread
+(ex. the actuation plan executor): ``sleep()`` just advances the time.
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import time
+import threading
+
+
+class RealClock:
+    """ time.monotonic() and time.sleep() """
+    realtime = True
+
+    monotonic = staticmethod(time.monotonic)
+    sleep = staticmethod(time.sleep)
+
+    @staticmethod
+    def wait(event, sec):
+        """
+        sleep ``sec``, or until ``event`` is set
+
+        Returns
+        -------
+        canceled: bool
+            True: ``event`` is set
+        """
+        return event.wait(sec)
+
+
+class SimClock:
+    """
+    Clock for simulation
+
+    Attributes
+    ----------
+    realtime: bool
+        True: real time, False: as fast as possible
+    """
+    def __init__(self, realtime=False, start=0.0):
+        """ Constructor
+
+        Parameters
+        ----------
+        realtime: bool
+        start: float
+            time at the beginning (sec)
+        """
+        self.realtime = realtime
+
+        self._start = start
+        self._now = start
+        self._t0 = time.monotonic()
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        """
+        Returns
+        -------
+        now: float
+            sec
+        """
+        if self.realtime:
+            return self._start + time.monotonic() - self._t0
+
+        return self._now
+
+    def sleep(self, sec):
+        """
+        Parameters
+        ----------
+        sec: float
+        """
+        if self.realtime:
+            time.sleep(sec)
+            return
+
+        if sec > 0:
+            with self._lock:
+                self._now += sec
+
+    def wait(self, event, sec):
+        """
+        sleep ``sec``, or until ``event`` is set (real time only)
+
+        Returns
+        -------
+        canceled: bool
+            True: ``event`` is set
+        """
+        if self.realtime:
+            return event.wait(sec)
+
+        self.sleep(sec)
+        return event.is_set()
@@ -0,0 +1,209 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Clock-synchronized playback across Music Box servers
+
+One server is the leader (the reference clock).
+The others measure the offset of their clock to the leader
+in the NTP style (``stream_sync``: the probe with the smallest
+round trip time of a burst), start the music at the agreed time
+of the leader's clock, and keep measuring during the song:
+the change of the offset (drift) is given to ``Player.adjust_clock()``.
+
+```
+{"cmd": "ensemble_start",
+ "leader": "ws://box1:8880/",    # null: this server is the leader
+ "start": 12345.678,             # leader's clock (sec)
+ "music_data": [..]}             # (optional) else the loaded music
+```
+
+``MusicBox ensemble MUSIC_FILE URL1 URL2 ..`` sends this to every server
+(URL1 is the leader).
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import threading
+from websocket import WebSocketException
+from .my_logger import get_logger
+
+SYNC_ERRORS = (OSError, ValueError, KeyError, WebSocketException)
+
+
+class ClockSync:
+    """
+    Clock offset to the leader (NTP style)
+
+    Attributes
+    ----------
+    offset: float
+        leader's clock - local clock (sec)
+    rtt: float
+        round trip time of the best probe (sec)
+    """
+    PROBE_N = 8
+
+    def __init__(self, leader_url, clock, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        leader_url: str
+        clock: RealClock or SimClock
+            local clock
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('leader_url=%s', leader_url)
+
+        from .wsclient import WsStreamClient
+
+        self._client = WsStreamClient(leader_url, clock=clock.monotonic,
+                                      debug=self._dbg)
+        self.offset = None
+        self.rtt = None
+
+    def close(self):
+        """ close the connection """
+        self._client.close()
+
+    def measure(self, probe_n=PROBE_N):
+        """
+        Returns
+        -------
+        offset: float
+        rtt: float
+        """
+        probes = [self._client.sync() for _ in range(probe_n)]
+        self.offset, self.rtt = min(probes, key=lambda p: p[1])
+
+        self._log.debug('offset=%.6f, rtt=%.6f', self.offset, self.rtt)
+        return self.offset, self.rtt
+
+
+class Ensemble:
+    """
+    Start the music at the leader's time, and follow the leader's clock
+    """
+    SYNC_INTERVAL = 5.0  # sec
+
+    def __init__(self, player, leader_url, start, repeat=False,
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        player: Player
+            music is loaded
+        leader_url: str
+            None: this server is the leader
+        start: float
+            leader's clock
+        repeat: bool
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('leader_url=%s, start=%s', leader_url, start)
+
+        self._player = player
+        self._clock = player.clock()
+        self._leader_url = leader_url
+        self._start = start
+        self._repeat = repeat
+
+        self._sync = None
+        self._active = True
+        self._wakeup = threading.Event()
+        self._stat = {
+            'leader': leader_url,
+            'start': start,
+            'local_start': None,
+            'offset': 0.0,
+            'rtt': 0.0,
+            'syncs': 0,
+            'corrections': 0,
+            'drift_msec': 0.0,
+            'error': None,
+        }
+
+        self._th = threading.Thread(target=self._th_func, daemon=True)
+        self._th.start()
+
+    def end(self):
+        """ stop following the leader (the music goes on) """
+        self._log.debug('')
+
+        self._active = False
+        self._wakeup.set()
+        self._th.join()
+
+    def status(self):
+        """
+        Returns
+        -------
+        status: dict
+            leader, start, local_start, offset, rtt, syncs,
+            corrections, drift_msec (total), error
+        """
+        return dict(self._stat)
+
+    def _th_func(self):
+        offset = 0.0
+        if self._leader_url is not None:
+            try:
+                self._sync = ClockSync(self._leader_url, self._clock,
+                                       debug=self._dbg)
+                offset, rtt = self._sync.measure()
+            except SYNC_ERRORS as ex:
+                self._stat['error'] = '%s: %s' % (type(ex).__name__, ex)
+                self._log.error('%s: %s', self._leader_url,
+                                self._stat['error'])
+                return
+
+            self._stat.update(offset=offset, rtt=rtt, syncs=1)
+
+        local_start = self._start - offset
+        self._stat['local_start'] = local_start
+        if local_start < self._clock.monotonic():
+            self._log.warning('start time has passed: %.3f sec',
+                              self._clock.monotonic() - local_start)
+
+        self._player.music_play_at(local_start, self._repeat)
+
+        if self._sync is None:
+            return
+
+        while self._active:
+            self._wakeup.wait(self.SYNC_INTERVAL)
+            if not self._active:
+                break
+
+            if not self._player.is_playing():
+                self._log.debug('music is not playing')
+                break
+
+            try:
+                new_offset, rtt = self._sync.measure()
+            except SYNC_ERRORS as ex:
+                self._log.warning('%s: %s', type(ex).__name__, ex)
+                continue
+
+            self._stat['syncs'] += 1
+            self._stat['rtt'] = rtt
+
+            # local time of the same leader's time
+            dt = offset - new_offset
+            if abs(dt) < rtt / 2:
+                # within the error of the measurement
+                continue
+
+            self._player.adjust_clock(dt)
+            offset = new_offset
+            self._stat['offset'] = offset
+            self._stat['corrections'] += 1
+            self._stat['drift_msec'] += dt * 1000
+            self._log.info('drift %+.3f msec (rtt %.3f msec)',
+                           dt * 1000, rtt * 1000)
+
+        self._sync.close()
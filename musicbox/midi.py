@@ -7,15 +7,44 @@ MIDI library for Music Box
 __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021/01'
 
-import copy
 import midilib
-from .parser import Parser
+from .parser import Parser, coalesce, mk_ent, COALESCE_FIRST
 from .my_logger import get_logger
 
+MAJOR_SCALE = [0, 2, 4, 5, 7, 9, 11]
+
+
+def mk_note_offset(ch_n, scale=MAJOR_SCALE):
+    """
+    note offsets of a comb of ``ch_n`` notes
+
+    the scale is repeated for each octave:
+    15 notes: 2 octaves (C .. C), 30 notes: 4 octaves + 2 notes, ..
+
+    Parameters
+    ----------
+    ch_n: int
+    scale: list of int
+        note offsets in one octave
+
+    Returns
+    -------
+    note_offset: list of int
+    """
+    return [12 * (i // len(scale)) + scale[i % len(scale)]
+            for i in range(ch_n)]
+
 
 class Midi(Parser):
     """
     MIDI parser for Music Box
+
+    Attributes
+    ----------
+    ch_n: int
+        number of notes of the comb (all the servo boards)
+    note_offset: list of int
+        note offset of each channel
     """
     NOTE_OFFSET = [0, 2, 4, 5, 7, 9, 11, 12, 14, 16, 17, 19, 21, 23, 24]
 
@@ -24,17 +53,34 @@ class Midi(Parser):
     NOTE_ORIGIN_MIN = 0
     NOTE_ORIGIN_MAX = 127 - NOTE_OFFSET[-1]
 
-    def __init__(self, debug=False):
-        """ Constructor """
+    def __init__(self, ch_n=None, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        ch_n: int
+            number of notes of the comb, None: ``CH_N``
+            (ex. 30: two boards)
+        """
         self._dbg = debug
         self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('ch_n=%s', ch_n)
+
+        self.ch_n = self.CH_N if ch_n is None else ch_n
+        self.note_offset = self.NOTE_OFFSET
+        if self.ch_n != self.CH_N:
+            self.note_offset = mk_note_offset(self.ch_n)
+            self._log.debug('note_offset=%s', self.note_offset)
+
+        if self.note_offset[-1] > 127:
+            raise ValueError('too many notes: ch_n=%s' % (self.ch_n))
 
         self._midilib_parser = midilib.Parser()
 
         super().__init__(debug=self._dbg)
 
     def note2ch(self, note, note_origin=NOTE_ORIGIN_MIN,
-                note_offset=NOTE_OFFSET) -> int:
+                note_offset=None) -> int:
         """
         calculate servo ch from MIDI note
 
@@ -48,6 +94,7 @@ class Midi(Parser):
         note_origin: int
             origin number of note
         note_offset: list of int
+            None: ``self.note_offset``, []: no offset
 
         Returns
         -------
@@ -56,10 +103,13 @@ class Midi(Parser):
         """
         ch = -1
 
+        if note_offset is None:
+            note_offset = self.note_offset
+
         if note_offset:
             offset = note - note_origin
 
-            if offset in self.NOTE_OFFSET:
+            if offset in note_offset:
                 ch = note_offset.index(offset)
         else:
             ch = note - note_origin
@@ -67,7 +117,7 @@ class Midi(Parser):
         return ch
 
     def get_ch_set(self, note_data, note_origin=NOTE_ORIGIN_MIN,
-                   note_offset=NOTE_OFFSET):
+                   note_offset=None):
         """
         Parameters
         ----------
@@ -101,8 +151,15 @@ class Midi(Parser):
         best_note_origin = self.NOTE_ORIGIN_MIN
         best_ch_count = 0
 
+        if note_offset is None:
+            note_offset = self.note_offset
+
+        note_origin_max = self.NOTE_ORIGIN_MAX
+        if note_offset:
+            note_origin_max = 127 - note_offset[-1]
+
         for note_origin in range(self.NOTE_ORIGIN_MIN,
-                                 self.NOTE_ORIGIN_MAX + 1):
+                                 note_origin_max + 1):
             ch_set = self.get_ch_set(note_data, note_origin, note_offset)
 
             if len(ch_set) > best_ch_count:
@@ -117,7 +174,7 @@ class Midi(Parser):
         return best_note_origin
 
     def mk_music_data(self, note_data, note_origin,
-                      note_offset=NOTE_OFFSET):
+                      note_offset=None):
         """
         Parameters
         ----------
@@ -132,57 +189,53 @@ class Midi(Parser):
 
         music_data = []
 
-        prev_abs_time = 0
+        prev_abs_time_us = 0
         for note_info in note_data:
             if note_info.velocity == 0:
                 continue
 
-            abs_time = note_info.abs_time
+            # integer usec: no accumulated rounding error
+            abs_time_us = round(note_info.abs_time * 1000000)
             ch = self.note2ch(note_info.note, note_origin, note_offset)
 
             if ch < 0:
                 continue
 
-            delay = round(abs_time - prev_abs_time, 3) * 1000
-            prev_abs_time = abs_time
-
-            ent = {'abs_time': round(abs_time, 3),
-                   'ch': [ch],
-                   'delay': delay}
+            ent = mk_ent([ch], abs_time_us - prev_abs_time_us, abs_time_us)
+            prev_abs_time_us = abs_time_us
 
             music_data.append(ent)
 
         return music_data
 
-    def merge_ch(self, in_music_data):
+    def merge_ch(self, in_music_data, window_msec=0, mode=COALESCE_FIRST,
+                 grid_msec=None):
         """
+        merge notes within ``window_msec`` into one chord
+
         Parameters
         ----------
         in_music_data: list of MusicDataEnt
+        window_msec: float
+            0: same ``abs_time`` only
+        mode: str
+            'first', 'mean' or 'grid' (see ``parser.coalesce()``)
+        grid_msec: float
 
         Returns
         -------
         out_music_data: list of MusicDataEnt
         """
-        out_music_data = []
-
-        abs_time = -1
-        for ent in in_music_data:
-            print(ent)
-            if ent['abs_time'] == abs_time:
-                ch_list = out_music_data[-1]['ch'] + ent['ch']
-                ch_set = set(ch_list)
-                out_music_data[-1]['ch'] = sorted(list(ch_set))
-                continue
-
-            ent2 = copy.deepcopy(ent)
-            out_music_data.append(ent2)
-            abs_time = ent['abs_time']
+        out_music_data, stats = coalesce(in_music_data, window_msec, mode,
+                                         grid_msec)
+        self._log.info('merge_ch(%s msec, %s): %s',
+                       window_msec, mode, stats)
 
         return out_music_data
 
     def parse(self, midi_file, channel=[], note_origin=-1,
-              note_offset=NOTE_OFFSET):
+              note_offset=None, coalesce_msec=0,
+              coalesce_mode=COALESCE_FIRST):
         """
         Parameters
         ----------
@@ -190,6 +243,11 @@ class Midi(Parser):
         channel: list of int
         note_origin: int
         note_offset: list of int
+            None: ``self.note_offset``, []: no offset
+        coalesce_msec: float
+            notes within this window are merged into one chord
+        coalesce_mode: str
+            'first', 'mean' or 'grid'
 
         Returns
         -------
@@ -207,6 +265,7 @@ class Midi(Parser):
         music_data = self.mk_music_data(parsed_midi['note_info'],
                                         note_origin, note_offset)
 
-        music_data2 = self.merge_ch(music_data)
+        music_data2 = self.merge_ch(music_data, coalesce_msec,
+                                    coalesce_mode)
 
         return music_data2
@@ -0,0 +1,272 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Motion profile for the rotation motor (stepper motor)
+
+### Speed
+
+``speed`` is a continuous value (0.0 .. 10.0).
+Integer values are the same as ``RotationMotor.SPEED2INTERVAL``,
+values in between are interpolated logarithmically.
+
+### Ramp
+
+Changing speed is done by accelerating/decelerating the step rate
+along a curve, so that the acceleration never exceeds
+``accel`` (speed up) or ``decel`` (slow down) [steps/sec^2].
+
+```python3
+profile = MotionProfile(accel=1000, decel=1500, curve='scurve')
+
+intervals = profile.ramp_intervals(0, 10)  # list of step interval (sec)
+```
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/01'
+
+import math
+from .my_logger import get_logger
+
+
+class MotionProfile:
+    """
+    Motion profile: speed <-> step interval and acceleration ramps
+
+    Attributes
+    ----------
+    accel, decel: float
+        max acceleration/deceleration [steps/sec^2] (0: no ramp)
+    start_rate: float
+        the motor can start/stop at this rate without ramp [steps/sec]
+    curve: str
+        'linear', 'scurve' or 'exp'
+    """
+    SPEED2INTERVAL = (None,
+                      0.5,
+                      0.25,
+                      0.125,
+                      0.06,
+                      0.03,
+                      0.015,
+                      0.008,
+                      0.004,
+                      0.002,
+                      0.0015)
+
+    SPEED_MAX = len(SPEED2INTERVAL) - 1
+
+    DEF_ACCEL = 1000.0      # steps/sec^2
+    DEF_DECEL = 1000.0      # steps/sec^2
+    DEF_START_RATE = 50.0   # steps/sec
+    DEF_CURVE = 'scurve'
+
+    # curve: (f(u), max(f'(u)))  u: 0..1 -> 0..1
+    CURVE = {
+        'linear': (lambda u: u, 1.0),
+        'scurve': (lambda u: u * u * (3 - 2 * u), 1.5),
+        'exp': (lambda u: (1 - math.exp(-4 * u)) / (1 - math.exp(-4)),
+                4 / (1 - math.exp(-4))),
+    }
+
+    # ramps are applied to the motor in segments of this duration
+    SEGMENT_SEC = 0.05
+
+    def __init__(self, accel=DEF_ACCEL, decel=DEF_DECEL,
+                 start_rate=DEF_START_RATE, curve=DEF_CURVE,
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        accel, decel: float
+            steps/sec^2 (0: no ramp)
+        start_rate: float
+            steps/sec
+        curve: str
+            'linear', 'scurve', 'exp'
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('accel=%s, decel=%s, start_rate=%s, curve=%s',
+                        accel, decel, start_rate, curve)
+
+        if curve not in self.CURVE:
+            raise ValueError('invalid curve: %a' % (curve))
+
+        self.accel = accel
+        self.decel = decel
+        self.start_rate = start_rate
+        self.curve = curve
+
+    def speed2interval(self, speed):
+        """
+        Parameters
+        ----------
+        speed: float
+            0.0 .. 10.0
+
+        Returns
+        -------
+        interval: float or None
+            step interval (sec), None: stop
+        """
+        if speed <= 0:
+            return None
+
+        speed = min(float(speed), self.SPEED_MAX)
+
+        if speed < 1:
+            # 1.0 未満は、停止に近づくように外挿
+            return self.SPEED2INTERVAL[1] / speed
+
+        i = int(speed)
+        if i == self.SPEED_MAX:
+            return self.SPEED2INTERVAL[i]
+
+        frac = speed - i
+        log_i1 = math.log(self.SPEED2INTERVAL[i])
+        log_i2 = math.log(self.SPEED2INTERVAL[i + 1])
+        return math.exp(log_i1 + (log_i2 - log_i1) * frac)
+
+    def speed2rate(self, speed):
+        """
+        Returns
+        -------
+        rate: float
+            steps/sec (0: stop)
+        """
+        interval = self.speed2interval(speed)
+        if interval is None:
+            return 0.0
+
+        return 1 / interval
+
+    def ramp_intervals(self, speed1, speed2):
+        """
+        step intervals to change speed from ``speed1`` to ``speed2``
+
+        Parameters
+        ----------
+        speed1, speed2: float
+
+        Returns
+        -------
+        intervals: list of float
+            step intervals (sec) of the ramp.
+            empty: no ramp is needed (change speed immediately)
+        """
+        return self.ramp_rate(self.speed2rate(speed1),
+                              self.speed2rate(speed2))
+
+    def ramp_rate(self, rate1, rate2):
+        """
+        step intervals to change step rate from ``rate1`` to ``rate2``
+
+        Parameters
+        ----------
+        rate1, rate2: float
+            steps/sec (0: stop)
+
+        Returns
+        -------
+        intervals: list of float
+        """
+        # start/stop: the motor can jump from/to ``start_rate``
+        rate1 = max(rate1, self.start_rate)
+        rate2 = max(rate2, self.start_rate)
+
+        accel = self.accel if rate2 > rate1 else self.decel
+        if accel <= 0 or abs(rate2 - rate1) < 1:
+            return []
+
+        func, peak = self.CURVE[self.curve]
+        ramp_sec = peak * abs(rate2 - rate1) / accel
+
+        def rate_at(t):
+            u = min(t / ramp_sec, 1.0)
+            return rate1 + (rate2 - rate1) * func(u)
+
+        intervals = []
+        t = 0.0
+        while t < ramp_sec:
+            # the rate at the middle of the interval
+            interval = 1 / rate_at(t)
+            interval = 1 / rate_at(t + interval / 2)
+            intervals.append(interval)
+            t += interval
+
+        self._log.debug('rate:%.1f->%.1f, ramp_sec=%.3f, steps=%s',
+                        rate1, rate2, ramp_sec, len(intervals))
+        return intervals
+
+    def segments(self, intervals, segment_sec=SEGMENT_SEC):
+        """
+        group step intervals into segments of about ``segment_sec``
+
+        Parameters
+        ----------
+        intervals: list of float
+        segment_sec: float
+
+        Returns
+        -------
+        segments: list of (interval, steps)
+            mean interval and number of steps of each segment
+        """
+        segments = []
+        seg = []
+        for interval in intervals:
+            seg.append(interval)
+            if sum(seg) >= segment_sec:
+                segments.append((sum(seg) / len(seg), len(seg)))
+                seg = []
+
+        if seg:
+            segments.append((sum(seg) / len(seg), len(seg)))
+
+        return segments
+
+    @staticmethod
+    def simulate(intervals, t0=0.0):
+        """
+        Parameters
+        ----------
+        intervals: list of float
+        t0: float
+
+        Returns
+        -------
+        step_time: list of float
+            time of each step
+        """
+        step_time = []
+        t = t0
+        for interval in intervals:
+            step_time.append(t)
+            t += interval
+
+        return step_time
+
+    @staticmethod
+    def max_accel(step_time):
+        """
+        maximum acceleration measured from step timing
+
+        Parameters
+        ----------
+        step_time: list of float
+
+        Returns
+        -------
+        accel: float
+            steps/sec^2
+        """
+        accel = 0.0
+        for i in range(len(step_time) - 2):
+            dt1 = step_time[i + 1] - step_time[i]
+            dt2 = step_time[i + 2] - step_time[i + 1]
+            a = abs(1 / dt2 - 1 / dt1) / ((dt1 + dt2) / 2)
+            accel = max(accel, a)
+
+        return accel
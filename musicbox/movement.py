@@ -9,6 +9,7 @@ Music Box movement class
 MovementBase
  |
  +- Movement            : for servo motor
+ |   +- MovementSim     : simulation (no hardware)
  +- MovementWavFile     : for wav file (15 notes)
  +- MovementWavFileFull : for wav file (full notes)
 
@@ -34,12 +35,57 @@ __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021/01'
 
 from pathlib import Path
+import os
 import glob
 import threading
 import time
-import pygame
 from .my_logger import get_logger
-from . import RotationMotor, Servo
+from . import RotationMotor, RotationMotorWave, Servo
+
+# pygame.mixer.Sound of each wav file (by real path),
+# shared by the players of one process (ex. ``MusicBox server -e ..``)
+_SOUND_BANK = {}
+_SOUND_BANK_LOCK = threading.Lock()
+
+
+def load_sound(wav_file):
+    """
+    load a wav file, or get the one already loaded
+
+    Parameters
+    ----------
+    wav_file: str
+
+    Returns
+    -------
+    sound: pygame.mixer.Sound
+    """
+    import pygame
+
+    path = os.path.realpath(wav_file)
+    with _SOUND_BANK_LOCK:
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+
+        if path not in _SOUND_BANK:
+            _SOUND_BANK[path] = pygame.mixer.Sound(path)
+
+        return _SOUND_BANK[path]
+
+
+def sound_bank_info():
+    """
+    Returns
+    -------
+    info: dict
+        sounds: number of loaded wav files
+        bytes: total size of the wav files
+    """
+    with _SOUND_BANK_LOCK:
+        return {
+            'sounds': len(_SOUND_BANK),
+            'bytes': sum([os.path.getsize(p) for p in _SOUND_BANK]),
+        }
 
 
 class MovementBase:
@@ -53,7 +99,17 @@ class MovementBase:
     ----------
     active: bool
         active flag
+    start_sec: dict
+        hardware bring-up time (sec): 'total' and each part
+    stop_sec: dict
+        shutdown time (sec), after ``end()``
     """
+    # see ``actuate_at()``
+    lookahead = 0.0
+
+    start_sec = {'total': 0.0}
+    stop_sec = None
+
     def __init__(self, ch_n=0, debug=False):
         """ Constructor
 
@@ -100,6 +156,47 @@ class MovementBase:
         self._log.debug('ch_list=%s', ch_list)
         self._log.error('*** This method must be overridden ***')
 
+    def max_lead(self):
+        """
+        Returns
+        -------
+        lead: float
+            how long before ``play_time`` ``single_play_at()``
+            must be called (sec)
+        """
+        return 0.0
+
+    def single_play_at(self, ch_list, play_time):
+        """
+        play One sound at ``play_time`` (in thread)
+
+        Parameters
+        ----------
+        ch_list: list of int
+        play_time: float
+            ``time.monotonic()``
+        """
+        self._log.debug('ch_list=%s, play_time=%.3f', ch_list, play_time)
+
+        threading.Thread(target=self.play_sound_at,
+                         args=(ch_list, play_time)).start()
+
+    def play_sound_at(self, ch_list, play_time):
+        """
+        wait until ``play_time`` and ``play_sound()``
+
+        Parameters
+        ----------
+        ch_list: list of int
+        play_time: float
+            ``time.monotonic()``
+        """
+        wait_sec = play_time - time.monotonic()
+        if wait_sec > 0:
+            time.sleep(wait_sec)
+
+        self.play_sound(ch_list)
+
     def set_onoff(self, ch_, on_=False, pw_=None, tap=False,
                   conf_file=None):
         """
@@ -147,6 +244,109 @@ class MovementBase:
             'ch_=%s, on_=%s, pw_diff=%s, tap=%s, conf_file=%s',
             ch_, on_, pw_diff, tap, conf_file)
 
+    def plan_params(self):
+        """
+        parameters for ``ActuationPlan.compile()``
+
+        Returns
+        -------
+        params: dict or None
+            None: this movement doesn't support actuation plans
+        """
+        return None
+
+    def actuate(self, op, ch):
+        """
+        execute one event of an actuation plan
+
+        Parameters
+        ----------
+        op: int
+            PUSH or PULL
+        ch: int
+        """
+        self._log.error('*** This method must be overridden ***')
+
+    def actuate_at(self, event_time, op, ch):
+        """
+        execute one event of an actuation plan at ``event_time``
+
+        The plan executor calls this ``lookahead`` sec before
+        ``event_time``. (lookahead=0: now)
+
+        Parameters
+        ----------
+        event_time: float
+            ``time.monotonic()``
+        op: int
+        ch: int
+        """
+        self.actuate(op, ch)
+
+    def actuate_batch(self, batch):
+        """
+        execute the events that are due at once
+
+        Parameters
+        ----------
+        batch: list of (event_time, op, ch)
+        """
+        for event_time, op, ch in batch:
+            self.actuate_at(event_time, op, ch)
+
+    def cancel(self):
+        """ cancel events that are not executed yet """
+        pass
+
+    def stats(self):
+        """
+        actuation statistics (since the last ``reset_stats()``)
+
+        Returns
+        -------
+        stats: dict
+        """
+        return {}
+
+    def reset_stats(self):
+        """ reset statistics """
+        pass
+
+    def write_pw(self, writes):
+        """
+        write pulse widths as they are (this node is a remote board)
+
+        Parameters
+        ----------
+        writes: list of (ch, pw)
+        """
+        self._log.debug('writes=%s: ignored', writes)
+
+    def get_interval(self, ch_):
+        """
+        push/pull interval of the channel
+
+        Parameters
+        ----------
+        ch_: int
+
+        Returns
+        -------
+        (push_interval, pull_interval): (float, float)
+            sec
+        """
+        return 0.0, 0.0
+
+    def set_interval(self, ch_, push_interval=None, pull_interval=None,
+                     conf_file=None):
+        """
+        push/pull intervalの設定(チャンネルごと)
+
+        実装はサブクラスでオーバーライド
+        """
+        self._log.debug('ch_=%s, interval=%s, conf_file=%s',
+                        ch_, (push_interval, pull_interval), conf_file)
+
 
 class Movement(MovementBase):
     """
@@ -158,6 +358,10 @@ class Movement(MovementBase):
     2つめ以降のインスタンス生成時に
     ``rotation_speed=0``とすること。
 
+    The rotation motor and the servos are brought up in parallel,
+    each gated on pigpiod (``pigpio_conn.pigpio_pi()``),
+    and shut down in parallel (``end()``).
+
     Attributes
     ----------
     ch_n: int
@@ -166,6 +370,13 @@ class Movement(MovementBase):
     ROTATION_SPEED = 10
     ROTATION_GPIO = [5, 6, 13, 19]
 
+    ROTATION_BACKEND_THREAD = 'thread'
+    ROTATION_BACKEND_WAVE = 'wave'
+    ROTATION_BACKEND = {
+        ROTATION_BACKEND_THREAD: RotationMotor,
+        ROTATION_BACKEND_WAVE: RotationMotorWave
+    }
+
     _log = get_logger(__name__, False)
 
     def __init__(self,
@@ -173,6 +384,11 @@ class Movement(MovementBase):
                  rotation_speed=ROTATION_SPEED,
                  push_interval=Servo.DEF_PUSH_INTERVAL,
                  pull_interval=Servo.DEF_PULL_INTERVAL,
+                 rotation_backend=ROTATION_BACKEND_THREAD,
+                 push_budget=Servo.DEF_PUSH_BUDGET,
+                 actuator_proc=False,
+                 rt_kw=None,
+                 boards=None,
                  debug=False):
         """ Constructor
 
@@ -180,44 +396,125 @@ class Movement(MovementBase):
         ----------
         rotation_gpio: list of int
             GPIO pin number of rotation motor (stepper motor)
-        rotation_speed: int
-            speed of rotation motor (0 .. 10)
+        rotation_speed: float
+            speed of rotation motor (0.0 .. 10.0)
             0: don't use rotation motor
         push_interval, pull_interval: float
             interval sec
+        rotation_backend: str
+            'thread': StepMtrTh, 'wave': pigpio waveform
+        push_budget: int
+            max number of servos that start a push at once
+            0: unlimited
+        actuator_proc: bool
+            servo writes run in a child process (``ActuatorProcess``)
+        rt_kw: dict
+            kwargs of ``rt.set_realtime()`` for the actuator process
+            None: not realtime
+        boards: str
+            several servo boards (see ``musicbox.channel_map``)
+            None: one PCA9685
         """
         self._dbg = debug
         self._log = get_logger(self.__class__.__name__, self._dbg)
         self._log.debug('rotation_gpio=%s', rotation_gpio)
         self._log.debug('rotation_speed=%s', rotation_speed)
+        self._log.debug('rotation_backend=%s', rotation_backend)
 
-        # start rotation
-        self._mtr = RotationMotor(
-            rotation_gpio[0],
-            rotation_gpio[1],
-            rotation_gpio[2],
-            rotation_gpio[3],
-            debug=False)
+        start = time.monotonic()
+        self.start_sec = {}
+        self._mtr = None
+        self._servo = None
         self._rotation_gpio = rotation_gpio
-        time.sleep(1)
-
-        # init servo
-        self._servo = Servo(push_interval=push_interval,
-                            pull_interval=pull_interval,
-                            debug=self._dbg)
+        errors = []
+
+        def _init(name, attr, func):
+            t1 = time.monotonic()
+            try:
+                setattr(self, attr, func())
+            except Exception as ex:
+                errors.append(ex)
+                self._log.error('%s: %s: %s', name, type(ex).__name__, ex)
+            self.start_sec[name] = round(time.monotonic() - t1, 3)
+
+        def open_rotation():
+            return self.ROTATION_BACKEND[rotation_backend](
+                rotation_gpio[0],
+                rotation_gpio[1],
+                rotation_gpio[2],
+                rotation_gpio[3],
+                debug=False)
+
+        def open_servo():
+            return Servo(push_interval=push_interval,
+                         pull_interval=pull_interval,
+                         push_budget=push_budget,
+                         boards=boards,
+                         debug=self._dbg)
+
+        parts = [('rotation', '_mtr', open_rotation),
+                 ('servo', '_servo', open_servo)]
+        th = [threading.Thread(target=_init, args=part, daemon=True)
+              for part in parts]
+        for t in th:
+            t.start()
+        for t in th:
+            t.join()
+
+        if errors:
+            for part in (self._mtr, self._servo):
+                if part is not None:
+                    part.end()
+            raise errors[0]
 
         super().__init__(ch_n=self._servo.servo_n, debug=self._dbg)
 
+        self._proc = None
+        if actuator_proc:
+            from .actuator import ActuatorProcess
+
+            self._proc = ActuatorProcess(
+                servo_kw={'conf_file': self._servo.conf_file,
+                          'push_interval': push_interval,
+                          'pull_interval': pull_interval,
+                          'boards': boards},
+                rt_kw=rt_kw,
+                debug=self._dbg)
+            if self._proc.wait_ready():
+                self.lookahead = self._proc.LOOKAHEAD_SEC
+            else:
+                self._proc.end()
+                self._proc = None
+
+        self.start_sec['total'] = round(time.monotonic() - start, 3)
+        self._log.info('hardware ready: %s sec', self.start_sec)
+
     def end(self):
         """
         Call at the end of program
         """
         self._log.debug('doing ..')
         super().end()
-
-        self._servo.end()
-        self._mtr.end()
-        self._log.debug('done')
+        start = time.monotonic()
+        self.stop_sec = {}
+
+        def _end(name, part):
+            t1 = time.monotonic()
+            part.end()
+            self.stop_sec[name] = round(time.monotonic() - t1, 3)
+
+        parts = [('rotation', self._mtr), ('servo', self._servo)]
+        if self._proc is not None:
+            parts.append(('proc', self._proc))
+        th = [threading.Thread(target=_end, args=part, daemon=True)
+              for part in parts]
+        for t in th:
+            t.start()
+        for t in th:
+            t.join()
+
+        self.stop_sec['total'] = round(time.monotonic() - start, 3)
+        self._log.info('hardware stopped: %s sec', self.stop_sec)
 
     def play_sound(self, ch_list):
         """
@@ -233,6 +530,11 @@ class Movement(MovementBase):
             return
 
         self._log.debug('tap channels: %s', ch_list)
+
+        if self._proc is not None:
+            self.tap_proc(ch_list, time.monotonic())
+            return
+
         try:
             self._servo.tap(ch_list)
         except ValueError as err:
@@ -240,6 +542,61 @@ class Movement(MovementBase):
 
         self._log.debug('done')
 
+    def max_lead(self):
+        """
+        Returns
+        -------
+        lead: float
+            max lead time of servos (sec)
+        """
+        return self._servo.max_lead()
+
+    def single_play_at(self, ch_list, play_time):
+        """
+        strike at ``play_time``
+
+        Each servo is pushed earlier by its lead time.
+
+        Parameters
+        ----------
+        ch_list: list of int
+        play_time: float
+            ``time.monotonic()``
+        """
+        self._log.debug('ch_list=%s, play_time=%.3f', ch_list, play_time)
+
+        if ch_list is None:
+            self._log.debug('do nothing')
+            return
+
+        if self._proc is not None:
+            self.tap_proc(ch_list, play_time)
+            return
+
+        try:
+            self._servo.tap_at(ch_list, play_time)
+        except ValueError as err:
+            self._log.warning('%s: %s', type(err), err)
+
+    def tap_proc(self, ch_list, play_time):
+        """
+        send taps to the actuator process
+
+        Parameters
+        ----------
+        ch_list: list of int
+        play_time: float
+            ``time.monotonic()``
+        """
+        from .actuator import OP_TAP
+
+        for ch in ch_list:
+            if ch < 0 or ch >= self._servo.servo_n:
+                self._log.warning('ch=%s: ignored', ch)
+                continue
+
+            self._proc.send(play_time, OP_TAP, ch)
+
     def rotation_speed(self, speed=0):
         self._log.debug('speed=%s', speed)
         self._mtr.set_speed(speed)
@@ -269,6 +626,7 @@ class Movement(MovementBase):
                         ch, on, pw, tap, conf_file)
 
         self._servo.set_onoff(ch, on, pw, tap, conf_file)
+        self.reload_proc()
 
     def calibrate(self, ch, on=False, pw_diff=0, tap=False,
                   conf_file=None):
@@ -295,6 +653,153 @@ class Movement(MovementBase):
                         ch, on, pw_diff, tap, conf_file)
 
         self._servo.calibrate(ch, on, pw_diff, tap, conf_file)
+        self.reload_proc()
+
+    def plan_params(self):
+        return self._servo.plan_params()
+
+    def actuate(self, op, ch):
+        self._servo.actuate(op, ch)
+
+    def actuate_at(self, event_time, op, ch):
+        if self._proc is None:
+            self._servo.actuate(op, ch)
+            return
+
+        self._proc.send(event_time, op, ch)
+        self._proc.poll_status()
+
+    def actuate_batch(self, batch):
+        if self._proc is None:
+            self._servo.actuate_batch([(op, ch) for _, op, ch in batch])
+            return
+
+        super().actuate_batch(batch)
+
+    def cancel(self):
+        if self._proc is None:
+            return
+
+        from .actuator import OP_CLEAR
+
+        self._proc.send(time.monotonic(), OP_CLEAR)
+
+    def stats(self):
+        stats = self._servo.stats()
+        if self._proc is not None:
+            stats['proc'] = dict(self._proc.poll_status())
+        return stats
+
+    def reset_stats(self):
+        self._servo.reset_stats()
+
+    def write_pw(self, writes):
+        self._servo.write_pw(writes)
+
+    def get_interval(self, ch):
+        return self._servo.get_interval(ch)
+
+    def set_interval(self, ch, push_interval=None, pull_interval=None,
+                     conf_file=None):
+        """
+        push/pull intervalの設定(チャンネルごと)
+
+        変更後 conf_file に保存する。
+
+        Parameters
+        ----------
+        ch: int
+            servo channel
+        push_interval, pull_interval: float
+            sec, None: don't change
+        conf_file: str
+            configuration file (path name)
+        """
+        self._log.debug('ch=%s, interval=%s, conf_file=%s',
+                        ch, (push_interval, pull_interval), conf_file)
+
+        self._servo.set_interval(ch, push_interval, pull_interval,
+                                 conf_file)
+        self.reload_proc()
+
+    def reload_proc(self):
+        """ the actuator process reloads the servo conf file """
+        if self._proc is None:
+            return
+
+        from .actuator import OP_RELOAD
+
+        self._proc.send(time.monotonic(), OP_RELOAD)
+
+
+class MovementSim(Movement):
+    """
+    Movement without hardware (``musicbox.sim``)
+
+    Every actuation is recorded with the time of ``clock``.
+    """
+    def __init__(self,
+                 rotation_speed=Movement.ROTATION_SPEED,
+                 push_interval=Servo.DEF_PUSH_INTERVAL,
+                 pull_interval=Servo.DEF_PULL_INTERVAL,
+                 push_budget=Servo.DEF_PUSH_BUDGET,
+                 conf_file=Servo.DEF_CONFFILE,
+                 clock=None,
+                 boards=None,
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        rotation_speed: float
+        push_interval, pull_interval: float
+        push_budget: int
+        conf_file: str
+            servo conf file (default values, if not exist)
+        clock: RealClock or SimClock
+        boards: str
+            several (simulated) servo boards
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('conf_file=%s, clock=%s', conf_file, clock)
+
+        from .sim import SimServo, SimRotationMotor
+
+        start = time.monotonic()
+        self._mtr = SimRotationMotor(clock=clock, debug=False)
+        self._servo = SimServo(conf_file=conf_file,
+                               push_interval=push_interval,
+                               pull_interval=pull_interval,
+                               push_budget=push_budget,
+                               clock=clock,
+                               boards=boards,
+                               debug=self._dbg)
+        self._servo.clear_actuations()
+        self._proc = None
+        self.start_sec = {'total': round(time.monotonic() - start, 3)}
+
+        MovementBase.__init__(self, ch_n=self._servo.servo_n,
+                              debug=self._dbg)
+
+    def actuations(self):
+        """
+        Returns
+        -------
+        actuations: list of (t, ch, push_flag)
+        """
+        return self._servo.actuations()
+
+    def clear_actuations(self):
+        self._servo.clear_actuations()
+
+    def rotation_log(self):
+        """
+        Returns
+        -------
+        log: list of (t, speed, ramp_sec)
+        """
+        return self._mtr.log
 
 
 class MovementWav1(MovementBase):
@@ -348,7 +853,6 @@ class MovementWav1(MovementBase):
         self._wav_dir = str(wav_path.expanduser())
         self._log.debug('wav_dir=%s', self._wav_dir)
 
-        pygame.mixer.init()
         self._sound = self.load_wav(self._wav_dir,
                                     self._wav_prefix, self._wav_suffix)
 
@@ -388,7 +892,7 @@ class MovementWav1(MovementBase):
         wav_files = sorted(glob.glob(glob_pattern))
         self._log.debug('wav_files=%s', wav_files)
 
-        return [pygame.mixer.Sound(f) for f in wav_files]
+        return [load_sound(f) for f in wav_files]
 
     def play_sound(self, ch_list):
         """
@@ -3,13 +3,34 @@
 #
 """
 my_logger.py
+
+### Asynchronous mode
+
+```python3
+from .my_logger import start_async_logging, stop_async_logging
+
+start_async_logging(log_file='server.log')   # None: stderr
+  :
+stop_async_logging()
+```
+
+In asynchronous mode, log records are put into a bounded queue
+and written by a background thread.
+Logging never blocks the caller: when the queue is full,
+the record is dropped and counted (see ``dropped_count()``).
 """
 __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021'
 
-import inspect
-from logging import getLogger, StreamHandler, Formatter
-from logging import DEBUG, INFO
+import os
+import sys
+import queue
+import atexit
+from logging import getLogger, StreamHandler, Formatter, LogRecord
+from logging import Logger
+from logging import DEBUG, INFO, WARNING
+from logging.handlers import QueueHandler, QueueListener
+from logging.handlers import RotatingFileHandler
 # from logging import NOTSET, DEBUG, INFO, WARNING, ERROR, CRITICAL
 
 FMT_HDR = '%(asctime)s %(levelname)s '
@@ -21,16 +42,158 @@ CONSOLE_HANDLER = StreamHandler()
 CONSOLE_HANDLER.setFormatter(HANDLER_FMT)
 CONSOLE_HANDLER.setLevel(DEBUG)
 
+DEF_QUEUE_SIZE = 10000
+DEF_LOG_MAX_BYTES = 1024 * 1024
+DEF_LOG_BACKUP_COUNT = 5
+
+# handler for new loggers
+_handler = CONSOLE_HANDLER
+
+# asynchronous mode
+_queue_handler = None
+_listener = None
+
+
+class DropQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks
+
+    Attributes
+    ----------
+    dropped: int
+        number of dropped records (total)
+    """
+    def __init__(self, que):
+        """ Constructor
+
+        Parameters
+        ----------
+        que: queue.Queue
+            bounded queue
+        """
+        super().__init__(que)
+        self.dropped = 0
+        self._unreported = 0
+
+    def enqueue(self, record):
+        """ put record without blocking """
+        if self._unreported > 0:
+            note = LogRecord(record.name, WARNING, __file__, 0,
+                             '(%s log records dropped)',
+                             (self._unreported,), None,
+                             func=self.__class__.__name__)
+            try:
+                self.queue.put_nowait(note)
+                self._unreported = 0
+            except queue.Full:
+                pass
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+
+
+def _replace_handler(old, new):
+    """ replace handler of all loggers created by get_logger() """
+    for logger in list(Logger.manager.loggerDict.values()):
+        if not isinstance(logger, Logger):
+            continue
+
+        if old in logger.handlers:
+            logger.removeHandler(old)
+            logger.addHandler(new)
+
+
+def start_async_logging(log_file=None,
+                        max_bytes=DEF_LOG_MAX_BYTES,
+                        backup_count=DEF_LOG_BACKUP_COUNT,
+                        queue_size=DEF_QUEUE_SIZE):
+    """
+    start asynchronous logging
+
+    Parameters
+    ----------
+    log_file: str
+        log file (None: stderr)
+    max_bytes: int
+        rotate the log file at this size (0: no rotation)
+    backup_count: int
+        number of rotated files to keep
+    queue_size: int
+        size of the buffer (number of records)
+    """
+    global _handler, _queue_handler, _listener
+
+    if _listener is not None:
+        stop_async_logging()
+
+    if log_file is None:
+        target = StreamHandler()
+    else:
+        target = RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                     backupCount=backup_count)
+    target.setFormatter(HANDLER_FMT)
+    target.setLevel(DEBUG)
+
+    _queue_handler = DropQueueHandler(queue.Queue(queue_size))
+    _queue_handler.setLevel(DEBUG)
+
+    _listener = QueueListener(_queue_handler.queue, target,
+                              respect_handler_level=True)
+    _listener.start()
+
+    _replace_handler(_handler, _queue_handler)
+    _handler = _queue_handler
+
+
+def stop_async_logging():
+    """
+    flush queued records and go back to synchronous logging
+    """
+    global _handler, _queue_handler, _listener
+
+    if _listener is None:
+        return
+
+    _replace_handler(_queue_handler, CONSOLE_HANDLER)
+    _handler = CONSOLE_HANDLER
+
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+
+    _listener = None
+
+
+def dropped_count():
+    """
+    Returns
+    -------
+    count: int
+        number of log records dropped in asynchronous mode
+    """
+    if _queue_handler is None:
+        return 0
+
+    return _queue_handler.dropped
+
+
+atexit.register(stop_async_logging)
+
 
 def get_logger(name, dbg=False):
     """
     get logger
     """
-    filename = inspect.stack()[1].filename.split('/')[-1]
+    # ``inspect.stack()`` reads source files of all frames (slow).
+    # Only the caller's file name is needed.
+    filename = os.path.basename(sys._getframe(1).f_code.co_filename)
     name = filename + '.' + name
     logger = getLogger(name)
     logger.propagate = False
-    logger.addHandler(CONSOLE_HANDLER)
+    logger.addHandler(_handler)
     logger.setLevel(INFO)
 
     # [Important !! ]
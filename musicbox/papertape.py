@@ -7,7 +7,7 @@ PaperTape library for Music Box
 __author__ = 'Yoichi Tanibayashi'
 __data__ = '2021/01'
 
-from .parser import Parser
+from .parser import Parser, mk_ent
 from .my_logger import get_logger
 
 
@@ -47,9 +47,9 @@ class PaperTape(Parser):
             lines = f.readlines()
 
         music_data = []
-        delay_unit_msec = 0
-        delay_msec = 0
-        abs_time_sec = 0
+        delay_unit_us = 0
+        delay_us = 0
+        abs_time_us = 0
         for line in lines:
 
             # remove comment
@@ -69,8 +69,8 @@ class PaperTape(Parser):
                 continue
 
             try:
-                delay_unit_msec = int(word[0])
-                self._log.debug('delay_unit_msec=%s', delay_unit_msec)
+                delay_unit_us = int(word[0]) * 1000
+                self._log.debug('delay_unit_us=%s', delay_unit_us)
                 continue
             except ValueError:
                 pass
@@ -84,21 +84,17 @@ class PaperTape(Parser):
                     ch.append(i)
 
             if ch:
-                ent = {'abs_time': round(abs_time_sec, 3),
-                       'delay': round(delay_msec, 1),
-                       'ch': ch}
+                ent = mk_ent(ch, delay_us, abs_time_us)
                 music_data.append(ent)
-                print(ent)
+                self._log.debug('ent=%s', ent)
 
-                delay_msec = 0
+                delay_us = 0
 
-            delay_msec += delay_unit_msec
-            abs_time_sec += delay_unit_msec / 1000
+            delay_us += delay_unit_us
+            abs_time_us += delay_unit_us
 
-        ent = {'abs_time': round(abs_time_sec, 3),
-               'delay': round(delay_msec, 1),
-               'ch': []}
+        ent = mk_ent([], delay_us, abs_time_us)
         music_data.append(ent)
-        print(ent)
+        self._log.debug('ent=%s', ent)
 
         return music_data
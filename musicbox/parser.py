@@ -9,6 +9,223 @@ __data__ = '2021/01'
 
 from .my_logger import get_logger
 
+COALESCE_FIRST = 'first'
+COALESCE_MEAN = 'mean'
+COALESCE_GRID = 'grid'
+COALESCE_MODES = (COALESCE_FIRST, COALESCE_MEAN, COALESCE_GRID)
+
+
+def mk_ent(ch, delay_us, abs_time_us=None):
+    """
+    MusicDataEnt on the integer usec timeline
+
+    The float fields (``delay``: msec, ``abs_time``: sec) are
+    derived from the integer fields, for old clients.
+
+    Parameters
+    ----------
+    ch: list of int
+    delay_us: int
+    abs_time_us: int
+        None: no ``abs_time``
+
+    Returns
+    -------
+    ent: MusicDataEnt
+    """
+    ent = {}
+    if abs_time_us is not None:
+        ent['abs_time'] = abs_time_us / 1000000
+        ent['abs_time_us'] = abs_time_us
+    ent['ch'] = ch
+    ent['delay'] = delay_us / 1000
+    ent['delay_us'] = delay_us
+
+    return ent
+
+
+def get_delay_us(ent):
+    """
+    Parameters
+    ----------
+    ent: MusicDataEnt
+
+    Returns
+    -------
+    delay_us: int
+        None: default delay
+    """
+    delay_us = ent.get('delay_us')
+    if delay_us is not None:
+        return delay_us
+
+    if ent['delay'] is None:
+        return None
+
+    return round(ent['delay'] * 1000)
+
+
+def get_abs_time_us(ent):
+    """
+    Parameters
+    ----------
+    ent: MusicDataEnt
+
+    Returns
+    -------
+    abs_time_us: int
+        None: unknown
+    """
+    abs_time_us = ent.get('abs_time_us')
+    if abs_time_us is not None:
+        return abs_time_us
+
+    if ent.get('abs_time') is None:
+        return None
+
+    return round(ent['abs_time'] * 1000000)
+
+
+def coalesce(music_data, window_msec, mode=COALESCE_FIRST, grid_msec=None,
+             def_delay=500):
+    """
+    merge near-simultaneous notes into one chord
+
+    Notes within ``window_msec`` from the first note of a chord are
+    merged into the chord.
+    The time of the chord is:
+
+    * 'first': time of the first note
+    * 'mean': mean time of the notes
+    * 'grid': time of the first note, quantized to ``grid_msec``
+
+    ``abs_time_us`` (or ``abs_time``) is used if every note has it,
+    otherwise the time is calculated from ``delay_us`` (or ``delay``).
+    Times are integer usec.
+    In the result, every ``delay`` is explicit (not None).
+    Rests (``ch == []``) and default delay changes (``ch is None``)
+    are not merged.
+
+    Parameters
+    ----------
+    music_data: list of MusicDataEnt
+    window_msec: float
+        0: merge notes at exactly the same time only
+    mode: str
+        COALESCE_MODES
+    grid_msec: float
+        None: ``window_msec``
+    def_delay: int
+        msec
+
+    Returns
+    -------
+    music_data: list of MusicDataEnt
+    stats: dict
+        events_in, events_out: number of note events (wakeups)
+        wakeups_saved: events_in - events_out
+        notes_merged: same channel twice in a chord (dropped)
+        actuations_saved: push and pull of ``notes_merged``
+    """
+    if mode not in COALESCE_MODES:
+        raise ValueError('mode must be one of %s: %a' % (
+            COALESCE_MODES, mode))
+
+    if grid_msec is None or grid_msec <= 0:
+        grid_msec = window_msec
+
+    window_us = round(window_msec * 1000)
+    grid_us = round(grid_msec * 1000)
+    def_delay_us = round(def_delay * 1000)
+
+    use_abs_time = all([get_abs_time_us(ent) is not None
+                        for ent in music_data if ent['ch']])
+
+    # time of each entry (usec)
+    times = []
+    t = 0
+    for ent in music_data:
+        delay_us = get_delay_us(ent)
+        if ent['ch'] is None:
+            if delay_us is not None:
+                def_delay_us = delay_us
+            times.append(None)
+            continue
+
+        if delay_us is None:
+            delay_us = def_delay_us
+
+        abs_time_us = get_abs_time_us(ent)
+        if use_abs_time and abs_time_us is not None:
+            t = abs_time_us
+        else:
+            t += delay_us
+        times.append(t)
+
+    stats = {
+        'events_in': 0,
+        'events_out': 0,
+        'wakeups_saved': 0,
+        'notes_merged': 0,
+        'actuations_saved': 0,
+    }
+
+    out_music_data = []
+    prev_t = 0
+    group = []   # [(t, ent), ..]
+
+    def flush():
+        nonlocal prev_t
+
+        if not group:
+            return
+
+        if mode == COALESCE_MEAN:
+            t = round(sum([g[0] for g in group]) / len(group))
+        elif mode == COALESCE_GRID and grid_us > 0:
+            t = round(group[0][0] / grid_us) * grid_us
+        else:
+            t = group[0][0]
+        t = max(t, prev_t)
+
+        ch_list = []
+        for g in group:
+            ch_list += g[1]['ch']
+        ch_set = set(ch_list)
+
+        ent = dict(group[0][1])
+        ent.update(mk_ent(sorted(ch_set), t - prev_t,
+                          t if 'abs_time' in ent else None))
+        out_music_data.append(ent)
+
+        stats['events_out'] += 1
+        stats['notes_merged'] += len(ch_list) - len(ch_set)
+        prev_t = t
+        group.clear()
+
+    for ent, t in zip(music_data, times):
+        if not ent['ch']:
+            flush()
+            ent = dict(ent)
+            if t is not None:
+                ent.update(mk_ent(ent['ch'], max(t - prev_t, 0),
+                                  t if 'abs_time' in ent else None))
+                prev_t = max(t, prev_t)
+            out_music_data.append(ent)
+            continue
+
+        stats['events_in'] += 1
+        if group and t - group[0][0] > window_us:
+            flush()
+        group.append((t, ent))
+
+    flush()
+
+    stats['wakeups_saved'] = stats['events_in'] - stats['events_out']
+    stats['actuations_saved'] = stats['notes_merged'] * 2
+
+    return out_music_data, stats
+
 
 class Parser:
     """
@@ -34,3 +251,24 @@ class Parser:
         self._log.debug('infile=%s', infile)
 
         return []  # dummy
+
+    def coalesce(self, music_data, window_msec, mode=COALESCE_FIRST,
+                 grid_msec=None):
+        """
+        merge near-simultaneous notes (see ``coalesce()``)
+
+        Parameters
+        ----------
+        music_data: list of MusicDataEnt
+        window_msec: float
+        mode: str
+        grid_msec: float
+
+        Returns
+        -------
+        music_data: list of MusicDataEnt
+        """
+        music_data, stats = coalesce(music_data, window_msec, mode,
+                                     grid_msec)
+        self._log.info('coalesce(%s msec, %s): %s', window_msec, mode, stats)
+        return music_data
@@ -0,0 +1,46 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Connection to pigpiod, gated on its readiness
+
+At boot (``MusicBox up``), pigpiod may still be starting:
+``pigpio_pi()`` retries until it accepts the connection,
+instead of failing, or sleeping a fixed time before.
+
+```python3
+pi = pigpio_pi()        # connected pigpio.pi
+```
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import time
+
+PIGPIOD_TIMEOUT = 10.0  # sec
+POLL_SEC = 0.05
+
+
+def pigpio_pi(timeout=PIGPIOD_TIMEOUT):
+    """
+    Parameters
+    ----------
+    timeout: float
+        sec
+
+    Returns
+    -------
+    pi: pigpio.pi
+        connected
+    """
+    import pigpio
+
+    end_time = time.monotonic() + timeout
+    while True:
+        pi = pigpio.pi(show_errors=False)
+        if pi.connected:
+            return pi
+
+        if time.monotonic() > end_time:
+            raise RuntimeError('pigpiod: not connected in %s sec' % timeout)
+        time.sleep(POLL_SEC)
@@ -0,0 +1,510 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+pigpio daemon (pigpiod) stand-in
+
+A local server that speaks the pigpiod socket protocol
+well enough for the commands that ``Servo`` (PCA9685 on I2C)
+and the rotation motors (GPIO, waveform) use.
+It keeps a virtual PCA9685 register file and GPIO states,
+and logs every command with a timestamp.
+
+```python3
+svr = PigpiodSim(port=0)   # 0: any free port
+svr.start()
+
+os.environ['PIGPIO_PORT'] = str(svr.port)   # before ``import pigpio``
+servo = Servo()
+  :
+svr.counts()          # {'I2CWI': 123, ..}
+svr.pca9685[0x40].pw(ch)
+svr.wave_pulses(wave_id)  # [(on_mask, off_mask, delay_us), ..]
+svr.end()
+```
+
+### Wire format
+
+```
+request : cmd, p1, p2, p3 (uint32 x 4, little endian)
+          + extension (p3 bytes)
+response: cmd, p1, p2, res (int32)
+          + data (res bytes, I2C read commands only)
+```
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import time
+import socket
+import struct
+import threading
+import socketserver
+from collections import Counter
+from .my_logger import get_logger
+
+# commands
+CMD_MODES = 0
+CMD_MODEG = 1
+CMD_READ = 3
+CMD_WRITE = 4
+CMD_BR1 = 10
+CMD_HWVER = 17
+CMD_NB = 19
+CMD_NC = 21
+CMD_PIGPV = 26
+CMD_WVCLR = 27
+CMD_WVAG = 28
+CMD_WVBSY = 32
+CMD_WVHLT = 33
+CMD_WVCRE = 49
+CMD_WVDEL = 50
+CMD_WVTX = 51
+CMD_WVTXR = 52
+CMD_WVNEW = 53
+CMD_I2CO = 54
+CMD_I2CC = 55
+CMD_I2CRD = 56
+CMD_I2CWD = 57
+CMD_I2CRB = 61
+CMD_I2CWB = 62
+CMD_I2CRW = 63
+CMD_I2CWW = 64
+CMD_I2CRI = 67
+CMD_I2CWI = 68
+CMD_WVCHA = 93
+CMD_NOIB = 99
+CMD_WVTXM = 100
+CMD_WVTAT = 101
+
+CMD_NAME = {v: k[4:] for k, v in globals().items() if k.startswith('CMD_')}
+
+# results
+PI_BAD_GPIO = -3
+PI_BAD_HANDLE = -25
+PI_BAD_WAVE_ID = -66
+PI_UNKNOWN_COMMAND = -88
+WAVE_NOT_FOUND = 9998
+NO_TX_WAVE = 9999
+
+I2C_CMDS = (CMD_I2CO, CMD_I2CC, CMD_I2CRD, CMD_I2CWD, CMD_I2CRB, CMD_I2CWB,
+            CMD_I2CRW, CMD_I2CWW, CMD_I2CRI, CMD_I2CWI)
+
+
+class PCA9685Regs:
+    """
+    Virtual PCA9685 register file
+
+    Attributes
+    ----------
+    reg: bytearray
+        256 registers
+    writes: int
+        number of written bytes
+    """
+    MODE1 = 0x00
+    LED0_ON_L = 0x06
+    PRE_SCALE = 0xFE
+
+    OSC_HZ = 25000000
+
+    def __init__(self):
+        self.reg = bytearray(256)
+        self.reg[self.MODE1] = 0x11
+        self.reg[self.PRE_SCALE] = 0x1E
+        self.ptr = 0
+        self.writes = 0
+
+    def write(self, reg, data):
+        """
+        Parameters
+        ----------
+        reg: int
+            first register (auto increment)
+        data: bytes
+        """
+        for i, b in enumerate(data):
+            self.reg[(reg + i) & 0xff] = b
+        self.ptr = (reg + len(data)) & 0xff
+        self.writes += len(data)
+
+    def read(self, reg, count):
+        """
+        Returns
+        -------
+        data: bytes
+        """
+        data = bytes([self.reg[(reg + i) & 0xff] for i in range(count)])
+        self.ptr = (reg + count) & 0xff
+        return data
+
+    def freq(self):
+        """
+        Returns
+        -------
+        freq: float
+            PWM frequency (Hz)
+        """
+        return self.OSC_HZ / (4096 * (self.reg[self.PRE_SCALE] + 1))
+
+    def pw(self, ch):
+        """
+        Parameters
+        ----------
+        ch: int
+
+        Returns
+        -------
+        pw: int
+            pulse width (usec)
+        """
+        r = self.LED0_ON_L + ch * 4
+        on = self.reg[r] | (self.reg[r + 1] & 0x0f) << 8
+        off = self.reg[r + 2] | (self.reg[r + 3] & 0x0f) << 8
+
+        if self.reg[r + 3] & 0x10:  # full off
+            return 0
+
+        return round(((off - on) % 4096) * 1000000 / (self.freq() * 4096))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """ one client connection """
+    def recv_n(self, n):
+        buf = b''
+        while len(buf) < n:
+            data = self.request.recv(n - len(buf))
+            if not data:
+                return None
+            buf += data
+        return buf
+
+    def handle(self):
+        sim = self.server.sim
+        conn_id = sim.new_conn()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        while True:
+            req = self.recv_n(PigpiodSim.MSG.size)
+            if req is None:
+                break
+
+            cmd, p1, p2, p3 = PigpiodSim.MSG.unpack(req)
+            ext = b''
+            if p3 > 0:
+                ext = self.recv_n(p3)
+                if ext is None:
+                    break
+
+            res, data = sim.command(conn_id, cmd, p1, p2, ext)
+            self.request.sendall(PigpiodSim.RES.pack(cmd, p1, p2, res)
+                                 + data)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class PigpiodSim:
+    """
+    pigpiod stand-in
+
+    Attributes
+    ----------
+    port: int
+    log: list of (t, conn_id, cmd, p1, p2, ext_len, res)
+    pca9685: dict
+        {i2c_addr: PCA9685Regs}
+    gpio_level: int
+        bit mask
+    gpio_mode: dict
+        {gpio: mode}
+    """
+    DEF_PORT = 8888
+
+    MSG = struct.Struct('<IIII')
+    RES = struct.Struct('<IIIi')
+    PULSE = struct.Struct('<III')
+
+    HWVER = 0xa02082
+    PIGPV = 79
+
+    def __init__(self, host='localhost', port=DEF_PORT, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        host: str
+        port: int
+            0: any free port
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('host=%s, port=%s', host, port)
+
+        self.log = []
+        self.pca9685 = {}
+        self.gpio_level = 0
+        self.gpio_mode = {}
+
+        self._lock = threading.Lock()
+        self._conn_n = 0
+        self._notify_n = 0
+        self._i2c = {}        # handle -> i2c_addr
+        self._i2c_n = 0
+
+        self._pulses = []     # wave being built
+        self._waves = {}      # wave_id -> (pulses, length_sec)
+        self._wave_pulses = {}  # wave_id -> pulses (also deleted ones)
+        self._wave_n = 0
+        self._tx = None       # (wave_id, end_time), end_time None: repeat
+
+        self._server = _Server((host, port), _Handler)
+        self._server.sim = self
+        self.port = self._server.server_address[1]
+        self._th = None
+
+    def start(self):
+        """ start serving (sub-thread) """
+        self._th = threading.Thread(target=self._server.serve_forever,
+                                    daemon=True)
+        self._th.start()
+        self._log.info('port=%s', self.port)
+
+    def end(self):
+        """ stop serving """
+        self._log.debug('')
+        self._server.shutdown()
+        self._server.server_close()
+        self._log.debug('done')
+
+    def new_conn(self):
+        """
+        Returns
+        -------
+        conn_id: int
+        """
+        with self._lock:
+            self._conn_n += 1
+            return self._conn_n
+
+    def clear_log(self):
+        with self._lock:
+            self.log = []
+
+    def counts(self, log=None):
+        """
+        Parameters
+        ----------
+        log: list
+            None: self.log
+
+        Returns
+        -------
+        counts: Counter
+            {cmd_name: n}
+        """
+        if log is None:
+            log = self.log
+
+        return Counter([CMD_NAME.get(ev[2], str(ev[2])) for ev in log])
+
+    def command(self, conn_id, cmd, p1, p2, ext=b''):
+        """
+        execute one command
+
+        Parameters
+        ----------
+        conn_id: int
+        cmd, p1, p2: int
+        ext: bytes
+
+        Returns
+        -------
+        res: int
+        data: bytes
+        """
+        with self._lock:
+            res, data = self._command(cmd, p1, p2, ext)
+            self.log.append((time.monotonic(), conn_id, cmd, p1, p2,
+                             len(ext), res))
+
+        if res == PI_UNKNOWN_COMMAND:
+            self._log.warning('unknown command: %s', cmd)
+
+        return res, data
+
+    def wave_pulses(self, wave_id):
+        """
+        Parameters
+        ----------
+        wave_id: int
+
+        Returns
+        -------
+        pulses: list of (on_mask, off_mask, delay_us)
+            (the wave may be deleted), None: no such wave
+        """
+        with self._lock:
+            pulses = self._wave_pulses.get(wave_id)
+        if pulses is None:
+            return None
+        return list(pulses)
+
+    def _ext_u32(self, ext):
+        return struct.unpack_from('<I', ext)[0] if len(ext) >= 4 else 0
+
+    def _command(self, cmd, p1, p2, ext):
+        # GPIO
+        if cmd in (CMD_MODES, CMD_MODEG, CMD_READ, CMD_WRITE):
+            if p1 > 53:
+                return PI_BAD_GPIO, b''
+            if cmd == CMD_MODES:
+                self.gpio_mode[p1] = p2
+                return 0, b''
+            if cmd == CMD_MODEG:
+                return self.gpio_mode.get(p1, 0), b''
+            if cmd == CMD_READ:
+                return (self.gpio_level >> p1) & 1, b''
+            if p2:
+                self.gpio_level |= 1 << p1
+            else:
+                self.gpio_level &= ~(1 << p1)
+            return 0, b''
+
+        if cmd == CMD_BR1:
+            return self.gpio_level & 0x7fffffff, b''
+
+        if cmd == CMD_HWVER:
+            return self.HWVER, b''
+        if cmd == CMD_PIGPV:
+            return self.PIGPV, b''
+
+        # notification
+        if cmd == CMD_NOIB:
+            self._notify_n += 1
+            return self._notify_n - 1, b''
+        if cmd in (CMD_NB, CMD_NC):
+            return 0, b''
+
+        if cmd in I2C_CMDS:
+            return self._i2c_command(cmd, p1, p2, ext)
+
+        return self._wave_command(cmd, p1, p2, ext)
+
+    def _i2c_command(self, cmd, p1, p2, ext):
+        if cmd == CMD_I2CO:
+            self._i2c[self._i2c_n] = p2
+            self.pca9685.setdefault(p2, PCA9685Regs())
+            self._i2c_n += 1
+            return self._i2c_n - 1, b''
+
+        if p1 not in self._i2c:
+            return PI_BAD_HANDLE, b''
+        dev = self.pca9685[self._i2c[p1]]
+
+        if cmd == CMD_I2CC:
+            del self._i2c[p1]
+            return 0, b''
+        if cmd == CMD_I2CWB:
+            dev.write(p2, bytes([self._ext_u32(ext) & 0xff]))
+            return 0, b''
+        if cmd == CMD_I2CWW:
+            dev.write(p2, struct.pack('<H', self._ext_u32(ext) & 0xffff))
+            return 0, b''
+        if cmd == CMD_I2CWI:
+            dev.write(p2, ext)
+            return 0, b''
+        if cmd == CMD_I2CWD:
+            # first byte: register pointer
+            if ext:
+                dev.write(ext[0], ext[1:])
+            return 0, b''
+        if cmd == CMD_I2CRB:
+            return dev.read(p2, 1)[0], b''
+        if cmd == CMD_I2CRW:
+            return struct.unpack('<H', dev.read(p2, 2))[0], b''
+        if cmd == CMD_I2CRI:
+            data = dev.read(p2, self._ext_u32(ext))
+            return len(data), data
+
+        # CMD_I2CRD
+        data = dev.read(dev.ptr, p2)
+        return len(data), data
+
+    def _wave_busy(self):
+        if self._tx is None:
+            return False
+
+        end_time = self._tx[1]
+        if end_time is not None and time.monotonic() >= end_time:
+            self._tx = None
+            return False
+
+        return True
+
+    def _wave_command(self, cmd, p1, p2, ext):
+        if cmd in (CMD_WVCLR, CMD_WVNEW):
+            self._pulses = []
+            if cmd == CMD_WVCLR:
+                self._waves = {}
+                self._tx = None
+            return 0, b''
+
+        if cmd == CMD_WVAG:
+            self._pulses += [self.PULSE.unpack_from(ext, i)
+                             for i in range(0, len(ext), self.PULSE.size)]
+            return len(self._pulses), b''
+
+        if cmd == CMD_WVCRE:
+            length = sum([p[2] for p in self._pulses]) / 1000000
+            self._waves[self._wave_n] = (self._pulses, length)
+            self._wave_pulses[self._wave_n] = self._pulses
+            self._pulses = []
+            self._wave_n += 1
+            return self._wave_n - 1, b''
+
+        if cmd == CMD_WVDEL:
+            if self._waves.pop(p1, None) is None:
+                return PI_BAD_WAVE_ID, b''
+            return 0, b''
+
+        if cmd in (CMD_WVTX, CMD_WVTXR, CMD_WVTXM):
+            if p1 not in self._waves:
+                return PI_BAD_WAVE_ID, b''
+            pulses, length = self._waves[p1]
+            # WVTXM mode: bit0 .. repeat
+            repeat = cmd == CMD_WVTXR or (cmd == CMD_WVTXM and p2 & 1)
+            self._tx = (p1, None if repeat else time.monotonic() + length)
+            return len(pulses), b''
+
+        if cmd == CMD_WVCHA:
+            # loop counts and delays are ignored
+            length, forever = 0.0, False
+            i = 0
+            while i < len(ext):
+                if ext[i] == 255:
+                    op = ext[i + 1] if i + 1 < len(ext) else 0
+                    forever = forever or op == 3
+                    i += 4 if op in (1, 2) else 2
+                    continue
+                length += self._waves.get(ext[i], ([], 0.0))[1]
+                i += 1
+            self._tx = (WAVE_NOT_FOUND,
+                        None if forever else time.monotonic() + length)
+            return 0, b''
+
+        if cmd == CMD_WVBSY:
+            return int(self._wave_busy()), b''
+
+        if cmd == CMD_WVTAT:
+            if not self._wave_busy():
+                return NO_TX_WAVE, b''
+            return self._tx[0], b''
+
+        if cmd == CMD_WVHLT:
+            self._tx = None
+            return 0, b''
+
+        return PI_UNKNOWN_COMMAND, b''
@@ -0,0 +1,456 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Compiled actuation plan
+
+``music_data`` is compiled once (at ``Player.music_load()``)
+into one timeline of absolute servo push/pull times.
+The song position is accumulated in integer usec (no drift).
+Lead time, power budget (staggering) and busy servos (retrigger/drop)
+are resolved at compile time, in the same way as ``Servo.tap_at()``,
+so that the player only has to wait for the next event
+and write the pulse width.
+
+```python3
+params = movement.plan_params()
+plan = ActuationPlan.load_or_compile(music_data, params,
+                                     cache_file='song.json.plan')
+plan = ActuationPlan.load_or_compile(music_data, params,
+                                     cache_dir='/path/to/plan_dir')
+
+for t, op, ch, idx in plan.events:  # sec from the top of the song
+    ..
+```
+
+The playback rate (``rate``) scales the song position only:
+lead time and push/pull intervals are physical, and busy servos
+are resolved again for the scaled timeline.
+
+### Cache file (JSON)
+
+```
+{"version": 2, "key": "<sha1 of music_data and params>",
+ "length": 123.4, "stats": {..}, "rate": 1.0,
+ "events": [[t, op, ch, idx], ..]}
+```
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import os
+import json
+import hashlib
+from collections.abc import Mapping
+from .servo import stagger_slots
+from .parser import get_delay_us
+from .my_logger import get_logger
+
+PUSH = 1
+PULL = 0
+
+
+class ActuationPlan:
+    """
+    Actuation plan
+
+    Attributes
+    ----------
+    events: list of (t, op, ch, idx)
+        t: sec from the top of the song (may be negative: lead time)
+        op: PUSH or PULL
+        ch: servo channel
+        idx: index of music_data
+    length: float
+        sec
+    stats: dict
+        same keys as ``Servo.stats()``
+    key: str
+    rate: float
+        playback rate (1.0: as written)
+    params: dict or None
+        ``Movement.plan_params()`` of the plan, None: unknown
+    """
+    VERSION = 2
+    CACHE_SUFFIX = '.plan'
+
+    _log = get_logger(__name__, False)
+
+    def __init__(self, events, length, stats, key=None, rate=1.0,
+                 params=None, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        events: list of (t, op, ch, idx)
+        length: float
+        stats: dict
+        key: str
+        rate: float
+        params: dict
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+
+        self.events = events
+        self.length = length
+        self.stats = stats
+        self.key = key
+        self.rate = rate
+        self.params = params
+        self._push_n = None
+
+    def __len__(self):
+        return len(self.events)
+
+    def find(self, music_data_i):
+        """
+        Parameters
+        ----------
+        music_data_i: int
+
+        Returns
+        -------
+        i: int
+            index of the first event of ``music_data_i`` or later
+        """
+        for i, ev in enumerate(self.events):
+            if ev[3] >= music_data_i:
+                return i
+
+        return len(self.events)
+
+    def push_count(self):
+        """
+        Returns
+        -------
+        push_n: dict
+            idx -> number of pushes (events of PUSH)
+        """
+        if self._push_n is None:
+            push_n = {}
+            for t, op, ch, idx in self.events:
+                if op == PUSH:
+                    push_n[idx] = push_n.get(idx, 0) + 1
+            self._push_n = push_n
+
+        return self._push_n
+
+    @staticmethod
+    def _json_default(obj):
+        """ Song, SongEnt """
+        if isinstance(obj, Mapping):
+            return dict(obj)
+        return list(obj)
+
+    @staticmethod
+    def make_key(music_data, params, def_delay):
+        """
+        Returns
+        -------
+        key: str
+            sha1 of music_data, params and def_delay
+        """
+        src = json.dumps([ActuationPlan.VERSION, music_data, params,
+                          def_delay], sort_keys=True,
+                         default=ActuationPlan._json_default)
+        return hashlib.sha1(src.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def cache_dir_path(cls, cache_dir, key):
+        """
+        Parameters
+        ----------
+        cache_dir: str
+        key: str
+            ``make_key()``
+
+        Returns
+        -------
+        cache_file: str
+            named from the key (not from the client)
+        """
+        return os.path.join(cache_dir, key + cls.CACHE_SUFFIX)
+
+    @classmethod
+    def cache_path(cls, music_file):
+        """
+        Parameters
+        ----------
+        music_file: str
+
+        Returns
+        -------
+        cache_file: str
+            next to ``music_file``
+        """
+        return music_file + cls.CACHE_SUFFIX
+
+    @classmethod
+    def compile(cls, music_data, params, def_delay=500, rate=1.0,
+                debug=False):
+        """
+        Parameters
+        ----------
+        music_data: list of {'ch': ch_list, 'delay': delay_msec}
+        params: dict
+            ``Movement.plan_params()``
+        def_delay: int
+            msec
+        rate: float
+            playback rate
+
+        Returns
+        -------
+        plan: ActuationPlan
+        """
+        servo_n = params['servo_n']
+        lead = params['lead']
+        push_interval = params['push_interval']
+        pull_interval = params['pull_interval']
+        push_budget = params['push_budget']
+        push_window = params['push_window']
+        retrigger_tol = params['retrigger_tol']
+
+        stats = {
+            'retriggered': [0] * servo_n,
+            'dropped': [0] * servo_n,
+            'max_late': 0.0,
+            'chords': 0,
+            'staggered_chords': 0,
+            'staggered_pushes': 0,
+            'max_stagger': 0.0,
+        }
+
+        slot_count = {}
+        free_time = [float('-inf')] * servo_n
+        events = []
+
+        def_delay_us = round(def_delay * 1000)
+
+        t_us = 0
+        t = 0.0
+        for idx, data1 in enumerate(music_data):
+            ch_list = data1['ch']
+            delay_us = get_delay_us(data1)
+
+            if ch_list is None:
+                if delay_us is not None:
+                    def_delay_us = delay_us
+                continue
+
+            if delay_us is None:
+                delay_us = def_delay_us
+
+            t_us += delay_us
+            t = t_us / rate / 1000000
+
+            if not ch_list:
+                continue
+
+            push_list = sorted([(ch, t - lead[ch]) for ch in ch_list
+                                if 0 <= ch < servo_n],
+                               key=lambda p: p[1])
+            stats['chords'] += 1
+
+            if push_budget > 0:
+                push_list, staggered, max_stagger = stagger_slots(
+                    push_list, slot_count, push_budget, push_window)
+                if staggered > 0:
+                    stats['staggered_chords'] += 1
+                    stats['staggered_pushes'] += staggered
+                    stats['max_stagger'] = max(stats['max_stagger'],
+                                               max_stagger)
+
+            for ch, push_time in push_list:
+                if push_time < free_time[ch]:
+                    late = free_time[ch] - push_time
+                    if late > retrigger_tol:
+                        stats['dropped'][ch] += 1
+                        continue
+
+                    stats['retriggered'][ch] += 1
+                    stats['max_late'] = max(stats['max_late'], late)
+                    push_time = free_time[ch]
+
+                pull_time = push_time + push_interval[ch]
+                free_time[ch] = pull_time + pull_interval[ch]
+
+                events.append((push_time, PUSH, ch, idx))
+                events.append((pull_time, PULL, ch, idx))
+
+        # pull first, if push and pull are at the same time
+        events.sort(key=lambda ev: (ev[0], ev[1]))
+
+        return cls(events, t, stats, rate=rate, params=params, debug=debug)
+
+    @classmethod
+    def compile_fastest(cls, music_data, params, def_delay=500,
+                        rate_min=0.25, rate_max=4.0, debug=False):
+        """
+        compile at the fastest rate that drops no more notes
+        than ``rate_min`` (bisection, busy servo model)
+
+        Returns
+        -------
+        plan: ActuationPlan
+        """
+        slow = cls.compile(music_data, params, def_delay, rate_min, debug)
+        min_dropped = sum(slow.stats['dropped'])
+
+        fast = cls.compile(music_data, params, def_delay, rate_max, debug)
+        if sum(fast.stats['dropped']) <= min_dropped:
+            return fast
+
+        # slow.rate: OK, rate_max: NG
+        ng_rate = rate_max
+        while ng_rate - slow.rate > 0.01:
+            rate = round((slow.rate * ng_rate) ** 0.5, 3)
+            if rate in (slow.rate, ng_rate):
+                break
+
+            plan = cls.compile(music_data, params, def_delay, rate, debug)
+            if sum(plan.stats['dropped']) <= min_dropped:
+                slow = plan
+            else:
+                ng_rate = rate
+
+        cls._log.debug('rate=%s, dropped=%s',
+                       slow.rate, sum(slow.stats['dropped']))
+        return slow
+
+    def to_dict(self, events=True):
+        """
+        Parameters
+        ----------
+        events: bool
+            False: without ``events`` (written separately)
+
+        Returns
+        -------
+        data: dict
+            version, key, length, stats, rate, events
+        """
+        data = {
+            'version': self.VERSION,
+            'key': self.key,
+            'length': self.length,
+            'stats': self.stats,
+            'rate': self.rate,
+        }
+        if events:
+            data['events'] = self.events
+        return data
+
+    @classmethod
+    def from_dict(cls, data, key=None, debug=False):
+        """
+        Parameters
+        ----------
+        data: dict
+            ``to_dict()``
+        key: str
+            None: don't check
+
+        Returns
+        -------
+        plan: ActuationPlan or None
+            None: other version, or out of date
+        """
+        if data.get('version') != cls.VERSION:
+            return None
+
+        if key is not None and data.get('key') != key:
+            return None
+
+        events = [tuple(ev) for ev in data['events']]
+        return cls(events, data['length'], data['stats'],
+                   key=data['key'], rate=data.get('rate', 1.0),
+                   debug=debug)
+
+    def save(self, cache_file):
+        """
+        Parameters
+        ----------
+        cache_file: str
+        """
+        self._log.debug('cache_file=%s', cache_file)
+
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, mode='w') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+        os.replace(tmp_file, cache_file)
+
+    @classmethod
+    def load(cls, cache_file, key=None, debug=False):
+        """
+        Parameters
+        ----------
+        cache_file: str
+        key: str
+            None: don't check
+
+        Returns
+        -------
+        plan: ActuationPlan or None
+            None: not found, or out of date
+        """
+        try:
+            with open(cache_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as ex:
+            cls._log.debug('%s: %s', type(ex).__name__, ex)
+            return None
+
+        plan = cls.from_dict(data, key, debug=debug)
+        if plan is None:
+            cls._log.debug('%s: out of date', cache_file)
+        return plan
+
+    @classmethod
+    def load_or_compile(cls, music_data, params, def_delay=500,
+                        cache_file=None, rate=1.0, cache_dir=None,
+                        debug=False):
+        """
+        load the plan from ``cache_file``,
+        or compile and save it, if the cache is out of date
+
+        Parameters
+        ----------
+        music_data: list
+        params: dict
+        def_delay: int
+        cache_file: str
+            None: ``cache_dir``
+        rate: float
+            the cache is for ``rate=1.0`` only
+        cache_dir: str
+            the cache file is named from ``make_key()`` in it,
+            None (and ``cache_file`` is None): don't cache
+
+        Returns
+        -------
+        plan: ActuationPlan
+        """
+        if (cache_file is None and cache_dir is None) or rate != 1.0:
+            return cls.compile(music_data, params, def_delay, rate,
+                               debug=debug)
+
+        key = cls.make_key(music_data, params, def_delay)
+        if cache_file is None:
+            cache_file = cls.cache_dir_path(cache_dir, key)
+
+        plan = cls.load(cache_file, key, debug=debug)
+        if plan is not None:
+            cls._log.debug('cache hit: %s', cache_file)
+            plan.params = params  # in the key
+            return plan
+
+        plan = cls.compile(music_data, params, def_delay, debug=debug)
+        plan.key = key
+        try:
+            plan.save(cache_file)
+        except OSError as ex:
+            cls._log.warning('%s: %s', type(ex).__name__, ex)
+
+        return plan
@@ -25,10 +25,17 @@ __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021/01'
 
 import threading
-import copy
 import time
-
-from . import Movement, MovementWav1, MovementWav2, MovementWav3
+import math
+import bisect
+
+from .plan import ActuationPlan, PUSH, PULL
+from .rt import set_realtime, get_status, lock_memory, LatenessHistogram
+from .clock import RealClock, SimClock
+from .parser import coalesce, get_delay_us, COALESCE_FIRST
+from .song import Song
+from .motion_profile import MotionProfile
+from .playlist import Playlist, Track, load_music_file
 from .my_logger import get_logger
 
 
@@ -61,6 +68,12 @@ class Player:
     player.music_stop()
     player.music_wait()
 
+    ## Playlist (gapless)
+    player.playlist_add(music_file='song1.mid')
+    player.playlist_add(music_data)
+    player.playlist_loop(True)
+    player.playlist_next()
+
     music_player.end()  # call at the end of using ``player``
     ============
 
@@ -73,17 +86,55 @@ class Player:
     WAVMODE_PIANO = 1
     WAVMODE_PIANO_FULL = 2
     WAVMODE_MIDI_FULL = 3
+    WAVMODE_SIM = 4          # simulation (no hardware)
 
     DEF_DELAY = 500  # msec
 
+    # if the music thread is late more than this, re-anchor the timeline
+    RESYNC_SEC = 0.5
+
+    # playback rate
+    TEMPO_MIN = 0.25
+    TEMPO_MAX = 4.0
+    # tempo change: events of the new plan up to this much in the past
+    # are still played (pushes done by the old plan are skipped)
+    TEMPO_OVERLAP_SEC = 0.1
+
+    # clock correction (``adjust_clock()``) per event, at most
+    CLOCK_SLEW_SEC = 0.002
+
+    # pause between repeats
+    REPEAT_PAUSE_SEC = 1.0
+
     ROTATION_SPEED = 10
     ROTATION_GPIO = [5, 6, 13, 19]
+    ROTATION_BACKEND = 'thread'
+
+    # max number of servos that start a push at once (0: unlimited)
+    PUSH_BUDGET = 5
+
+    # rotation_tempo mode:
+    #   rotation_speed is for this number of notes per second
+    ROTATION_TEMPO_REF_NPS = 4.0
+    ROTATION_TEMPO_WINDOW = 4.0   # sec
+    ROTATION_TEMPO_UPDATE = 1.0   # sec
 
     def __init__(self,
                  wav_mode=WAVMODE_NONE,
                  rotation_speed=ROTATION_SPEED,
                  rotation_gpio=ROTATION_GPIO,
                  wavdir='wav',
+                 rotation_backend=ROTATION_BACKEND,
+                 rotation_tempo=False,
+                 push_budget=PUSH_BUDGET,
+                 actuator_proc=False,
+                 realtime=False,
+                 rt_cpu=None,
+                 clock=None,
+                 coalesce_msec=0,
+                 coalesce_mode=COALESCE_FIRST,
+                 boards=None,
+                 plan_dir=None,
                  debug=False):
         """ Constructor
         initialize and start rotation
@@ -92,12 +143,42 @@ class Player:
         ----------
         wav_mode: int
             Wav File mode
-        rotation_speed: int
-            speed of rotation motor (0 .. 10)
+        rotation_speed: float
+            speed of rotation motor (0.0 .. 10.0)
             0: stop rotation motor
         rotation_gpio: list of int
             GPIO pin number of rotation motor (stepper motor)
         wavdir: str
+        rotation_backend: str
+            'thread': StepMtrTh, 'wave': pigpio waveform
+        rotation_tempo: bool
+            tie rotation speed to the tempo of the song
+        push_budget: int
+            max number of servos that start a push at once
+            0: unlimited
+        actuator_proc: bool
+            servo writes run in a child process
+        realtime: bool
+            SCHED_FIFO, small timer slack and mlockall()
+            for the music thread (and the actuator process),
+            mlockall() of this process: MCL_ONFAULT,
+            and not with ``actuator_proc``
+        rt_cpu: int
+            pin the music thread to this CPU, None: don't pin
+        clock: RealClock or SimClock
+            None: RealClock (WAVMODE_SIM: SimClock(realtime=True))
+        coalesce_msec: float
+            notes within this window are merged into one chord
+            at ``music_load()``, 0: don't merge
+        coalesce_mode: str
+            time of the merged chord: 'first', 'mean' or 'grid'
+        boards: str
+            servo channels over several boards (``musicbox.channel_map``)
+            ex. "0x40=15,0x41=15", None: one PCA9685
+        plan_dir: str
+            cache directory of the actuation plans
+            (the files are named from the song and the parameters),
+            used when ``plan_file`` is not given, None: no cache
         """
         self._dbg = debug
         self._log = get_logger(self.__class__.__name__, self._dbg)
@@ -105,22 +186,80 @@ class Player:
         self._log.debug('rotation_speed=%s', rotation_speed)
         self._log.debug('rotation_gpio=%s', rotation_gpio)
         self._log.debug('wavdir=%s', wavdir)
+        self._log.debug('rotation_backend=%s', rotation_backend)
+        self._log.debug('rotation_tempo=%s', rotation_tempo)
+        self._log.debug('push_budget=%s', push_budget)
+        self._log.debug('actuator_proc=%s', actuator_proc)
+        self._log.debug('realtime=%s, rt_cpu=%s', realtime, rt_cpu)
+        self._log.debug('coalesce=%s msec, %s', coalesce_msec, coalesce_mode)
+        self._log.debug('boards=%s', boards)
+        self._log.debug('plan_dir=%s', plan_dir)
 
         self._wav_mode = wav_mode
         self._rotation_speed = rotation_speed
         self._rotation_gpio = rotation_gpio
         self._wavdir = wavdir
+        self._rotation_backend = rotation_backend
+        self._rotation_tempo = rotation_tempo
+        self._rotation_tempo_time = 0
 
         self._def_delay = self.DEF_DELAY
+        self._plan_dir = plan_dir
 
         self._music_data = None
         self._music_data_i = 0
         self._music_active = False
         self._music_th = None
+        self._repeat = True
+        self._wakeup = threading.Event()  # music_pause(): stop waiting
+        self._song_stats = {}
+        self._plan = None
+        self._plan_lock = threading.Lock()
+
+        self._tempo = 1.0
+        self._tempo_auto = False
+
+        self._start_at = None
+        self._clock_adj = 0.0
+
+        self._coalesce_msec = coalesce_msec
+        self._coalesce_mode = coalesce_mode
+        self._coalesce_stats = {}
+
+        self._playlist = Playlist(self._prepare_track, debug=self._dbg)
+
+        self._clock = clock
+        if self._clock is None:
+            if self._wav_mode == self.WAVMODE_SIM:
+                self._clock = SimClock(realtime=True)
+            else:
+                self._clock = RealClock()
+
+        self._realtime = realtime
+        self._rt_cpu = rt_cpu
+        self.rt_status = get_status()
+        self._lateness = LatenessHistogram()
+
+        rt_kw = None
+        if self._realtime:
+            if not actuator_proc:
+                # the taps are threads: don't pin their whole stacks
+                # (the actuator process locks all of its own memory)
+                lock_memory(onfault=True)
+            rt_kw = {'cpu': self._rt_cpu}
+
+        # import movement (pygame, pigpio, ..) only when needed
+        from . import Movement, MovementWav1, MovementWav2, MovementWav3
+        from . import MovementSim
 
         if self._wav_mode == self.WAVMODE_NONE:
             self._movement = Movement(
                 self._rotation_gpio, self._rotation_speed,
+                rotation_backend=self._rotation_backend,
+                push_budget=push_budget,
+                actuator_proc=actuator_proc,
+                rt_kw=rt_kw,
+                boards=boards,
                 debug=self._dbg)
 
         elif self._wav_mode == self.WAVMODE_PIANO:
@@ -135,6 +274,11 @@ class Player:
             self._movement = MovementWav3(wav_topdir=self._wavdir,
                                           debug=self._dbg)
 
+        elif self._wav_mode == self.WAVMODE_SIM:
+            self._movement = MovementSim(
+                self._rotation_speed, push_budget=push_budget,
+                clock=self._clock, boards=boards, debug=self._dbg)
+
         else:
             msg = 'invalid wav_mode: %s' % self._wav_mode
             raise ValueError(msg)
@@ -146,25 +290,105 @@ class Player:
     def end(self):
         """ Call at the end of program
 
-        stop movement
+        stop music (the actuations that are not executed yet are
+        canceled, and the servos are pulled), and stop movement
         """
         self._log.debug('doing ..')
 
+        self.music_pause()
         self._movement.rotation_speed(0)
         self._movement.end()
 
         self._log.debug('done')
 
+    def movement(self):
+        """
+        Returns
+        -------
+        movement: MovementBase
+        """
+        return self._movement
+
+    def clock(self):
+        """
+        Returns
+        -------
+        clock: RealClock or SimClock
+        """
+        return self._clock
+
     def rotation_speed(self, speed=ROTATION_SPEED):
         """
         Parameters
         ----------
-        speed: int
+        speed: float
+            0 .. ``MotionProfile.SPEED_MAX`` (NaN, inf: ignored),
+            base speed in rotation_tempo mode
         """
         self._log.debug('speed=%s', speed)
+
+        speed = float(speed)
+        if not math.isfinite(speed):
+            self._log.warning('speed=%s: not finite .. ignored', speed)
+            return
+
+        if not 0 <= speed <= MotionProfile.SPEED_MAX:
+            self._log.warning('speed=%s: out of range', speed)
+            speed = min(max(speed, 0.0), float(MotionProfile.SPEED_MAX))
+
         self._rotation_speed = speed
         self._movement.rotation_speed(self._rotation_speed)
 
+    def rotation_tempo(self, on=True):
+        """ rotation_tempo mode on/off
+
+        In rotation_tempo mode, rotation speed follows the tempo
+        (notes per second) of the song while playing.
+
+        Parameters
+        ----------
+        on: bool
+        """
+        self._log.debug('on=%s', on)
+        self._rotation_tempo = on
+
+        if not on:
+            self._movement.rotation_speed(self._rotation_speed)
+
+    def update_rotation_tempo(self):
+        """ set rotation speed from the current tempo """
+        now = self._clock.monotonic()
+        if now - self._rotation_tempo_time < self.ROTATION_TEMPO_UPDATE:
+            return
+
+        self._rotation_tempo_time = now
+
+        if self._rotation_speed <= 0:
+            # stopped by the user: the tempo doesn't start it
+            return
+
+        # the next chord (may be just after the end of the song)
+        pos_i = min(self._music_data_i, len(self._music_data) - 1)
+        pos_sec = self._music_data[pos_i].get('abs_time')
+        if pos_sec is None:
+            return
+
+        note_n = 0
+        for i in range(pos_i, -1, -1):
+            data1 = self._music_data[i]
+            if data1.get('abs_time', pos_sec) <= \
+               pos_sec - self.ROTATION_TEMPO_WINDOW:
+                break
+            if data1['ch']:
+                note_n += len(data1['ch'])
+
+        nps = note_n / self.ROTATION_TEMPO_WINDOW
+        speed = self._rotation_speed * nps / self.ROTATION_TEMPO_REF_NPS
+        speed = min(max(speed, 1.0), 10.0)
+        self._log.debug('nps=%.2f, speed=%.2f', nps, speed)
+
+        self._movement.rotation_speed(speed)
+
     def single_play(self, ch_list=None):
         """
         Parameters
@@ -209,15 +433,95 @@ class Player:
             self._log.debug('delay=%s (default)', delay)
 
         self._log.debug('sleep %.2f msec', delay)
-        time.sleep(delay / 1000)
+        self._clock.sleep(delay / 1000)
 
         self.single_play(ch_list)
 
         self._log.debug('done')
 
-    def music_load(self, music_data, start_flag=True):
+    def sleep_and_single_play_at(self, ch_list, delay_us, t0, pos_us,
+                                 rate=1.0):
+        """ sleep and single play (absolute time)
+
+        Same as ``sleep_and_single_play()``, but the play time is
+        ``t0 + (pos_us + delay_us)`` on the integer usec timeline
+        (no accumulated error),
+        and the movement is called earlier by its lead time,
+        so that the sound comes out at the play time.
+
+        Parameters
+        ----------
+        ch_list: list of int
+            channel list
+        delay_us: int
+            usec
+        t0: float
+            top of the song (``clock.monotonic()``)
+        pos_us: int
+            position of the previous data (usec from the top)
+        rate: float
+            playback rate
+
+        Returns
+        -------
+        t0: float
+            top of the song (changed by resync)
+        pos_us: int
+            position of this data
+        """
+        self._log.debug('delay_us=%s, ch_list=%s', delay_us, ch_list)
+
+        if ch_list is None:
+            if delay_us is None:
+                self._log.debug('do nothing')
+            else:
+                self._def_delay = delay_us / 1000
+                self._log.debug('change default delay: %s',
+                                self._def_delay)
+
+            return t0, pos_us  # no delay
+
+        if delay_us is None:
+            delay_us = round(self._def_delay * 1000)
+            self._log.debug('delay_us=%s (default)', delay_us)
+
+        pos_us += delay_us
+        play_time = t0 + pos_us / rate / 1000000
+
+        now = self._clock.monotonic()
+        if now - play_time > self.RESYNC_SEC:
+            self._log.warning('late %.3f sec: resync',
+                              now - play_time)
+            t0 += now - play_time
+            play_time = now
+
+        wait_sec = play_time - self._movement.max_lead() - now
+        if wait_sec > 0:
+            if self._clock.wait(self._wakeup, wait_sec):
+                # paused: this note is played when resumed
+                return t0, pos_us
+            self._lateness.add(self._clock.monotonic() - (now + wait_sec))
+
+        if ch_list:
+            self._log.info('ch_list=%s', ch_list)
+            self._movement.single_play_at(ch_list, play_time)
+
+        return t0, pos_us
+
+    def music_load(self, music_data, start_flag=True, plan_file=None,
+                   coalesce_msec=None, copy=True):
         """ load music data
 
+        A ``Song`` (immutable) is taken by reference.
+        A list is frozen into a ``Song`` (``copy=True``),
+        or taken by reference (``copy=False``: ownership transfer,
+        the caller must not change it afterwards).
+
+        Near-simultaneous notes are merged into one chord
+        (``coalesce_msec``).
+        If the movement supports it, music data is compiled into
+        an actuation plan (``ActuationPlan``).
+
         Parameters
         ----------
         music_data: list of {'ch': ch_list, 'delay': delay_msec}
@@ -225,6 +529,13 @@ class Player:
             delay_msec: int
         start_flag: bool
             start music or not
+        plan_file: str
+            cache file of the actuation plan (a local path, not from
+            a client), None: ``plan_dir``
+        coalesce_msec: float
+            None: the value given to the constructor
+        copy: bool
+            False: take ``music_data`` (list) by reference
 
           music_data ex.
           [
@@ -236,12 +547,20 @@ class Player:
                :
                :
           ]
+
+          ``delay_us`` and ``abs_time_us`` (integer usec), if any,
+          take precedence over ``delay`` and ``abs_time``.
         """
         # self._log.debug('music_data=%s', music_data)
 
-        self._music_data = copy.deepcopy(music_data)
+        music_data, plan, coalesce_stats = self._prepare(
+            music_data, plan_file, coalesce_msec, copy)
 
         self.music_stop()
+        self._movement.reset_stats()
+        self._playlist.done()
+
+        self._set_song(music_data, plan, coalesce_stats)
 
         if self._music_data_i >= len(self._music_data):
             self._music_data_i = 0
@@ -249,6 +568,343 @@ class Player:
         if start_flag:
             self.music_play()
 
+    def _prepare(self, music_data, plan_file=None, coalesce_msec=None,
+                 copy=True):
+        """ freeze, coalesce and compile music data
+
+        Returns
+        -------
+        music_data: Song or list
+        plan: ActuationPlan or None
+        coalesce_stats: dict
+        """
+        if copy and not isinstance(music_data, Song):
+            music_data = Song.from_music_data(music_data)
+
+        if coalesce_msec is None:
+            coalesce_msec = self._coalesce_msec
+
+        coalesce_stats = {}
+        if coalesce_msec > 0:
+            music_data, coalesce_stats = coalesce(
+                music_data, coalesce_msec, self._coalesce_mode,
+                def_delay=self._def_delay)
+            self._log.info('coalesce(%s msec, %s): %s', coalesce_msec,
+                           self._coalesce_mode, coalesce_stats)
+
+        plan = self._compile_plan(music_data, plan_file)
+
+        return music_data, plan, coalesce_stats
+
+    def _compile_plan(self, music_data, plan_file=None):
+        """ compile an actuation plan at the current tempo
+
+        Returns
+        -------
+        plan: ActuationPlan or None
+            None: the movement doesn't support it
+        """
+        params = self._movement.plan_params()
+        if params is None:
+            return None
+
+        start_time = time.monotonic()
+        if self._tempo_auto:
+            plan = ActuationPlan.compile_fastest(
+                music_data, params, self._def_delay,
+                self.TEMPO_MIN, self.TEMPO_MAX, debug=self._dbg)
+        else:
+            plan = ActuationPlan.load_or_compile(
+                music_data, params, self._def_delay,
+                cache_file=plan_file, rate=self._tempo,
+                cache_dir=self._plan_dir, debug=self._dbg)
+        self._log.info('plan: %s events, rate %s, %.1f msec',
+                       len(plan), plan.rate,
+                       (time.monotonic() - start_time) * 1000)
+
+        return plan
+
+    def _plan_stale(self, plan):
+        """
+        Returns
+        -------
+        stale: bool
+            the servo parameters were changed after compiling ``plan``
+        """
+        return (plan is not None and
+                plan.params != self._movement.plan_params())
+
+    def _set_song(self, music_data, plan, coalesce_stats):
+        """ set the current song """
+        stale = self._plan_stale(plan)
+        if plan is not None and (stale or plan.rate != self._tempo):
+            if self._tempo_auto and not stale:
+                self._tempo = plan.rate
+            else:
+                # tempo or servo parameters were changed while preparing
+                plan = self._compile_plan(music_data)
+                if self._tempo_auto:
+                    self._tempo = plan.rate
+
+        with self._plan_lock:
+            self._music_data = music_data
+            self._plan = plan
+            self._coalesce_stats = coalesce_stats
+
+    def _prepare_track(self, track):
+        """ prepare a track of the playlist (in a background thread) """
+        music_data = track.src_data
+        copy = track.copy
+        if music_data is None:
+            ch_n = None
+            if self._wav_mode in (self.WAVMODE_NONE, self.WAVMODE_SIM):
+                ch_n = self.ch_n  # fit MIDI notes to all the boards
+            music_data = load_music_file(track.music_file, ch_n,
+                                         debug=self._dbg)
+            copy = False  # nobody else has it
+
+        (track.music_data, track.plan,
+         track.coalesce_stats) = self._prepare(music_data, track.plan_file,
+                                               track.coalesce_msec, copy)
+        track.src_data = None
+
+    def _next_track(self):
+        """ switch to the next track of the playlist
+
+        Returns
+        -------
+        track: Track or None
+            None: no more tracks
+        """
+        track = self._playlist.pop()
+        if track is None:
+            return None
+
+        self._log.info('next track: %s', track)
+        self._set_song(track.music_data, track.plan, track.coalesce_stats)
+        self._music_data_i = 0
+        return track
+
+    def music_tempo(self, rate=1.0):
+        """ playback rate
+
+        The loaded music data is not changed.
+        The actuation plan is compiled for the new rate,
+        and the player continues from the current position.
+
+        Parameters
+        ----------
+        rate: float or 'auto'
+            TEMPO_MIN .. TEMPO_MAX (NaN, inf: ignored),
+            'auto': the fastest rate that drops no more notes
+            than the slowest one (busy servo model)
+
+        Returns
+        -------
+        rate: float
+        """
+        self._log.debug('rate=%s', rate)
+
+        if rate == 'auto':
+            if self._movement.plan_params() is None:
+                self._log.warning('auto: not supported (wav_mode=%s)',
+                                  self._wav_mode)
+                return self._tempo
+
+            self._tempo_auto = True
+        else:
+            rate = float(rate)
+            if not math.isfinite(rate):
+                self._log.warning('rate=%s: not finite .. ignored', rate)
+                return self._tempo
+
+            self._tempo_auto = False
+            if not self.TEMPO_MIN <= rate <= self.TEMPO_MAX:
+                self._log.warning('rate=%s: out of range', rate)
+                rate = min(max(rate, self.TEMPO_MIN), self.TEMPO_MAX)
+            self._tempo = rate
+
+        self._switch_plan()
+        return self._tempo
+
+    def _switch_plan(self):
+        """ compile the plan of the current song again, and switch to it
+        (the player continues from the current position)
+        """
+        music_data = self._music_data
+        if music_data is None or self._plan is None:
+            return
+
+        plan = self._compile_plan(music_data)
+        with self._plan_lock:
+            if self._music_data is not music_data:
+                # the song was changed while compiling
+                return
+
+            # the plan executor switches to this plan
+            self._plan = plan
+            self._tempo = plan.rate
+
+        self._log.info('rate=%s, dropped=%s',
+                       plan.rate, sum(plan.stats['dropped']))
+
+    def update_plan(self):
+        """ compile the plan again, if the servo parameters are changed
+
+        The tracks of the playlist are compiled again
+        when they are played (``_set_song()``).
+        """
+        if not self._plan_stale(self._plan):
+            return
+
+        self._log.info('servo parameters changed: compile again')
+        self._switch_plan()
+
+    def get_music_tempo(self):
+        """
+        Returns
+        -------
+        rate: float
+        """
+        return self._tempo
+
+    def playlist_add(self, music_data=None, music_file=None, name=None,
+                     plan_file=None, coalesce_msec=None, copy=True):
+        """ add a track to the playlist
+
+        The next track is prepared in background
+        while the current one plays.
+
+        Parameters
+        ----------
+        music_data: list of MusicDataEnt or Song
+        music_file: str
+            MIDI, music data (JSON) or paper tape file,
+            used if ``music_data`` is None
+        name: str
+        plan_file: str
+        coalesce_msec: float
+        copy: bool
+            see ``music_load()``
+
+        Returns
+        -------
+        track: Track
+        """
+        self._log.debug('music_file=%s, name=%s', music_file, name)
+
+        track = Track(music_data, music_file, name,
+                      plan_file, coalesce_msec, copy)
+        self._playlist.add(track)
+        return track
+
+    def playlist_next(self, repeat=True):
+        """ start the next track of the playlist now
+
+        Returns
+        -------
+        result: bool
+            False: no more tracks
+        """
+        self._log.debug('')
+
+        self.music_pause()
+        if self._next_track() is None:
+            self._log.warning('no more tracks')
+            return False
+
+        self.music_play(repeat)
+        return True
+
+    def playlist_shuffle(self, on=True):
+        """ shuffle on/off """
+        self._playlist.set_shuffle(on)
+
+    def playlist_loop(self, on=True):
+        """ loop on/off """
+        self._playlist.set_loop(on)
+
+    def playlist_clear(self):
+        """ remove all tracks except the current one """
+        self._playlist.clear()
+
+    def playlist_status(self):
+        """
+        Returns
+        -------
+        status: dict
+            current, next, queue, loop, shuffle
+        """
+        return self._playlist.status()
+
+    def get_state(self):
+        """ state for a warm restart (``musicbox.snapshot``)
+
+        Returns
+        -------
+        state: dict
+            music_data: Song, plan: ActuationPlan, coalesce_stats: dict
+            .. by reference (None: no song),
+            pos: index of music_data, playing, repeat,
+            tempo, tempo_auto, def_delay, rotation_speed, rotation_tempo,
+            playlist: ``Playlist.tracks()``
+        """
+        with self._plan_lock:
+            music_data = self._music_data
+            plan = self._plan
+            coalesce_stats = self._coalesce_stats
+
+        return {
+            'music_data': music_data,
+            'plan': plan,
+            'coalesce_stats': coalesce_stats,
+            'pos': self._music_data_i,
+            'playing': self.is_playing(),
+            'repeat': self._repeat,
+            'tempo': self._tempo,
+            'tempo_auto': self._tempo_auto,
+            'def_delay': self._def_delay,
+            'rotation_speed': self._rotation_speed,
+            'rotation_tempo': self._rotation_tempo,
+            'playlist': self._playlist.tracks(),
+        }
+
+    def set_state(self, state):
+        """ restore ``get_state()``, and resume playing
+
+        The song is not parsed again. The plan is compiled
+        only if it is None (ex. the servo parameters were changed).
+
+        Parameters
+        ----------
+        state: dict
+        """
+        self._log.debug('pos=%s, playing=%s', state['pos'], state['playing'])
+
+        self.music_stop()
+
+        self._tempo = state['tempo']
+        self._tempo_auto = state['tempo_auto']
+        self._def_delay = state['def_delay']
+        self.rotation_speed(state['rotation_speed'])
+        self.rotation_tempo(state['rotation_tempo'])
+
+        music_data = state['music_data']
+        if music_data is not None:
+            plan = state['plan']
+            if plan is None:
+                plan = self._compile_plan(music_data)
+            self._set_song(music_data, plan, state['coalesce_stats'])
+
+            self._music_data_i = state['pos']
+            if self._music_data_i >= len(music_data):
+                self._music_data_i = 0
+
+        self._playlist.restore(**state['playlist'])
+
+        if state['playing']:
+            self.music_play(state['repeat'])
+
     def music_th(self, music_data_i, repeat=True):
         """ music thread function
 
@@ -261,6 +917,10 @@ class Player:
         """
         self._log.debug('music_data_i=%s', music_data_i)
 
+        if self._music_data is None and len(self._playlist) > 0:
+            self._next_track()
+            music_data_i = 0
+
         if self._music_data is None:
             self._log.warning('music_data=%s', self._music_data)
             return
@@ -272,29 +932,319 @@ class Player:
         self._music_data_i = music_data_i
         self._music_active = True
 
+        start_at = self._start_at
+        self._start_at = None
+
+        if self._realtime:
+            self.rt_status = set_realtime(cpu=self._rt_cpu)
+
+        if self._plan is not None:
+            self.plan_exec(repeat, start_at)
+            return
+
+        t0 = self._clock.monotonic()
+        if start_at is not None:
+            t0 = start_at
+        pos_us = 0
+        rate = self._tempo
+        clock_adj = self._clock_adj
+        track = self._playlist.current
+        if track is not None:
+            track.start_time = t0
+
         while True:
             while self._music_active:
                 if self._music_data_i >= len(self._music_data):
                     self._music_data_i = 0
+                    self.update_song_stats()
                     break
 
+                if self._tempo != rate:
+                    # the song position is preserved
+                    t0 += pos_us / 1000000 * (1 / rate - 1 / self._tempo)
+                    rate = self._tempo
+
+                if self._clock_adj != clock_adj:
+                    step = min(max(self._clock_adj - clock_adj,
+                                   -self.CLOCK_SLEW_SEC), self.CLOCK_SLEW_SEC)
+                    t0 += step
+                    clock_adj += step
+
                 data1 = self._music_data[self._music_data_i]
-                self.sleep_and_single_play(data1['ch'],
-                                           data1['delay'])
+                t0, pos_us = self.sleep_and_single_play_at(
+                    data1['ch'], get_delay_us(data1), t0, pos_us, rate)
+                if not self._music_active:
+                    break
+
+                if self._rotation_tempo:
+                    self.update_rotation_tempo()
+
                 self._music_data_i += 1
 
             if not self._music_active:
                 break
 
-            if not repeat:
+            in_playlist = self._playlist.current is not None
+            track = self._next_track()
+            if track is not None:
+                # gapless: continue on the same timeline
+                t0 += pos_us / rate / 1000000
+                pos_us = 0
+                track.start_time = t0
+                continue
+
+            if not repeat or in_playlist:
                 break
 
-            time.sleep(1)
+            t0 += pos_us / rate / 1000000 + self.REPEAT_PAUSE_SEC
+            pos_us = 0
 
         self._msuci_active = False
 
+        if self._rotation_tempo:
+            self._movement.rotation_speed(self._rotation_speed)
+
+        self._log.debug('done')
+
+    def plan_exec(self, repeat=True, start_at=None):
+        """ music thread function (actuation plan executor)
+
+        wait for the next event and write the pulse width .. only
+
+        Parameters
+        ----------
+        repeat: bool
+            repeat flag
+        start_at: float
+            top of the song (``clock.monotonic()``), None: now
+        """
+        plan = self._plan
+        events = plan.events
+        if len(events) == 0:
+            self._log.warning('no events')
+            return
+
+        actuate_at = self._movement.actuate_at
+        actuate_batch = self._movement.actuate_batch
+        batch = []    # actuations that are due (written before sleeping)
+        lookahead = self._movement.lookahead
+        monotonic = self._clock.monotonic
+        wait = self._clock.wait
+        wakeup = self._wakeup
+        resync_sec = self.RESYNC_SEC
+        lateness = self._lateness.add
+        pushed = set()
+        push_n = plan.push_count()
+        done_n = {}   # idx -> pushes executed (or skipped)
+        carry = []    # pulls scheduled by the previous plan (tempo change)
+        skip = set()  # pushes done by the previous plan (idx, ch)
+        clock_adj = self._clock_adj
+        slew = self.CLOCK_SLEW_SEC
+
+        i = plan.find(self._music_data_i)
+        if i >= len(events):
+            # at the end: from the top
+            i = 0
+        if i == 0:
+            t0 = monotonic() - min(events[0][0], 0.0)
+        elif i < len(events):
+            t0 = monotonic() - events[i][0]
+        if start_at is not None:
+            t0 = start_at - (events[i][0] if 0 < i < len(events) else 0.0)
+        track = self._playlist.current
+        if track is not None:
+            track.start_time = t0
+
+        while True:
+            while self._music_active and (i < len(events) or carry):
+                if self._plan is not plan:
+                    # tempo changed
+                    t0, i, carry, skip = self.tempo_switch(
+                        plan, self._plan, t0, i, pushed)
+                    plan = self._plan
+                    events = plan.events
+                    push_n = plan.push_count()
+                    done_n = {}
+                    continue
+
+                if self._clock_adj != clock_adj:
+                    step = min(max(self._clock_adj - clock_adj, -slew), slew)
+                    t0 += step
+                    clock_adj += step
+
+                if carry and (i >= len(events) or
+                              carry[0][0] <= t0 + events[i][0]):
+                    ev_time, ch = carry.pop(0)
+                    op, idx = PULL, None
+                else:
+                    t, op, ch, idx = events[i]
+                    ev_time = t0 + t
+                    i += 1
+
+                deadline = ev_time - lookahead
+                wait_sec = deadline - monotonic()
+                if wait_sec > 0:
+                    if batch:
+                        actuate_batch(batch)
+                        batch = []
+                    if wait(wakeup, wait_sec):
+                        # paused: the event is not executed
+                        break
+                    lateness(monotonic() - deadline)
+                elif wait_sec < -resync_sec:
+                    self._log.warning('late %.3f sec: resync', -wait_sec)
+                    t0 -= wait_sec
+                    ev_time -= wait_sec
+
+                if op == PUSH and idx is not None:
+                    done_n[idx] = done_n.get(idx, 0) + 1
+                    if done_n[idx] == push_n[idx] and \
+                       idx >= self._music_data_i:
+                        # the chord is done: pause/resume from the next one
+                        self._music_data_i = idx + 1
+
+                if op == PUSH:
+                    if ch in pushed or (skip and (idx, ch) in skip):
+                        continue
+                    pushed.add(ch)
+                else:
+                    if ch not in pushed:
+                        continue
+                    pushed.discard(ch)
+                    if carry and idx is not None:
+                        carry = [c for c in carry if c[1] != ch]
+
+                batch.append((ev_time, op, ch))
+
+                if self._rotation_tempo:
+                    self.update_rotation_tempo()
+
+            if batch:
+                actuate_batch(batch)
+                batch = []
+
+            if not self._music_active:
+                break
+
+            self._music_data_i = 0
+            self.update_song_stats()
+            skip = set()
+            done_n = {}
+
+            length = plan.length
+            last_t = events[-1][0] if events else 0.0
+            in_playlist = self._playlist.current is not None
+            track = self._next_track()
+            if track is not None:
+                # gapless: the next song starts at the end of this song
+                # (or just after the last event of this song)
+                plan = self._plan
+                events = plan.events
+                push_n = plan.push_count()
+                first_t = min(events[0][0], 0.0) if events else 0.0
+                t0 += max(length, last_t - first_t)
+                track.start_time = t0
+                i = 0
+                continue
+
+            if not repeat or in_playlist:
+                break
+
+            plan = self._plan
+            events = plan.events
+            push_n = plan.push_count()
+            first_t = min(events[0][0], 0.0) if events else 0.0
+            t0 += (max(length, last_t - first_t) +
+                   self.REPEAT_PAUSE_SEC)
+            i = 0
+
+        # don't leave servos pushed
+        self._movement.cancel()
+        for ch in pushed:
+            actuate_at(monotonic(), PULL, ch)
+
+        if self._rotation_tempo:
+            self._movement.rotation_speed(self._rotation_speed)
+
         self._log.debug('done')
 
+    def tempo_switch(self, old_plan, new_plan, t0, i, pushed):
+        """ continue with a plan of another rate, at the same position
+
+        Parameters
+        ----------
+        old_plan, new_plan: ActuationPlan
+        t0: float
+            top of the song (old plan)
+        i: int
+            next event of the old plan
+        pushed: set of int
+            channels pushed now
+
+        Returns
+        -------
+        t0: float
+            top of the song (new plan)
+        i: int
+            next event of the new plan
+        carry: list of (event_time, ch)
+            pulls of ``pushed``, as scheduled by the old plan
+        skip: set of (idx, ch)
+            recent pushes of the old plan
+        """
+        now = self._clock.monotonic()
+        old_events = old_plan.events
+
+        # the song position is preserved
+        new_t0 = now - (now - t0) * old_plan.rate / new_plan.rate
+
+        carry = []
+        rest = set(pushed)
+        for t, op, ch, idx in old_events[i:]:
+            if not rest:
+                break
+            if op == PULL and ch in rest:
+                carry.append((t0 + t, ch))
+                rest.discard(ch)
+
+        t_min = now - self.TEMPO_OVERLAP_SEC
+        skip = set()
+        for t, op, ch, idx in reversed(old_events[:i]):
+            if t0 + t < t_min:
+                break
+            if op == PUSH:
+                skip.add((idx, ch))
+
+        new_i = bisect.bisect_left(new_plan.events, (t_min - new_t0,))
+
+        self._log.info('rate %s -> %s: event %s/%s -> %s/%s',
+                       old_plan.rate, new_plan.rate,
+                       i, len(old_events), new_i, len(new_plan.events))
+        return new_t0, new_i, carry, skip
+
+    def update_song_stats(self):
+        """ save and reset actuation statistics at the end of a song """
+        self._song_stats = self._movement.stats()
+        if self._plan is not None:
+            self._song_stats.update(self._plan.stats)
+        if self._coalesce_stats:
+            self._song_stats['coalesce'] = self._coalesce_stats
+        self._song_stats['tempo'] = self._tempo
+        self._song_stats['policy'] = self.rt_status['policy']
+        self._song_stats['lateness'] = self._lateness.to_dict()
+        self._lateness.reset()
+        self._movement.reset_stats()
+        self._log.info('song stats: %s', self._song_stats)
+
+    def song_stats(self):
+        """
+        Returns
+        -------
+        stats: dict
+            actuation statistics of the last song played to the end
+        """
+        return self._song_stats
+
     def get_music_length_sec(self):
         """
         """
@@ -318,15 +1268,21 @@ class Player:
         if not self._music_active:
             pos_sec = -1
         else:
-            pos_sec = self._music_data[self._music_data_i]['abs_time']
+            pos_i = min(self._music_data_i, len(self._music_data) - 1)
+            pos_sec = self._music_data[pos_i]['abs_time']
 
         self._log.debug('pos_sec_=%s', pos_sec)
         return pos_sec
 
-    def music_play(self):
+    def music_play(self, repeat=True):
         """ start music
 
         This function starts sub-thread and returns immidiately
+
+        Parameters
+        ----------
+        repeat: bool
+            repeat flag
         """
         self._log.debug('music_th=%s', self._music_th)
 
@@ -336,19 +1292,61 @@ class Player:
                 return
 
         self._log.debug('music_data_i=%s', self._music_data_i)
+        self._repeat = repeat
+        self._wakeup.clear()
         self._music_th = threading.Thread(target=self.music_th,
-                                          args=(self._music_data_i,),
+                                          args=(self._music_data_i,
+                                                repeat),
                                           daemon=True)
         self._music_th.start()
 
         self._log.debug('done: _music_th=%s', self._music_th)
 
+    def is_playing(self):
+        """
+        Returns
+        -------
+        playing: bool
+            the music thread is running
+        """
+        return self._music_th is not None and self._music_th.is_alive()
+
+    def music_play_at(self, start_time, repeat=True):
+        """ start music at ``start_time``
+
+        Parameters
+        ----------
+        start_time: float
+            top of the song (``clock.monotonic()``)
+        repeat: bool
+        """
+        self._log.debug('start_time=%.3f (%.3f sec later)', start_time,
+                        start_time - self._clock.monotonic())
+
+        self.music_stop()
+        self._start_at = start_time
+        self.music_play(repeat)
+
+    def adjust_clock(self, dt):
+        """ shift the timeline of the music being played
+
+        Applied gradually (``CLOCK_SLEW_SEC`` per event).
+
+        Parameters
+        ----------
+        dt: float
+            sec (positive: later)
+        """
+        self._log.debug('dt=%.6f', dt)
+        self._clock_adj += dt
+
     def music_pause(self):
         """ pause music """
         self._log.debug('')
 
         if type(self._music_th) == threading.Thread:
             self._music_active = False
+            self._wakeup.set()
 
             count = 0
             while self._music_th.is_alive():
@@ -369,7 +1367,7 @@ class Player:
         if type(self._music_th) == threading.Thread:
             while self._music_th.is_alive():
                 self._log.debug('waiting ..')
-                time.sleep(0.5)
+                self._music_th.join(0.5)
 
         self._log.debug('done')
 
@@ -513,3 +1511,42 @@ class Player:
                         ch, on, pw_diff, tap, conf_file)
 
         self._movement.calibrate(ch, on, pw_diff, tap, conf_file)
+        self.update_plan()
+
+    def set_interval(self, ch, push_interval=None, pull_interval=None,
+                     conf_file=None):
+        """
+        push/pull intervalの設定(チャンネルごと)
+
+        変更後 conf_file に保存する。
+
+        Parameters
+        ----------
+        ch: int
+            servo channel
+        push_interval, pull_interval: float
+            sec, None: don't change
+        conf_file: str
+            configuration file (path name)
+
+        Raises
+        ------
+        ValueError
+            invalid channel number or interval (``Servo.set_interval()``)
+        """
+        self._log.debug('ch=%s, interval=%s, conf_file=%s',
+                        ch, (push_interval, pull_interval), conf_file)
+
+        self._movement.set_interval(ch, push_interval, pull_interval,
+                                    conf_file)
+        self.update_plan()
+
+    def write_pw(self, writes):
+        """
+        write pulse widths as they are (this node is a remote board)
+
+        Parameters
+        ----------
+        writes: list of (ch, pw)
+        """
+        self._movement.write_pw(writes)
@@ -0,0 +1,321 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Playlist for Player
+
+The next track is prepared (parsed, frozen, coalesced, compiled)
+in a background thread while the current one plays,
+so that the player can switch to it without a gap.
+
+```python3
+player.playlist_add(music_file='song1.mid')
+player.playlist_add(music_data=music_data, name='song2')
+player.playlist_loop(True)
+player.playlist_shuffle(True)
+player.playlist_next()     # start (or skip to) the next track
+```
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import json
+import time
+import random
+import threading
+from .my_logger import get_logger
+
+
+def load_music_file(music_file, ch_n=None, debug=False):
+    """
+    Parameters
+    ----------
+    music_file: str
+        MIDI file, music data file (JSON) or paper tape file
+    ch_n: int
+        number of notes of the comb (MIDI file), None: ``Midi.CH_N``
+
+    Returns
+    -------
+    music_data: list of MusicDataEnt
+    """
+    if music_file.lower().endswith(('.mid', '.midi')):
+        from .midi import Midi
+        return Midi(ch_n=ch_n, debug=debug).parse(music_file)
+
+    if music_file.lower().endswith('.json'):
+        with open(music_file) as f:
+            return json.load(f)
+
+    from .papertape import PaperTape
+    return PaperTape(debug=debug).parse(music_file)
+
+
+class Track:
+    """
+    One track of the playlist
+
+    Attributes
+    ----------
+    name: str
+    ready: threading.Event
+        set when prepared (or failed)
+    music_data: Song or list
+        prepared music data
+    plan: ActuationPlan or None
+    coalesce_stats: dict
+    error: str or None
+    prepare_sec: float
+    start_time: float or None
+        clock time of the beginning of the track (last played)
+    """
+    def __init__(self, music_data=None, music_file=None, name=None,
+                 plan_file=None, coalesce_msec=None, copy=True):
+        """ Constructor
+
+        Parameters
+        ----------
+        music_data: list of MusicDataEnt or Song
+        music_file: str
+            used if ``music_data`` is None
+        name: str
+            None: ``music_file``
+        plan_file: str
+        coalesce_msec: float
+        copy: bool
+        """
+        if music_data is None and music_file is None:
+            raise ValueError('music_data or music_file is required')
+
+        self.name = name
+        if self.name is None:
+            self.name = music_file if music_file else 'music_data'
+
+        self.src_data = music_data
+        self.music_file = music_file
+        self.plan_file = plan_file
+        self.coalesce_msec = coalesce_msec
+        self.copy = copy
+
+        self.ready = threading.Event()
+        self.music_data = None
+        self.plan = None
+        self.coalesce_stats = {}
+        self.error = None
+        self.prepare_sec = 0.0
+        self.start_time = None
+
+    def __repr__(self):
+        return '%s(%a)' % (self.__class__.__name__, self.name)
+
+
+class Playlist:
+    """
+    Queue of tracks with shuffle and loop
+
+    ``pop()`` returns the next track (already prepared, if possible),
+    and prepares the one after it in the background.
+    """
+    def __init__(self, prepare, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        prepare: function(track)
+            fills ``track.music_data``, ``track.plan``, ..
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+
+        self._prepare = prepare
+
+        self._lock = threading.Lock()
+        self._queue = []
+        self._next = None     # chosen and being prepared
+        self._history = []    # played tracks (for loop)
+        self.current = None
+        self.loop = False
+        self.shuffle = False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._queue) + (self._next is not None)
+
+    def _prepare_th(self, track):
+        self._log.debug('track=%s', track)
+
+        start_time = time.monotonic()
+        try:
+            self._prepare(track)
+        except Exception as ex:
+            track.error = '%s: %s' % (type(ex).__name__, ex)
+            self._log.error('%s: %s', track, track.error)
+        track.prepare_sec = time.monotonic() - start_time
+        track.ready.set()
+
+        self._log.info('%s: prepared in %.1f msec', track,
+                       track.prepare_sec * 1000)
+
+    def _choose_next(self):
+        """ choose the next track, and start preparing it (locked) """
+        if self._next is not None:
+            return
+
+        if not self._queue and self.loop and self._history:
+            self._queue = self._history
+            self._history = []
+
+        if not self._queue:
+            return
+
+        i = random.randrange(len(self._queue)) if self.shuffle else 0
+        self._next = self._queue.pop(i)
+
+        if not self._next.ready.is_set():
+            threading.Thread(target=self._prepare_th, args=(self._next,),
+                             daemon=True).start()
+
+    def add(self, track):
+        """
+        Parameters
+        ----------
+        track: Track
+        """
+        self._log.debug('track=%s', track)
+
+        with self._lock:
+            self._queue.append(track)
+            self._choose_next()
+
+    def pop(self):
+        """
+        next track (wait until it is prepared)
+
+        Returns
+        -------
+        track: Track or None
+            None: no more tracks
+        """
+        self.done()
+
+        while True:
+            with self._lock:
+                self._choose_next()
+                track = self._next
+                self._next = None
+
+            if track is None:
+                return None
+
+            if not track.ready.is_set():
+                self._log.warning('%s: not prepared yet .. wait', track)
+            track.ready.wait()
+
+            if track.error is None:
+                with self._lock:
+                    self.current = track
+                    self._choose_next()
+                return track
+
+            self._log.error('%s: %s .. skipped', track, track.error)
+
+    def done(self):
+        """ the current track is not played any more """
+        with self._lock:
+            if self.current is not None:
+                self._history.append(self.current)
+                self.current = None
+
+    def clear(self):
+        """ remove all tracks (except the current one) """
+        self._log.debug('')
+
+        with self._lock:
+            self._queue = []
+            self._next = None
+            self._history = []
+
+    def set_shuffle(self, on=True):
+        """ shuffle on/off """
+        self._log.debug('on=%s', on)
+
+        with self._lock:
+            self.shuffle = on
+            if self._next is not None:
+                # choose again
+                self._queue.insert(0, self._next)
+                self._next = None
+                self._choose_next()
+
+    def set_loop(self, on=True):
+        """ loop on/off """
+        self._log.debug('on=%s', on)
+
+        with self._lock:
+            self.loop = on
+            self._choose_next()
+
+    def tracks(self):
+        """ all tracks (for ``musicbox.snapshot``)
+
+        Returns
+        -------
+        tracks: dict
+            current: Track or None,
+            queue: list of Track .. the next one first,
+            history: list of Track .. played (for loop),
+            loop, shuffle
+        """
+        with self._lock:
+            queue = list(self._queue)
+            if self._next is not None:
+                queue.insert(0, self._next)
+            return {
+                'current': self.current,
+                'queue': queue,
+                'history': list(self._history),
+                'loop': self.loop,
+                'shuffle': self.shuffle,
+            }
+
+    def restore(self, current=None, queue=(), history=(), loop=False,
+                shuffle=False):
+        """ replace all tracks (see ``tracks()``)
+
+        Parameters
+        ----------
+        current: Track
+            already prepared (``ready`` is set)
+        queue: list of Track
+        history: list of Track
+        loop: bool
+        shuffle: bool
+        """
+        self._log.debug('current=%s, queue=%s', current, queue)
+
+        with self._lock:
+            self.current = current
+            self._queue = list(queue)
+            self._next = None
+            self._history = list(history)
+            self.loop = loop
+            # the next track is the same as before (not shuffled again)
+            self.shuffle = False
+            self._choose_next()
+            self.shuffle = shuffle
+
+    def status(self):
+        """
+        Returns
+        -------
+        status: dict
+            current, next, queue: track names, loop, shuffle
+        """
+        with self._lock:
+            return {
+                'current': self.current.name if self.current else None,
+                'next': self._next.name if self._next else None,
+                'queue': [t.name for t in self._queue],
+                'loop': self.loop,
+                'shuffle': self.shuffle,
+            }
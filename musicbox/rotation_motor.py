@@ -14,41 +14,63 @@ Rotation Motor driver for Music Box
 |   StepMtr     |--
  ---------------
 
+### Speed
+
+speed は 0.0 .. 10.0 の連続値 (``MotionProfile``参照)。
+速度変更は、``MotionProfile``の加速・減速カーブに沿って行う。
+
+### Start
+
+pigpiodが接続を受け付けるまで待ってから初期化する
+(``pigpio_conn.pigpio_pi()``)。
+
 """
 __author__ = 'FabLab Kannai'
 __date__   = '2021/01'
 
-from stepmtr import StepMtr, StepMtrTh
+import threading
+from .pigpio_conn import pigpio_pi
+from .motion_profile import MotionProfile
 from .my_logger import get_logger
 
 
 class RotationMotor:
     """オルゴール回転モーター
+
+    Attributes
+    ----------
+    profile: MotionProfile
     """
-    SPEED2INTERVAL = (None,
-                      0.5,
-                      0.25,
-                      0.125,
-                      0.06,
-                      0.03,
-                      0.015,
-                      0.008,
-                      0.004,
-                      0.002,
-                      0.0015)
-
-    def __init__(self, pin1, pin2, pin3, pin4, debug=False):
+    SPEED2INTERVAL = MotionProfile.SPEED2INTERVAL
+
+    def __init__(self, pin1, pin2, pin3, pin4, profile=None,
+                 debug=False):
         """ Constructor
 
         Parameters
         ----------
         pin1, pin2, pin3, pin4: int
             GPIOピン番号
+        profile: MotionProfile
+            None: default profile
         """
         self._dbg = debug
         self._log = get_logger(__class__.__name__, self._dbg)
         self._log.debug('pins=%s', (pin1, pin2, pin3, pin4))
 
+        self.profile = profile
+        if self.profile is None:
+            self.profile = MotionProfile(debug=self._dbg)
+
+        self._interval = None   # None: stop
+        self._ramp_th = None
+        self._ramp_cancel = threading.Event()
+
+        from stepmtr import StepMtr, StepMtrTh
+
+        # StepMtrTh connects to pigpiod by itself: wait until it's ready
+        pigpio_pi().stop()
+
         self.sm_th = StepMtrTh(pin1, pin2, pin3, pin4,
                                seq=StepMtr.SEQ_FULL,
                                interval=StepMtr.DEF_INTERVAL,
@@ -67,25 +89,93 @@ class RotationMotor:
         """
         self._log.debug('')
         self.sm_th.stop()
+        self._interval = None
+
+    def set_interval(self, interval):
+        """ステップ間隔を変更する(ランプなし)
+
+        Parameters
+        ----------
+        interval: float or None
+            sec, None: stop
+        """
+        if interval is None:
+            self.stop()
+            return
+
+        self.sm_th.set_interval(interval)
+        if self._interval is None:
+            self.start()
+        self._interval = interval
+
+    def cur_rate(self):
+        """
+        Returns
+        -------
+        rate: float
+            現在のステップ・レート (steps/sec), 0: stop
+        """
+        if self._interval is None:
+            return 0.0
+
+        return 1 / self._interval
 
     def set_speed(self, speed):
         """スピード変更
 
         Parameters
         ----------
-        speed: int
+        speed: float
             速度  0:ストップ, 10:最速
         """
         self._log.debug('speed=%s', speed)
 
-        interval = self.SPEED2INTERVAL[speed]
+        self.cancel_ramp()
 
-        if interval is None:
-            self.sm_th.stop()
+        interval = self.profile.speed2interval(speed)
+        intervals = self.profile.ramp_rate(self.cur_rate(),
+                                           self.profile.speed2rate(speed))
+        if not intervals:
+            self.set_interval(interval)
             return
 
-        self.sm_th.set_interval(interval)
-        self.start()
+        self._ramp_th = threading.Thread(
+            target=self.ramp_th,
+            args=(self.profile.segments(intervals), interval),
+            daemon=True)
+        self._ramp_th.start()
+
+    def ramp_th(self, segments, interval):
+        """ランプ(加速・減速)スレッド
+
+        Parameters
+        ----------
+        segments: list of (float, int)
+            (interval, steps)
+        interval: float or None
+            ランプ終了後のステップ間隔
+        """
+        self._log.debug('segments=%s, interval=%s',
+                        len(segments), interval)
+
+        for seg_interval, steps in segments:
+            self.set_interval(seg_interval)
+            if self._ramp_cancel.wait(seg_interval * steps):
+                self._log.debug('canceled')
+                return
+
+        self.set_interval(interval)
+
+    def cancel_ramp(self):
+        """実行中のランプを中断する
+        """
+        if self._ramp_th is None:
+            return
+
+        self._ramp_cancel.set()
+        self._ramp_th.join()
+        self._ramp_th = None
+        self._ramp_cancel.clear()
 
     def end(self):
         """終了処理
@@ -93,4 +183,302 @@ class RotationMotor:
         プログラム終了時に呼ぶこと
         """
         self._log.debug('')
+        self.cancel_ramp()
         self.sm_th.end()
+
+
+class RotationMotorWave:
+    """オルゴール回転モーター (pigpio DMA waveform版)
+
+    ステップ・シーケンスを pigpioの waveformとして作成し、
+    繰り返し送信する(wave_send_using_mode)。
+    ステップ動作に Pythonの CPU時間を使わない。
+
+    速度変更時は、新しい waveformを ``WAVE_MODE_REPEAT_SYNC``で送信し、
+    現在の waveformの周期の終わりで切り替える(グリッチなし)。
+
+    ランプ(加速・減速)は、ワンショットの waveformとして送信し、
+    その後に繰り返しの waveformを続ける。
+
+    ``RotationMotor``と同じインタフェース。
+    """
+    SPEED2INTERVAL = MotionProfile.SPEED2INTERVAL
+
+    # (pin1, pin2, pin3, pin4)
+    SEQ_FULL = ((1, 1, 0, 0),
+                (0, 1, 1, 0),
+                (0, 0, 1, 1),
+                (1, 0, 0, 1))
+
+    CW = 1
+    CCW = -1
+
+    DEF_INTERVAL = SPEED2INTERVAL[1]
+
+    RAMP_POLL_SEC = 0.005
+
+    def __init__(self, pin1, pin2, pin3, pin4, profile=None,
+                 seq=SEQ_FULL, direction=CCW, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        pin1, pin2, pin3, pin4: int
+            GPIOピン番号
+        profile: MotionProfile
+            None: default profile
+        seq: list of (int, int, int, int)
+            step sequence
+        direction: int
+            CW or CCW
+        """
+        self._dbg = debug
+        self._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('pins=%s', (pin1, pin2, pin3, pin4))
+
+        self.profile = profile
+        if self.profile is None:
+            self.profile = MotionProfile(debug=self._dbg)
+
+        self._ramp_th = None
+        self._ramp_cancel = threading.Event()
+
+        import pigpio
+        self._pigpio = pigpio
+
+        self._pins = (pin1, pin2, pin3, pin4)
+        self._seq = seq if direction == self.CW else seq[::-1]
+
+        self._pi = pigpio_pi()
+        for pin in self._pins:
+            self._pi.set_mode(pin, pigpio.OUTPUT)
+            self._pi.write(pin, 0)
+
+        self._wid = None
+        self._old_wid = []
+        self._interval = None
+
+    def mk_wave(self, interval):
+        """ 1周期分の waveformを作成する
+
+        Parameters
+        ----------
+        interval: float
+            sec
+
+        Returns
+        -------
+        wid: int
+            wave id
+        """
+        return self.mk_wave_steps([interval] * len(self._seq))
+
+    def mk_wave_steps(self, intervals):
+        """ ステップごとの間隔を指定して waveformを作成する
+
+        位相を保つため、ステップ数はシーケンス長の倍数に切り上げる。
+
+        Parameters
+        ----------
+        intervals: list of float
+            sec
+
+        Returns
+        -------
+        wid: int
+            wave id
+        """
+        intervals = list(intervals)
+        while len(intervals) % len(self._seq) != 0:
+            intervals.append(intervals[-1])
+
+        pulses = []
+        for i, interval in enumerate(intervals):
+            step = self._seq[i % len(self._seq)]
+            on_mask = 0
+            off_mask = 0
+            for pin, val in zip(self._pins, step):
+                if val:
+                    on_mask |= 1 << pin
+                else:
+                    off_mask |= 1 << pin
+
+            interval_us = max(int(interval * 1000000), 1)
+            pulses.append(self._pigpio.pulse(on_mask, off_mask,
+                                             interval_us))
+
+        self._pi.wave_add_new()
+        self._pi.wave_add_generic(pulses)
+        wid = self._pi.wave_create()
+        self._log.debug('steps=%s, wid=%s', len(pulses), wid)
+        return wid
+
+    def start(self):
+        """スタート
+        """
+        self._log.debug('')
+
+        if self._interval is None:
+            self._interval = self.DEF_INTERVAL
+
+        self.set_interval(self._interval)
+
+    def stop(self):
+        """ストップ
+        """
+        self._log.debug('')
+
+        self._pi.wave_tx_stop()
+        for wid in self._old_wid + [self._wid]:
+            if wid is not None:
+                self._pi.wave_delete(wid)
+        self._wid = None
+        self._old_wid = []
+
+        for pin in self._pins:
+            self._pi.write(pin, 0)
+
+    def set_interval(self, interval):
+        """ステップ間隔を変更して回転させる
+
+        Parameters
+        ----------
+        interval: float
+            sec
+        """
+        self._log.debug('interval=%s', interval)
+
+        if interval == self._interval and self._wid is not None:
+            return
+
+        self.delete_old_wave()
+
+        if self._wid is not None:
+            self._old_wid.append(self._wid)
+
+        self._wid = self.mk_wave(interval)
+        self._interval = interval
+
+        # 現在の waveformの周期が終わってから切り替わる
+        self._pi.wave_send_using_mode(
+            self._wid, self._pigpio.WAVE_MODE_REPEAT_SYNC)
+
+    def delete_old_wave(self):
+        """送信の終わった古い waveformを削除する
+
+        送信中の waveformは削除できないので、
+        切り替え時には待たずに、次の切り替え時に削除する。
+        """
+        tx_wid = self._pi.wave_tx_at()
+
+        for wid in list(self._old_wid):
+            if wid == tx_wid:
+                continue
+
+            self._pi.wave_delete(wid)
+            self._old_wid.remove(wid)
+
+    def cur_rate(self):
+        """
+        Returns
+        -------
+        rate: float
+            現在のステップ・レート (steps/sec), 0: stop
+        """
+        if self._wid is None:
+            return 0.0
+
+        return 1 / self._interval
+
+    def set_speed(self, speed):
+        """スピード変更
+
+        Parameters
+        ----------
+        speed: float
+            速度  0:ストップ, 10:最速
+        """
+        self._log.debug('speed=%s', speed)
+
+        self.cancel_ramp()
+
+        interval = self.profile.speed2interval(speed)
+        intervals = self.profile.ramp_rate(self.cur_rate(),
+                                           self.profile.speed2rate(speed))
+        if not intervals:
+            if interval is None:
+                self.stop()
+                return
+
+            self.set_interval(interval)
+            return
+
+        # ランプを現在の waveformの周期の終わりに続けて送信
+        self.delete_old_wave()
+        prev_wid = self._wid
+        if prev_wid is not None:
+            self._old_wid.append(prev_wid)
+
+        ramp_wid = self.mk_wave_steps(intervals)
+        self._pi.wave_send_using_mode(
+            ramp_wid, self._pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+        self._wid = ramp_wid
+        self._interval = intervals[-1]
+
+        self._ramp_th = threading.Thread(
+            target=self.ramp_th, args=(prev_wid, ramp_wid, interval),
+            daemon=True)
+        self._ramp_th.start()
+
+    def ramp_th(self, prev_wid, ramp_wid, interval):
+        """ランプ送信開始を待って、次の waveformを送信する
+
+        Parameters
+        ----------
+        prev_wid, ramp_wid: int
+        interval: float or None
+            ランプ終了後のステップ間隔, None: stop
+        """
+        self._log.debug('prev_wid=%s, ramp_wid=%s, interval=%s',
+                        prev_wid, ramp_wid, interval)
+
+        # ランプが始まるまで待つ
+        while prev_wid is not None and self._pi.wave_tx_at() == prev_wid:
+            if self._ramp_cancel.wait(self.RAMP_POLL_SEC):
+                return
+
+        if interval is None:
+            # ランプが終わるまで待って停止
+            while self._pi.wave_tx_busy():
+                if self._ramp_cancel.wait(self.RAMP_POLL_SEC):
+                    return
+            self.stop()
+            return
+
+        # ランプ(ワンショット)の終わりに続けて、繰り返し送信
+        self._old_wid.append(ramp_wid)
+        self._wid = self.mk_wave(interval)
+        self._interval = interval
+        self._pi.wave_send_using_mode(
+            self._wid, self._pigpio.WAVE_MODE_REPEAT_SYNC)
+
+    def cancel_ramp(self):
+        """実行中のランプを中断する
+        """
+        if self._ramp_th is None:
+            return
+
+        self._ramp_cancel.set()
+        self._ramp_th.join()
+        self._ramp_th = None
+        self._ramp_cancel.clear()
+
+    def end(self):
+        """終了処理
+
+        プログラム終了時に呼ぶこと
+        """
+        self._log.debug('')
+        self.cancel_ramp()
+        self.stop()
+        self._pi.stop()
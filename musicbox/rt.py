@@ -0,0 +1,262 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Real-time settings for timing critical threads (Linux)
+
+```python3
+status = set_realtime(priority=50, cpu=3, timer_slack_ns=1)
+#  -> {'policy': 'SCHED_FIFO', 'priority': 50, 'cpu': [3], ..}
+
+lock_memory()              # mlockall(), whole process
+lock_memory(onfault=True)  # only the pages that are used
+```
+
+Each setting falls back gracefully:
+if it is not permitted (ex. not root, no CAP_SYS_NICE),
+the error is recorded in ``status['errors']`` and the rest is applied.
+
+``set_realtime()`` applies to the calling thread.
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import os
+import errno
+import ctypes
+import ctypes.util
+from .my_logger import get_logger
+
+PR_SET_TIMERSLACK = 29
+PR_GET_TIMERSLACK = 30
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+MCL_ONFAULT = 4  # Linux 4.4 or later
+
+DEF_PRIORITY = 50
+DEF_TIMER_SLACK_NS = 1
+
+_log = get_logger(__name__, False)
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    return _libc
+
+
+def policy_name(policy):
+    """
+    Parameters
+    ----------
+    policy: int
+
+    Returns
+    -------
+    name: str
+    """
+    for name in ('SCHED_OTHER', 'SCHED_FIFO', 'SCHED_RR', 'SCHED_BATCH',
+                 'SCHED_IDLE'):
+        if getattr(os, name, None) == policy:
+            return name
+
+    return str(policy)
+
+
+def set_realtime(priority=DEF_PRIORITY, cpu=None,
+                 timer_slack_ns=DEF_TIMER_SLACK_NS):
+    """
+    SCHED_FIFO, CPU affinity and timer slack of the calling thread
+
+    Parameters
+    ----------
+    priority: int
+        SCHED_FIFO priority (1 .. 99), None: don't change
+    cpu: int or list of int
+        CPU(s) to run on, None: don't change
+    timer_slack_ns: int
+        timer slack (nsec), None: don't change
+
+    Returns
+    -------
+    status: dict
+        policy: str, priority: int, cpu: list of int,
+        timer_slack_ns: int, errors: list of str
+    """
+    errors = []
+
+    if priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO,
+                                  os.sched_param(priority))
+        except (OSError, AttributeError) as ex:
+            errors.append('SCHED_FIFO: %s' % (ex))
+
+    if cpu is not None:
+        if isinstance(cpu, int):
+            cpu = [cpu]
+        try:
+            os.sched_setaffinity(0, cpu)
+        except (OSError, ValueError, AttributeError) as ex:
+            errors.append('affinity: %s' % (ex))
+
+    if timer_slack_ns is not None:
+        try:
+            ret = _get_libc().prctl(PR_SET_TIMERSLACK,
+                                    ctypes.c_ulong(timer_slack_ns), 0, 0, 0)
+            if ret != 0:
+                errors.append('timer slack: %s' % (
+                    os.strerror(ctypes.get_errno())))
+        except (OSError, AttributeError, TypeError) as ex:
+            errors.append('timer slack: %s' % (ex))
+
+    status = get_status()
+    status['errors'] = errors
+
+    for err in errors:
+        _log.warning('%s .. ignored', err)
+    _log.info('policy=%s, priority=%s, cpu=%s, timer_slack=%sns',
+              status['policy'], status['priority'], status['cpu'],
+              status['timer_slack_ns'])
+
+    return status
+
+
+def get_status():
+    """
+    scheduling status of the calling thread
+
+    Returns
+    -------
+    status: dict
+    """
+    status = {
+        'policy': None,
+        'priority': None,
+        'cpu': None,
+        'timer_slack_ns': None,
+    }
+
+    try:
+        status['policy'] = policy_name(os.sched_getscheduler(0))
+        status['priority'] = os.sched_getparam(0).sched_priority
+        status['cpu'] = sorted(os.sched_getaffinity(0))
+    except (OSError, AttributeError):
+        pass
+
+    try:
+        status['timer_slack_ns'] = _get_libc().prctl(PR_GET_TIMERSLACK,
+                                                     0, 0, 0, 0)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+    return status
+
+
+def lock_memory(onfault=False):
+    """
+    mlockall(MCL_CURRENT | MCL_FUTURE): no page faults (whole process)
+
+    With many threads (ex. a thread for each tap), MCL_FUTURE pins
+    the whole stack of each new thread (8MB by default).
+    ``onfault`` adds MCL_ONFAULT: only the pages that are touched
+    are locked. If the kernel doesn't know it,
+    only the current pages are locked (MCL_CURRENT).
+
+    Parameters
+    ----------
+    onfault: bool
+
+    Returns
+    -------
+    result: bool
+    """
+    flags = MCL_CURRENT | MCL_FUTURE
+    if onfault:
+        flags |= MCL_ONFAULT
+
+    try:
+        libc = _get_libc()
+        ret = libc.mlockall(flags)
+        if ret != 0 and onfault and ctypes.get_errno() == errno.EINVAL:
+            _log.warning('mlockall: no MCL_ONFAULT .. MCL_CURRENT only')
+            ret = libc.mlockall(MCL_CURRENT)
+    except (OSError, AttributeError, TypeError) as ex:
+        _log.warning('mlockall: %s .. ignored', ex)
+        return False
+
+    if ret != 0:
+        _log.warning('mlockall: %s .. ignored',
+                     os.strerror(ctypes.get_errno()))
+        return False
+
+    return True
+
+
+class LatenessHistogram:
+    """
+    Histogram of lateness (how late a thread woke up)
+
+    Attributes
+    ----------
+    count: list of int
+        number of samples in each bin
+    max: float
+        sec
+    """
+    # upper limit of each bin (msec)
+    BIN_MSEC = (0.1, 0.5, 1, 2, 5, 10, 20, 50, float('inf'))
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = [0] * len(self.BIN_MSEC)
+        self.max = 0.0
+        self._sum = 0.0
+        self._n = 0
+
+    def add(self, late):
+        """
+        Parameters
+        ----------
+        late: float
+            sec (negative: early .. counted as 0)
+        """
+        late = max(late, 0.0)
+        late_msec = late * 1000
+        for i, limit in enumerate(self.BIN_MSEC):
+            if late_msec < limit:
+                self.count[i] += 1
+                break
+
+        self.max = max(self.max, late)
+        self._sum += late
+        self._n += 1
+
+    def mean(self):
+        if self._n == 0:
+            return 0.0
+
+        return self._sum / self._n
+
+    def to_dict(self):
+        """
+        Returns
+        -------
+        hist: dict
+            {'<0.1ms': n, .., '>=50ms': n, 'max_msec': x, 'mean_msec': y}
+        """
+        hist = {}
+        for limit, n in zip(self.BIN_MSEC[:-1], self.count):
+            hist['<%sms' % (limit)] = n
+        hist['>=%sms' % (self.BIN_MSEC[-2])] = self.count[-1]
+
+        hist['max_msec'] = round(self.max * 1000, 3)
+        hist['mean_msec'] = round(self.mean() * 1000, 3)
+        return hist
@@ -2,11 +2,50 @@
 # (c) 2021 FabLab Kannai
 #
 """
-Rotation Motor driver for Music Box
+Servo Motor driver for Music Box
 
 ### config file
 
-
+``musicbox-servo.conf``: on/off pulse width of each channel,
+and optionally push/pull interval (msec) of each channel
+```
+# ch,on,off[,push_msec,pull_msec]
+00,1520,1020
+01,1350,0950,0080,0100
+```
+
+``musicbox-servo-lead.conf``: lead time of each channel (msec)
+(from push command to striking the tine)
+```
+# ch,lead_msec
+00,0012.5
+```
+``tap_at()`` pushes each channel earlier by its lead time,
+so that all channels strike at the same time.
+
+### Retrigger
+
+A tap requested while the servo is still moving is queued,
+and fired as soon as the current stroke (push and pull) completes,
+if it would be late by no more than ``retrigger_tol`` sec.
+Otherwise, it is dropped. See ``stats()``.
+
+### Power budget
+
+Pushing many servos at once causes a large inrush current
+(the 5V rail drops, and the PCA9685 or the Raspberry Pi may reset).
+No more than ``push_budget`` servos start a push
+within one ``push_window`` sec slot.
+Larger chords are staggered into the following slots,
+in order of push time (the channel with the longest lead time first).
+
+### Start and end
+
+The device is opened when pigpiod accepts the connection
+(``pigpio_conn.pigpio_pi()``), and all channels are pulled in one batch.
+``end()`` cancels the taps that are waiting (cooperative cancellation:
+a stroke in progress is pulled at once), waits for the last pull stroke
+only, and closes the device. See ``start_sec`` and ``stop_sec``.
 
 ### Architecture
 
@@ -18,15 +57,33 @@ Rotation Motor driver for Music Box
 | pigpioPCA9685 |--
  ---------------
 
+### Multiple boards
+
+With ``boards`` (ex. "0x40=15,0x41=15,ws://pi2:8880/=15"),
+the channels are spread over several PCA9685 boards and remote nodes
+(``musicbox.channel_map``). ``servo_n`` is the total number of channels.
+
+ --------------------------------------
+|                Servo                 |
+|======================================|
+|              BoardGroup              |
+|--------------------------------------|
+| ServoPCA9685 | ServoPCA9685 | Remote |
+|    (0x40)    |    (0x41)    | Board  |
+ --------------------------------------
+
 """
 __author__ = 'FabLab Kannai'
 __date__ = '2021/01'
 
 import os
+import math
 import time
 import threading
-import pigpio
-from servoPCA9685 import Servo as ServoPCA9685
+from collections import deque
+from .clock import RealClock
+from .pigpio_conn import pigpio_pi
+from .channel_map import ChannelMap, BoardGroup
 from .my_logger import get_logger
 
 
@@ -38,6 +95,11 @@ class Servo:
     ----------
     servo_n: int
         number of servo motors
+    PW_CENTER, PW_MIN, PW_MAX: int
+        pulse width limits of ``servoPCA9685``
+        (available after the device is opened)
+    start_sec, stop_sec: float
+        time of the constructor and ``end()`` (sec)
     """
     _log = get_logger(__name__, False)
 
@@ -45,14 +107,21 @@ class Servo:
     DEF_CONF_DIR = os.environ['HOME']
     DEF_CONFFILE = DEF_CONF_DIR + '/' + DEF_CONF_FNAME
 
+    LEAD_CONF_SUFFIX = '-lead.conf'
+
     DEF_PUSH_INTERVAL = 0.2  # sec
     DEF_PULL_INTERVAL = 0.2  # sec
+    MAX_INTERVAL = 2.0       # sec
 
     DEF_SERVO_N = 15
 
-    PW_CENTER = ServoPCA9685.PW_CENTER
-    PW_MIN = ServoPCA9685.PW_MIN
-    PW_MAX = ServoPCA9685.PW_MAX
+    DEF_RETRIGGER_TOL = 0.1  # sec
+
+    DEF_CANCEL_TIMEOUT = 1.0  # sec
+
+    DEF_PUSH_BUDGET = 5       # servos / slot, 0: unlimited
+    DEF_PUSH_WINDOW = 0.002   # sec
+
     PW_OFF = 0
     PW_NOP = -1
 
@@ -60,6 +129,12 @@ class Servo:
                  push_interval=DEF_PUSH_INTERVAL,
                  pull_interval=DEF_PULL_INTERVAL,
                  servo_n=DEF_SERVO_N,
+                 lead_conf_file=None,
+                 retrigger_tol=DEF_RETRIGGER_TOL,
+                 push_budget=DEF_PUSH_BUDGET,
+                 push_window=DEF_PUSH_WINDOW,
+                 clock=None,
+                 boards=None,
                  debug=False):
         """ Constractor
 
@@ -71,6 +146,21 @@ class Servo:
             push/pull interval (sec)
         servo_n: int
             number of servo motors
+        lead_conf_file: str
+            lead time file name (path name)
+            None: ``lead_conf_path(conf_file)``
+        retrigger_tol: float
+            max delay of a queued tap (sec), 0: don't queue
+        push_budget: int
+            max number of servos that start a push in one slot
+            0: unlimited
+        push_window: float
+            slot length (sec)
+        clock: RealClock or SimClock
+            None: RealClock
+        boards: str or list of (addr, ch_n)
+            several boards (``channel_map.parse_boards()``),
+            ``servo_n`` is ignored. None: one PCA9685
         """
         self._dbg = debug
         self._log = get_logger(self.__class__.__name__, self._dbg)
@@ -78,26 +168,114 @@ class Servo:
         self._log.debug('push/pull interval=%s',
                         (push_interval, pull_interval))
         self._log.debug('servo_n=%s', servo_n)
+        self._log.debug('lead_conf_file=%s', lead_conf_file)
+        self._log.debug('boards=%s', boards)
+
+        start = time.monotonic()
+        self.stop_sec = None
+
+        self.channel_map = None
+        if boards is not None:
+            self.channel_map = ChannelMap(boards)
+            servo_n = self.channel_map.ch_n
+            self._log.debug('channel_map=%s', self.channel_map)
+
+        if lead_conf_file is None:
+            lead_conf_file = self.lead_conf_path(conf_file)
+            self._log.debug('lead_conf_file=%s', lead_conf_file)
 
         self.conf_file = conf_file
+        self.lead_conf_file = lead_conf_file
         self.push_interval = push_interval
         self.pull_interval = pull_interval
         self.servo_n = servo_n
+        self.retrigger_tol = retrigger_tol
+        self.push_budget = push_budget
+        self.push_window = push_window
+
+        self._clock = clock
+        if self._clock is None:
+            self._clock = RealClock()
 
-        self._pi = pigpio.pi()
+        self._dev = self.open_device()
 
         self._on = [self.PW_CENTER] * self.servo_n
         self._off = [self.PW_CENTER] * self.servo_n
+        self._push_interval = [self.push_interval] * self.servo_n
+        self._pull_interval = [self.pull_interval] * self.servo_n
         self._moving = [False] * self.servo_n
+        self._lock = [threading.Lock() for _ in range(self.servo_n)]
+        self._queue = [deque() for _ in range(self.servo_n)]
+        self._free_time = [0.0] * self.servo_n
+        self._slot_lock = threading.Lock()
+        self._slot_count = {}
+        self._cancel = threading.Event()
+        self._tap_n = 0
+        self._tap_cond = threading.Condition()
+        self._last_write = 0.0
+        self.reset_stats()
         self._log.debug('on=%s', self._on)
         self._log.debug('off=%s', self._off)
         self._log.debug('moving=%s', self._moving)
 
         self.load_conf(self.conf_file)
 
-        self._dev = ServoPCA9685(list(range(self.servo_n)), self._pi,
-                                 debug=self._dbg)
-        self.pull(list(range(self.servo_n)))
+        # lead time (sec)
+        self.lead = load_lead_conf(self.lead_conf_file, self.servo_n)
+        self._log.debug('lead=%s', self.lead)
+
+        self.actuate_batch([(False, ch) for ch in range(self.servo_n)])
+
+        self.start_sec = time.monotonic() - start
+        self._log.debug('start_sec=%.3f', self.start_sec)
+
+    def open_device(self):
+        """
+        open the device (PCA9685), and set ``PW_CENTER`` etc.
+
+        Returns
+        -------
+        dev: ServoPCA9685
+        """
+        # import hardware libraries only when the device is used
+        from servoPCA9685 import Servo as ServoPCA9685
+
+        self.PW_CENTER = ServoPCA9685.PW_CENTER
+        self.PW_MIN = ServoPCA9685.PW_MIN
+        self.PW_MAX = ServoPCA9685.PW_MAX
+
+        self._pi = pigpio_pi()
+
+        if self.channel_map is not None:
+            return BoardGroup(self.channel_map, self.open_board,
+                              debug=self._dbg)
+
+        return ServoPCA9685(list(range(self.servo_n)), self._pi,
+                            debug=self._dbg)
+
+    def open_board(self, addr, ch_n):
+        """
+        open one of the boards
+
+        Parameters
+        ----------
+        addr: int
+            I2C address
+        ch_n: int
+
+        Returns
+        -------
+        dev: ServoPCA9685
+        """
+        from servoPCA9685 import Servo as ServoPCA9685
+
+        return ServoPCA9685(list(range(ch_n)), self._pi, addr=addr,
+                            debug=self._dbg)
+
+    def close_device(self):
+        """ close the device """
+        self._dev.end()
+        self._pi.stop()
 
     def end(self):
         """終了処理
@@ -105,11 +283,72 @@ class Servo:
         プログラム終了時に呼ぶこと
         """
         self._log.debug('doing ..')
-        time.sleep(0.5)
-        self._dev.end()
-        time.sleep(0.5)
-        self._pi.stop()
-        self._log.debug('done')
+        start = time.monotonic()
+
+        self.cancel_taps()
+
+        # the last pull stroke is completed before the device is closed
+        wait_sec = (self._last_write + max(self._pull_interval)
+                    - self._clock.monotonic())
+        if wait_sec > 0:
+            self._clock.sleep(wait_sec)
+
+        self.close_device()
+
+        self.stop_sec = time.monotonic() - start
+        self._log.debug('done: stop_sec=%.3f', self.stop_sec)
+
+    def cancel_taps(self, timeout=DEF_CANCEL_TIMEOUT):
+        """
+        cancel the taps that are waiting, and pull the servos
+        that are pushed (cooperative cancellation of the tap threads)
+
+        Parameters
+        ----------
+        timeout: float
+            sec
+
+        Returns
+        -------
+        done: bool
+            False: some tap threads did not end in ``timeout``
+        """
+        self._log.debug('tap_n=%s', self._tap_n)
+
+        self._cancel.set()
+        with self._tap_cond:
+            done = self._tap_cond.wait_for(lambda: self._tap_n == 0,
+                                           timeout)
+        self._cancel.clear()
+
+        if not done:
+            self._log.warning('%s tap threads: not ended', self._tap_n)
+        return done
+
+    @classmethod
+    def lead_conf_path(cls, conf_file=DEF_CONFFILE):
+        """ lead time file next to ``conf_file``
+
+        Parameters
+        ----------
+        conf_file: str
+
+        Returns
+        -------
+        lead_conf_file: str
+            ex. 'musicbox-servo.conf' -> 'musicbox-servo-lead.conf'
+        """
+        base, _ = os.path.splitext(conf_file)
+        return base + cls.LEAD_CONF_SUFFIX
+
+    def max_lead(self):
+        """
+        Returns
+        -------
+        lead: float
+            max lead time of all channels (sec)
+        """
+        return max(self.lead)
 
     def load_conf(self, conf_file=None):
         """設定ファイルを読み込む
@@ -132,19 +371,25 @@ class Servo:
             col = line.replace(' ', '').rstrip('\n').split(',')
             self._log.debug('col=%s', col)
 
-            if len(col) != 3:
+            if len(col) not in (3, 5):
                 continue
 
             if col[0][0] == '#':
                 continue
 
-            [ch, on, off] = [int(s) for s in col]
+            [ch, on, off] = [int(s) for s in col[:3]]
 
             self._on[ch] = on
             self._off[ch] = off
 
+            if len(col) == 5:
+                self._push_interval[ch] = float(col[3]) / 1000
+                self._pull_interval[ch] = float(col[4]) / 1000
+
         self._log.debug('on=%s', self._on)
         self._log.debug('off=%s', self._off)
+        self._log.debug('push_interval=%s', self._push_interval)
+        self._log.debug('pull_interval=%s', self._pull_interval)
 
     def save_conf(self, conf_file=None):
         """ 設定ファイルに保存する
@@ -160,11 +405,20 @@ class Servo:
             conf_file = self.conf_file
             self._log.debug('conf_file=%s', conf_file)
 
-        lines = ['# ch,on,off .. saved by %s' % (__name__)]
+        lines = ['# ch,on,off[,push_msec,pull_msec] .. saved by %s' % (
+            __name__)]
 
         for ch in range(self.servo_n):
-            lines.append('%02d,%04d,%04d' % (
-                ch, self._on[ch], self._off[ch]))
+            line = '%02d,%04d,%04d' % (ch, self._on[ch], self._off[ch])
+
+            # default intervals are not saved
+            if (self._push_interval[ch], self._pull_interval[ch]) != (
+                    self.push_interval, self.pull_interval):
+                line += ',%04d,%04d' % (
+                    round(self._push_interval[ch] * 1000),
+                    round(self._pull_interval[ch] * 1000))
+
+            lines.append(line)
 
         with open(conf_file, mode='w') as f:
             f.write('\n'.join(lines) + '\n')
@@ -255,6 +509,130 @@ class Servo:
 
         self.set_onoff(ch, on, pw, tap, conf_file)
 
+    def get_interval(self, ch):
+        """
+        Parameters
+        ----------
+        ch: int
+
+        Returns
+        -------
+        (push_interval, pull_interval): (float, float)
+            sec
+        """
+        return self._push_interval[ch], self._pull_interval[ch]
+
+    def set_interval(self, ch, push_interval=None, pull_interval=None,
+                     conf_file=None):
+        """
+        push/pull intervalの設定(チャンネルごと)
+
+        変更後 conf_file に保存する。
+
+        Parameters
+        ----------
+        ch: int
+            servo channel
+        push_interval, pull_interval: float
+            sec (0 .. MAX_INTERVAL), None: don't change
+        conf_file: str
+            configuration file (path name)
+
+        Raises
+        ------
+        ValueError
+            invalid channel number or interval (nothing is changed)
+        """
+        self._log.debug('ch=%s, interval=%s, conf_file=%s',
+                        ch, (push_interval, pull_interval), conf_file)
+
+        if ch < 0 or ch >= self.servo_n:
+            msg = 'invalid channel number:%s.' % (ch)
+            msg += ' specify 0 .. %s' % (self.servo_n - 1)
+            raise ValueError(msg)
+
+        for interval in (push_interval, pull_interval):
+            if interval is None:
+                continue
+            if not (math.isfinite(interval) and
+                    0 < interval <= self.MAX_INTERVAL):
+                msg = 'invalid interval:%s.' % (interval)
+                msg += ' specify 0 .. %s sec' % (self.MAX_INTERVAL)
+                raise ValueError(msg)
+
+        if push_interval is not None:
+            self._push_interval[ch] = push_interval
+
+        if pull_interval is not None:
+            self._pull_interval[ch] = pull_interval
+
+        self.save_conf(conf_file)
+
+    def tune_interval(self, ch, judge, start=None, min_interval=0.02,
+                      ratio=0.85, repeat=5, margin=1.1):
+        """
+        push/pull intervalを自動調整する
+
+        push interval、pull intervalの順に、
+        ``judge()``が Falseを返すまで短くしていき、
+        最後に成功した値 x ``margin``を設定する。
+
+        各候補で、キャリブレーションと同じ方法(pull1してから tap1)で
+        ``repeat``回連続して弾き、``judge()``で判定する。
+
+        Parameters
+        ----------
+        ch: int
+            servo channel
+        judge: function(ch, push_interval, pull_interval) -> bool
+            True: all taps were OK
+        start: (float, float)
+            start (push_interval, pull_interval), None: current
+        min_interval: float
+            sec
+        ratio: float
+            interval *= ratio at each step
+        repeat: int
+            number of taps for each candidate
+        margin: float
+
+        Returns
+        -------
+        (push_interval, pull_interval): (float, float)
+        """
+        self._log.debug('ch=%s, start=%s', ch, start)
+
+        if start is None:
+            start = self.get_interval(ch)
+
+        best = list(start)
+
+        for i in range(2):  # 0: push, 1: pull
+            interval = list(best)
+            while True:
+                interval[i] *= ratio
+                if interval[i] < min_interval:
+                    break
+
+                self.pull1(ch)
+                time.sleep(0.5)
+                for _ in range(repeat):
+                    self.tap1(ch, interval[0], interval[1])
+
+                ok = judge(ch, interval[0], interval[1])
+                self._log.info('ch=%s, interval=%s: %s',
+                               ch, interval, ok)
+                if not ok:
+                    break
+
+                best[i] = interval[i]
+
+        best = [min(b * margin, s) for b, s in zip(best, start)]
+        self._log.info('ch=%s: interval=%s', ch, best)
+
+        self.set_interval(ch, best[0], best[1])
+        return tuple(best)
+
     def tap(self, ch_list=[], push_interval=None, pull_interval=None):
         """
         指定された複数のチャンネルのピンをはじく(push and pull)
@@ -273,17 +651,246 @@ class Servo:
             self._log.warning('ch_list=%s !?', ch_list)
             return
 
+        now = self._clock.monotonic()
+        for ch, push_time in self.stagger([(ch, now) for ch in ch_list]):
+            self.start_tap(ch, push_time, push_interval, pull_interval)
+
+    def tap_at(self, ch_list, strike_time,
+               push_interval=None, pull_interval=None):
+        """
+        指定された複数のチャンネルを、``strike_time``に弾く
+
+        各チャンネルのリードタイム分、早めに push する。
+        同時に push するサーボ数は、``push_budget``以下に抑える。
+
+        Parameters
+        ----------
+        ch_list: list of int
+            チャンネル番号: 0 .. self.servo_n-1
+        strike_time: float
+            ``time.monotonic()``
+        push_interval, pull_interval: int
+            interval sec
+        """
+        self._log.debug('ch_list=%s, strike_time=%.3f',
+                        ch_list, strike_time)
+
+        if len(ch_list) == 0:
+            self._log.warning('ch_list=%s !?', ch_list)
+            return
+
+        push_list = []
         for ch in ch_list:
-            # daemon化しないほうがいい (?)
-            threading.Thread(target=self.tap1,
-                             args=(ch, push_interval, pull_interval),
-                             daemon=False).start()
+            if ch < 0 or ch >= self.servo_n:
+                self._log.warning('ch=%s: ignored', ch)
+                continue
+
+            push_list.append((ch, strike_time - self.lead[ch]))
+
+        for ch, push_time in self.stagger(push_list):
+            self.start_tap(ch, push_time, push_interval, pull_interval)
+
+    def start_tap(self, ch, push_time, push_interval=None,
+                  pull_interval=None):
+        """
+        ``tap1_at()`` in a thread
+
+        The thread is a daemon: ``end()`` cancels it and waits for it,
+        so that no servo is left pushed.
+        """
+        with self._tap_cond:
+            self._tap_n += 1
+
+        threading.Thread(target=self._tap_th,
+                         args=(ch, push_time, push_interval, pull_interval),
+                         daemon=True).start()
+
+    def _tap_th(self, ch, push_time, push_interval, pull_interval):
+        try:
+            self.tap1_at(ch, push_time, push_interval, pull_interval)
+        finally:
+            with self._tap_cond:
+                self._tap_n -= 1
+                self._tap_cond.notify_all()
+
+    def tap1_at(self, ch, push_time, push_interval=None,
+                pull_interval=None):
+        """
+        ``push_time``まで待って、``tap1()``
+
+        Parameters
+        ----------
+        ch: int
+        push_time: float
+            ``time.monotonic()``
+        push_interval, pull_interval: int
+            interval sec
+        """
+        wait_sec = push_time - self._clock.monotonic()
+        if wait_sec > 0 and self._clock.wait(self._cancel, wait_sec):
+            self._log.debug('ch[%s]: canceled', ch)
+            return
+
+        self.tap1(ch, push_interval, pull_interval)
+
+    def reset_stats(self):
+        """ reset retrigger statistics """
+        self._retriggered = [0] * self.servo_n
+        self._dropped = [0] * self.servo_n
+        self._max_late = 0.0
+        self._chords = 0
+        self._staggered_chords = 0
+        self._staggered_pushes = 0
+        self._max_stagger = 0.0
+        if self.channel_map is not None:
+            self._dev.reset_stats()
+
+    def stats(self):
+        """
+        Returns
+        -------
+        stats: dict
+            retriggered: number of queued taps (per channel)
+            dropped: number of dropped taps (per channel)
+            max_late: max delay of queued taps (sec)
+            chords: number of tap requests
+            staggered_chords: number of staggered tap requests
+            staggered_pushes: number of delayed pushes
+            max_stagger: max delay by staggering (sec)
+            boards: per board statistics (``BoardGroup.stats()``)
+                multiple boards only
+        """
+        stats = {
+            'retriggered': list(self._retriggered),
+            'dropped': list(self._dropped),
+            'max_late': self._max_late,
+            'chords': self._chords,
+            'staggered_chords': self._staggered_chords,
+            'staggered_pushes': self._staggered_pushes,
+            'max_stagger': self._max_stagger,
+        }
+        if self.channel_map is not None:
+            stats['boards'] = self._dev.stats()
+        return stats
+
+    def plan_params(self):
+        """
+        parameters for ``ActuationPlan.compile()``
+
+        Returns
+        -------
+        params: dict
+        """
+        return {
+            'servo_n': self.servo_n,
+            'lead': list(self.lead),
+            'push_interval': list(self._push_interval),
+            'pull_interval': list(self._pull_interval),
+            'push_budget': self.push_budget,
+            'push_window': self.push_window,
+            'retrigger_tol': self.retrigger_tol,
+        }
+
+    def actuate(self, push_flag, ch):
+        """
+        write the pulse width only (for the plan executor)
+
+        no check, no log
+
+        Parameters
+        ----------
+        push_flag: bool or int
+        ch: int
+        """
+        self._dev.set_pw1(ch, self._on[ch] if push_flag else self._off[ch])
+        self._last_write = self._clock.monotonic()
+
+    def actuate_batch(self, ops):
+        """
+        write the pulse widths of several channels at once
+        (one batch per board)
+
+        Parameters
+        ----------
+        ops: list of (push_flag, ch)
+        """
+        writes = [(ch, self._on[ch] if push_flag else self._off[ch])
+                  for push_flag, ch in ops]
+
+        if self.channel_map is not None:
+            self._dev.set_pw(writes)
+        else:
+            for ch, pw in writes:
+                self._dev.set_pw1(ch, pw)
+        self._last_write = self._clock.monotonic()
+
+    def write_pw(self, writes):
+        """
+        write pulse widths as they are (for a remote board)
+
+        Parameters
+        ----------
+        writes: list of (ch, pw)
+            pw: PW_MIN .. PW_MAX, or PW_OFF
+        """
+        self._log.debug('writes=%s', writes)
+
+        for ch, pw in writes:
+            if ch < 0 or ch >= self.servo_n:
+                self._log.warning('ch=%s: ignored', ch)
+                continue
+
+            if pw != self.PW_OFF:
+                pw = min(max(pw, self.PW_MIN), self.PW_MAX)
+
+            self._dev.set_pw1(ch, pw)
+        self._last_write = self._clock.monotonic()
+
+    def stagger(self, push_list):
+        """
+        spread pushes into slots within the power budget
+
+        Parameters
+        ----------
+        push_list: list of (ch, push_time)
+
+        Returns
+        -------
+        push_list: list of (ch, push_time)
+            sorted by push time
+        """
+        push_list = sorted(push_list, key=lambda p: p[1])
+        self._chords += 1
+
+        if self.push_budget <= 0:
+            return push_list
+
+        with self._slot_lock:
+            # forget past slots
+            cur_slot = int(self._clock.monotonic() / self.push_window)
+            for slot in [s for s in self._slot_count if s < cur_slot]:
+                del self._slot_count[slot]
+
+            out, staggered, max_stagger = stagger_slots(
+                push_list, self._slot_count,
+                self.push_budget, self.push_window)
+
+        self._max_stagger = max(self._max_stagger, max_stagger)
+
+        if staggered > 0:
+            self._staggered_chords += 1
+            self._staggered_pushes += staggered
+            self._log.debug('staggered: %s/%s', staggered, len(out))
+
+        return out
 
     def tap1(self, ch, push_interval=None, pull_interval=None):
         """
         指定されたチャンネルのピンを弾く(push and pull)
 
-        動作中に同じサーボを呼び出された場合は、何もしない(無視する)
+        動作中に同じサーボを呼び出された場合は、
+        動作終了後に弾くようにキューに入れる。
+        ただし、``retrigger_tol``以上遅れる場合は無視する。
 
         Parameters
         ----------
@@ -295,26 +902,54 @@ class Servo:
         self._log.debug('ch=%s, interval=%s',
                         ch, (push_interval, pull_interval))
 
-        if self._moving[ch]:
-            self._log.warning('ch[%s]: busy .. ignored', ch)
-            return
-
-        self._moving[ch] = True
-
         if push_interval is None:
-            push_interval = self.push_interval
+            push_interval = self._push_interval[ch]
             self._log.debug('push_interval=%s', push_interval)
 
         if pull_interval is None:
-            pull_interval = self.pull_interval
+            pull_interval = self._pull_interval[ch]
             self._log.debug('pull_interval=%s', pull_interval)
 
-        self.push1(ch)
-        time.sleep(push_interval)
-        self.pull1(ch)
-        time.sleep(pull_interval)
+        with self._lock[ch]:
+            now = self._clock.monotonic()
+
+            if self._moving[ch]:
+                late = self._free_time[ch] - now
+                if late > self.retrigger_tol:
+                    self._dropped[ch] += 1
+                    self._log.warning('ch[%s]: busy (late %.3f sec)'
+                                      ' .. dropped', ch, late)
+                    return
+
+                self._queue[ch].append((push_interval, pull_interval))
+                self._free_time[ch] += push_interval + pull_interval
+                self._retriggered[ch] += 1
+                self._max_late = max(self._max_late, late)
+                self._log.debug('ch[%s]: busy .. queued (late %.3f sec)',
+                                ch, late)
+                return
+
+            self._moving[ch] = True
+            self._free_time[ch] = now + push_interval + pull_interval
+
+        while True:
+            # canceled: pull at once, and don't retrigger
+            self.push1(ch)
+            self._clock.wait(self._cancel, push_interval)
+            self.pull1(ch)
+            canceled = self._clock.wait(self._cancel, pull_interval)
+
+            with self._lock[ch]:
+                if canceled:
+                    self._queue[ch].clear()
+                if not self._queue[ch]:
+                    self._moving[ch] = False
+                    break
 
-        self._moving[ch] = False
+                (push_interval,
+                 pull_interval) = self._queue[ch].popleft()
+
+            self._log.debug('ch[%s]: retrigger', ch)
 
         self._log.debug('ch[%s]: done', ch)
 
@@ -344,6 +979,7 @@ class Servo:
 
         self._log.debug('pw=%s', pw)
         self._dev.set_pw1(ch, pw)
+        self._last_write = self._clock.monotonic()
 
     def push1(self, ch):
         """
@@ -404,3 +1040,143 @@ class Servo:
 
         for ch in ch_list:
             self.pull1(ch)
+
+
+def stagger_slots(push_list, slot_count, budget, window):
+    """
+    put pushes into slots of ``window`` sec,
+    no more than ``budget`` pushes in a slot
+
+    Parameters
+    ----------
+    push_list: list of (ch, push_time)
+        sorted by push time
+    slot_count: dict
+        slot number -> number of pushes (updated)
+    budget: int
+    window: float
+        sec
+
+    Returns
+    -------
+    (push_list, staggered, max_stagger): (list, int, float)
+        push_list: list of (ch, push_time)
+        staggered: number of delayed pushes
+        max_stagger: max delay (sec)
+    """
+    staggered = 0
+    max_stagger = 0.0
+    out = []
+    for ch, push_time in push_list:
+        slot = math.floor(push_time / window)
+        t = push_time
+        while slot_count.get(slot, 0) >= budget:
+            slot += 1
+            t = slot * window
+
+        slot_count[slot] = slot_count.get(slot, 0) + 1
+
+        if t > push_time:
+            staggered += 1
+            max_stagger = max(max_stagger, t - push_time)
+        out.append((ch, t))
+
+    return out, staggered, max_stagger
+
+
+def load_lead_conf(conf_file, ch_n):
+    """ リードタイム・ファイルを読み込む
+
+    ファイルが無い場合は、全チャンネル 0
+
+    Parameters
+    ----------
+    conf_file: str
+    ch_n: int
+        number of channels
+
+    Returns
+    -------
+    lead: list of float
+        lead time of each channel (sec)
+    """
+    lead = [0.0] * ch_n
+
+    try:
+        with open(conf_file) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return lead
+
+    for line in lines:
+        col = line.replace(' ', '').rstrip('\n').split(',')
+
+        if len(col) != 2:
+            continue
+
+        if col[0][0] == '#':
+            continue
+
+        ch = int(col[0])
+        if ch < ch_n:
+            lead[ch] = float(col[1]) / 1000
+
+    return lead
+
+
+def save_lead_conf(conf_file, lead):
+    """ リードタイム・ファイルに保存する
+
+    Parameters
+    ----------
+    conf_file: str
+    lead: list of float
+        lead time of each channel (sec)
+    """
+    lines = ['# ch,lead_msec .. saved by %s' % (__name__)]
+
+    for ch, lead1 in enumerate(lead):
+        lines.append('%02d,%06.1f' % (ch, lead1 * 1000))
+
+    with open(conf_file, mode='w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def fit_lead(samples, ch_n):
+    """ 計測したタイムスタンプからリードタイムを求める
+
+    チャンネルごとに (strike_time - cmd_time) の中央値
+
+    Parameters
+    ----------
+    samples: list of (int, float, float)
+        (ch, cmd_time, strike_time) .. sec
+    ch_n: int
+        number of channels
+
+    Returns
+    -------
+    lead: list of float
+        sec (no sample: 0)
+    count: list of int
+        number of samples of each channel
+    """
+    delay = [[] for _ in range(ch_n)]
+    for ch, cmd_time, strike_time in samples:
+        if 0 <= ch < ch_n:
+            delay[ch].append(strike_time - cmd_time)
+
+    lead = []
+    for d in delay:
+        if not d:
+            lead.append(0.0)
+            continue
+
+        d = sorted(d)
+        mid = len(d) // 2
+        if len(d) % 2:
+            lead.append(max(d[mid], 0.0))
+        else:
+            lead.append(max((d[mid - 1] + d[mid]) / 2, 0.0))
+
+    return lead, [len(d) for d in delay]
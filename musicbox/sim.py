@@ -0,0 +1,210 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Simulation backend (no hardware)
+
+Stand-ins for the device layer (PCA9685), ``Servo`` and
+``RotationMotor``, that record every actuation with the time
+of the injected clock (``musicbox.clock``).
+
+```python3
+clock = SimClock()   # as fast as possible
+player = Player(wav_mode=Player.WAVMODE_SIM, clock=clock)
+player.music_load(music_data, start_flag=False)
+player.music_play(repeat=False)
+player.music_wait()
+
+for t, ch, op in player.movement().actuations():
+    ..
+```
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import os
+import time
+import threading
+from .servo import Servo
+from .channel_map import BoardGroup
+from .motion_profile import MotionProfile
+from .clock import RealClock
+from .my_logger import get_logger
+
+
+class SimDevice:
+    """
+    Simulated PCA9685 (``servoPCA9685.Servo``)
+
+    Attributes
+    ----------
+    log: list of (t, ch, pw)
+        all writes
+    pw: list of int
+        current pulse width of each channel
+    """
+    PW_CENTER = 1500
+    PW_MIN = 500
+    PW_MAX = 2500
+
+    def __init__(self, ch_n, clock=None):
+        """ Constructor
+
+        Parameters
+        ----------
+        ch_n: int
+        clock: RealClock or SimClock
+        """
+        self._clock = clock
+        if self._clock is None:
+            self._clock = RealClock()
+
+        self.pw = [0] * ch_n
+        self.log = []
+        self._lock = threading.Lock()
+
+    def set_pw1(self, ch, pw):
+        with self._lock:
+            self.pw[ch] = pw
+            self.log.append((self._clock.monotonic(), ch, pw))
+
+    def clear_log(self):
+        with self._lock:
+            self.log = []
+
+    def end(self):
+        pass
+
+
+class SimServo(Servo):
+    """
+    Servo without hardware
+
+    The conf file and the lead time file are read, if they exist.
+    """
+    PW_ON_DIFF = 250
+
+    def open_device(self):
+        self.PW_CENTER = SimDevice.PW_CENTER
+        self.PW_MIN = SimDevice.PW_MIN
+        self.PW_MAX = SimDevice.PW_MAX
+
+        if self.channel_map is not None:
+            return BoardGroup(self.channel_map, self.open_board,
+                              debug=self._dbg)
+
+        return SimDevice(self.servo_n, self._clock)
+
+    def open_board(self, addr, ch_n):
+        return SimDevice(ch_n, self._clock)
+
+    def close_device(self):
+        self._dev.end()
+
+    def end(self):
+        self._log.debug('')
+        start = time.monotonic()
+        self.cancel_taps()
+        self.close_device()
+        self.stop_sec = time.monotonic() - start
+
+    def load_conf(self, conf_file=None):
+        if conf_file is None:
+            conf_file = self.conf_file
+
+        if not os.path.exists(conf_file):
+            self._log.debug('%s: not found .. default', conf_file)
+            self._on = [self.PW_CENTER + self.PW_ON_DIFF] * self.servo_n
+            self._off = [self.PW_CENTER - self.PW_ON_DIFF] * self.servo_n
+            return
+
+        super().load_conf(conf_file)
+
+    def save_conf(self, conf_file=None):
+        self._log.debug('conf_file=%s: not saved (simulation)', conf_file)
+
+    def actuations(self):
+        """
+        Returns
+        -------
+        actuations: list of (t, ch, push_flag)
+            push_flag: True: push, False: pull
+        """
+        return [(t, ch, pw == self._on[ch]) for t, ch, pw in self._dev.log
+                if pw in (self._on[ch], self._off[ch])]
+
+    def clear_actuations(self):
+        self._dev.clear_log()
+
+
+class SimRotationMotor:
+    """
+    RotationMotor without hardware
+
+    Ramps are not executed, but their duration is recorded.
+
+    Attributes
+    ----------
+    log: list of (t, speed, ramp_sec)
+    """
+    SPEED2INTERVAL = MotionProfile.SPEED2INTERVAL
+
+    def __init__(self, pin1=0, pin2=0, pin3=0, pin4=0, profile=None,
+                 clock=None, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        pin1, pin2, pin3, pin4: int
+            ignored
+        profile: MotionProfile
+        clock: RealClock or SimClock
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+
+        self.profile = profile
+        if self.profile is None:
+            self.profile = MotionProfile(debug=self._dbg)
+
+        self._clock = clock
+        if self._clock is None:
+            self._clock = RealClock()
+
+        self._interval = None
+        self.log = []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self._interval = None
+
+    def set_interval(self, interval):
+        self._interval = interval
+
+    def cur_rate(self):
+        if self._interval is None:
+            return 0.0
+
+        return 1 / self._interval
+
+    def set_speed(self, speed):
+        """
+        Parameters
+        ----------
+        speed: float
+        """
+        self._log.debug('speed=%s', speed)
+
+        intervals = self.profile.ramp_rate(self.cur_rate(),
+                                           self.profile.speed2rate(speed))
+        self.log.append((self._clock.monotonic(), speed, sum(intervals)))
+        self.set_interval(self.profile.speed2interval(speed))
+
+    def cancel_ramp(self):
+        pass
+
+    def end(self):
+        self._log.debug('')
+        self.stop()
@@ -0,0 +1,454 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Warm restart: snapshot of the player state
+
+The state of a ``Player`` is written to a file periodically
+(``INTERVAL`` sec), and restored when the server starts again:
+the song resumes where it was, without parsing it again,
+without compiling it again, and without the web application.
+
+```python3
+snap = Snapshot(player, '/path/to/musicbox-8880.snapshot')
+snap.restore()       # at start: resume (if there is a snapshot)
+snap.start()         # write periodically
+  :
+snap.end()           # write the last state (before ``player.end()``)
+```
+
+### Files (JSON, atomic: written to '.tmp', synced and renamed)
+
+```
+musicbox-8880.snapshot       .. small, written when it is changed
+  {"version": 1, "key": "<key of the data file>",
+   "pos": 123, "playing": true, "repeat": true, "tempo": 1.0, ..,
+   "playlist": {"current": 0, "queue": [1, 2], "history": [],
+                "loop": false, "shuffle": false}}
+
+musicbox-8880.snapshot.data  .. written when the song, the plan
+                                 or the tracks are changed
+  {"version": 1, "key": "<random>", "params": "<sha1 of plan_params>",
+   "coalesce_stats": {..}, "plan": {..}, "events": [[t, op, ch, idx], ..],
+   "song": [[ch, delay_us, abs_time_us], ..],
+   "tracks": [{"name": .., "music_file": .., "song": [..]}, ..]}
+```
+
+The tracks of the playlist are referred to by their index in "tracks".
+A track of a music file is loaded from the file (in background)
+when it is played next; only the tracks of music data have "song".
+The plan is compiled again, if the servo parameters
+(``Movement.plan_params()``) are not the same as in the snapshot.
+
+The data file is written by small chunks,
+not to hold the GIL for long while the music thread is playing.
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from .song import Song
+from .plan import ActuationPlan
+from .playlist import Track
+from .my_logger import get_logger
+
+
+class Snapshot:
+    """
+    Snapshot of a Player (warm restart)
+
+    Attributes
+    ----------
+    restore_sec: float or None
+        time to restore, None: not restored
+    saves: int
+        number of writes of the state file
+    """
+    VERSION = 1
+    INTERVAL = 2.0  # sec
+    DATA_SUFFIX = '.data'
+    CHUNK = 512     # rows per ``json.dumps()``
+
+    def __init__(self, player, snapshot_file, interval=INTERVAL,
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        player: Player
+        snapshot_file: str
+            the data file is ``snapshot_file`` + ``DATA_SUFFIX``
+        interval: float
+            sec
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('snapshot_file=%s, interval=%s',
+                        snapshot_file, interval)
+
+        self._player = player
+        self._file = snapshot_file
+        self._data_file = snapshot_file + self.DATA_SUFFIX
+        self._interval = interval
+
+        self._data_objs = None   # the objects in the data file
+        self._key = None
+        self._last_state = None
+
+        self._stop = threading.Event()
+        self._th = None
+
+        self.restore_sec = None
+        self.saves = 0
+
+    @staticmethod
+    def params_key(params):
+        """
+        Parameters
+        ----------
+        params: dict or None
+            ``Movement.plan_params()``
+
+        Returns
+        -------
+        key: str or None
+        """
+        if params is None:
+            return None
+        src = json.dumps(params, sort_keys=True)
+        return hashlib.sha1(src.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _atomic_write(path, write):
+        """
+        written to '.tmp', synced, and renamed
+        (a power cut leaves the old file or the new one, not empty)
+
+        Parameters
+        ----------
+        path: str
+        write: function(f)
+        """
+        tmp_file = path + '.tmp'
+        with open(tmp_file, mode='w') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+
+        # the rename itself
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write_list(self, f, rows):
+        """ JSON list, by ``CHUNK`` rows """
+        f.write('[')
+        for i in range(0, len(rows), self.CHUNK):
+            if i > 0:
+                f.write(',')
+            f.write(json.dumps(rows[i:i + self.CHUNK],
+                               separators=(',', ':'))[1:-1])
+            time.sleep(0)  # let the music thread run
+        f.write(']')
+
+    @staticmethod
+    def _track_to_dict(track, with_song=True):
+        """
+        Parameters
+        ----------
+        track: Track
+        with_song: bool
+            False: the current track (the song is saved as "song")
+
+        Returns
+        -------
+        ent: dict
+        """
+        ent = {
+            'name': track.name,
+            'music_file': track.music_file,
+            'plan_file': track.plan_file,
+            'coalesce_msec': track.coalesce_msec,
+        }
+        if track.music_file is not None or not with_song:
+            return ent
+
+        music_data = track.src_data
+        if music_data is None:
+            music_data = track.music_data
+            ent['coalesce_msec'] = 0  # already coalesced
+        ent['song'] = Song.from_music_data(music_data).to_rows()
+        return ent
+
+    def _save_data(self, state, tracks):
+        """ write the data file
+
+        Returns
+        -------
+        key: str
+        """
+        key = uuid.uuid4().hex
+        music_data = state['music_data']
+        plan = state['plan']
+        current = state['playlist']['current']
+
+        head = {
+            'version': self.VERSION,
+            'key': key,
+            'params': self.params_key(
+                self._player.movement().plan_params()),
+            'coalesce_stats': state['coalesce_stats'],
+            'plan': plan.to_dict(events=False) if plan else None,
+            'tracks': [self._track_to_dict(t, t is not current)
+                       for t in tracks],
+        }
+
+        def write(f):
+            f.write(json.dumps(head, separators=(',', ':'))[:-1])
+            f.write(',"song":')
+            if music_data is None:
+                f.write('null')
+            else:
+                self._write_list(f, Song.from_music_data(
+                    music_data).to_rows())
+            f.write(',"events":')
+            if plan is None:
+                f.write('null')
+            else:
+                self._write_list(f, plan.events)
+            f.write('}')
+
+        self._atomic_write(self._data_file, write)
+        self._log.debug('%s: key=%s', self._data_file, key)
+        return key
+
+    @staticmethod
+    def _data_objs_of(state):
+        """
+        Returns
+        -------
+        objs: list
+            music_data, plan and tracks (current, queue, history)
+        """
+        pl = state['playlist']
+        objs = [state['music_data'], state['plan']]
+        if pl['current'] is not None:
+            objs.append(pl['current'])
+        return objs + pl['queue'] + pl['history']
+
+    def _data_changed(self, objs):
+        if self._data_objs is None or len(objs) != len(self._data_objs):
+            return True
+        return any([a is not b for a, b in zip(objs, self._data_objs)])
+
+    def save(self):
+        """ write the state (and the data, if changed)
+
+        Returns
+        -------
+        saved: bool
+            False: not changed
+        """
+        state = self._player.get_state()
+        pl = state['playlist']
+
+        objs = self._data_objs_of(state)
+        if self._data_changed(objs):
+            self._key = self._save_data(state, objs[2:])
+            self._data_objs = objs
+
+        index = {id(t): i for i, t in enumerate(self._data_objs[2:])}
+        snap = {
+            'version': self.VERSION,
+            'key': self._key,
+            'pos': state['pos'],
+            'playing': state['playing'],
+            'repeat': state['repeat'],
+            'tempo': state['tempo'],
+            'tempo_auto': state['tempo_auto'],
+            'def_delay': state['def_delay'],
+            'rotation_speed': state['rotation_speed'],
+            'rotation_tempo': state['rotation_tempo'],
+            'playlist': {
+                'current': (index[id(pl['current'])]
+                            if pl['current'] is not None else None),
+                'queue': [index[id(t)] for t in pl['queue']],
+                'history': [index[id(t)] for t in pl['history']],
+                'loop': pl['loop'],
+                'shuffle': pl['shuffle'],
+            },
+        }
+        if snap == self._last_state:
+            return False
+
+        self._atomic_write(self._file, lambda f: json.dump(
+            snap, f, separators=(',', ':')))
+        self._last_state = snap
+        self.saves += 1
+        return True
+
+    def load(self):
+        """ read the files
+
+        Returns
+        -------
+        state: dict or None
+            ``Player.get_state()``, None: no (valid) snapshot
+        """
+        try:
+            with open(self._file) as f:
+                snap = json.load(f)
+            with open(self._data_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as ex:
+            self._log.info('no snapshot: %s: %s', type(ex).__name__, ex)
+            return None
+
+        if snap.get('version') != self.VERSION or \
+           data.get('version') != self.VERSION:
+            self._log.warning('snapshot: other version .. ignored')
+            return None
+
+        if snap['key'] != data['key']:
+            self._log.warning('snapshot: the data file is not of'
+                              ' the state file .. ignored')
+            return None
+
+        music_data = None
+        if data['song'] is not None:
+            music_data = Song.from_rows(data['song'])
+
+        plan = None
+        if data['plan'] is not None:
+            params = self._player.movement().plan_params()
+            if data['params'] == self.params_key(params):
+                data['plan']['events'] = data['events']
+                plan = ActuationPlan.from_dict(data['plan'], debug=self._dbg)
+                plan.params = params
+            else:
+                self._log.info('servo parameters changed: compile again')
+
+        tracks = []
+        for ent in data['tracks']:
+            song = ent.get('song')
+            if song is not None:
+                song = Song.from_rows(song)
+            elif ent['music_file'] is None:
+                # the current track
+                song = music_data if music_data is not None else Song()
+            tracks.append(Track(song, ent['music_file'], ent['name'],
+                                ent['plan_file'], ent['coalesce_msec'],
+                                copy=False))
+
+        pl = snap['playlist']
+        current = None
+        if pl['current'] is not None:
+            # the song of the snapshot
+            current = tracks[pl['current']]
+            current.src_data = None
+            current.music_data = music_data
+            current.plan = plan
+            current.coalesce_stats = data['coalesce_stats']
+            current.ready.set()
+
+        self._key = snap['key']
+
+        return {
+            'music_data': music_data,
+            'plan': plan,
+            'coalesce_stats': data['coalesce_stats'],
+            'pos': snap['pos'],
+            'playing': snap['playing'],
+            'repeat': snap['repeat'],
+            'tempo': snap['tempo'],
+            'tempo_auto': snap['tempo_auto'],
+            'def_delay': snap['def_delay'],
+            'rotation_speed': snap['rotation_speed'],
+            'rotation_tempo': snap['rotation_tempo'],
+            'playlist': {
+                'current': current,
+                'queue': [tracks[i] for i in pl['queue']],
+                'history': [tracks[i] for i in pl['history']],
+                'loop': pl['loop'],
+                'shuffle': pl['shuffle'],
+            },
+        }
+
+    def restore(self):
+        """ restore the player from the snapshot, and resume
+
+        Returns
+        -------
+        restored: bool
+        """
+        start_time = time.monotonic()
+
+        state = self.load()
+        if state is None:
+            return False
+
+        self._player.set_state(state)
+        # the data file is written again only if it is changed
+        # (ex. the plan is compiled again)
+        self._data_objs = self._data_objs_of(state)
+
+        self.restore_sec = time.monotonic() - start_time
+        music_data = state['music_data']
+        plan = self._player.get_state()['plan']  # may be compiled again
+        self._log.info('restored: %s entries, %s events, pos %s, %s,'
+                       ' %.1f msec',
+                       len(music_data) if music_data is not None else 0,
+                       len(plan) if plan is not None else 0,
+                       state['pos'],
+                       'playing' if state['playing'] else 'stopped',
+                       self.restore_sec * 1000)
+        return True
+
+    def _save_th(self):
+        while not self._stop.wait(self._interval):
+            try:
+                self.save()
+            except OSError as ex:
+                self._log.warning('%s: %s', type(ex).__name__, ex)
+
+    def start(self):
+        """ write periodically (daemon thread) """
+        self._log.debug('')
+
+        self._th = threading.Thread(target=self._save_th, daemon=True)
+        self._th.start()
+
+    def status(self):
+        """
+        Returns
+        -------
+        status: dict
+            file, restore_sec, saves
+        """
+        return {
+            'file': self._file,
+            'restore_sec': (round(self.restore_sec, 3)
+                            if self.restore_sec is not None else None),
+            'saves': self.saves,
+        }
+
+    def end(self):
+        """ stop, and write the last state """
+        self._log.debug('')
+
+        self._stop.set()
+        if self._th is not None:
+            self._th.join()
+
+        try:
+            self.save()
+        except OSError as ex:
+            self._log.warning('%s: %s', type(ex).__name__, ex)
@@ -0,0 +1,191 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Immutable music data
+
+``Song`` is a frozen copy of ``music_data`` (list of MusicDataEnt).
+``Player.music_load()`` takes a ``Song`` by reference:
+no copy, and nobody can change it afterwards.
+
+```python3
+song = Song.from_music_data(music_data)
+player.music_load(song)
+
+song[0]['ch']            # (0, 4, 7) .. tuple
+song[0]['delay']         # msec (float), from 'delay_us'
+song.to_music_data()     # list of dict (for JSON)
+
+rows = song.to_rows()    # [[ch, delay_us, abs_time_us], ..] (compact)
+song = Song.from_rows(rows)
+```
+
+Each entry (``SongEnt``) is a read-only mapping
+with the same keys as MusicDataEnt.
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+from collections.abc import Mapping, Sequence
+from .parser import get_delay_us, get_abs_time_us
+
+
+class SongEnt(Mapping):
+    """
+    Read-only MusicDataEnt
+
+    Attributes
+    ----------
+    ch: tuple of int or None
+    delay_us: int or None
+    abs_time_us: int or None
+    """
+    __slots__ = ('ch', 'delay_us', 'abs_time_us')
+
+    def __init__(self, ch, delay_us, abs_time_us=None):
+        """ Constructor
+
+        Parameters
+        ----------
+        ch: list of int or None
+        delay_us: int or None
+        abs_time_us: int or None
+        """
+        if ch is not None:
+            ch = tuple(ch)
+        object.__setattr__(self, 'ch', ch)
+        object.__setattr__(self, 'delay_us', delay_us)
+        object.__setattr__(self, 'abs_time_us', abs_time_us)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is read-only' % (self.__class__.__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is read-only' % (self.__class__.__name__))
+
+    def __getitem__(self, key):
+        if key == 'ch':
+            return self.ch
+        if key == 'delay_us':
+            return self.delay_us
+        if key == 'delay':
+            if self.delay_us is None:
+                return None
+            return self.delay_us / 1000
+        if self.abs_time_us is not None:
+            if key == 'abs_time_us':
+                return self.abs_time_us
+            if key == 'abs_time':
+                return self.abs_time_us / 1000000
+
+        raise KeyError(key)
+
+    def __iter__(self):
+        if self.abs_time_us is not None:
+            yield 'abs_time'
+            yield 'abs_time_us'
+        yield 'ch'
+        yield 'delay'
+        yield 'delay_us'
+
+    def __len__(self):
+        return 3 if self.abs_time_us is None else 5
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, dict(self))
+
+    def to_dict(self):
+        """
+        Returns
+        -------
+        ent: dict
+            MusicDataEnt (``ch`` is a list)
+        """
+        ent = dict(self)
+        if self.ch is not None:
+            ent['ch'] = list(self.ch)
+        return ent
+
+
+class Song(Sequence):
+    """
+    Immutable music data (sequence of SongEnt)
+    """
+    __slots__ = ('_ents',)
+
+    def __init__(self, ents=()):
+        """ Constructor
+
+        Parameters
+        ----------
+        ents: iterable of SongEnt
+        """
+        object.__setattr__(self, '_ents', tuple(ents))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is read-only' % (self.__class__.__name__))
+
+    @classmethod
+    def from_music_data(cls, music_data):
+        """
+        Parameters
+        ----------
+        music_data: list of MusicDataEnt or Song
+
+        Returns
+        -------
+        song: Song
+            ``music_data`` itself, if it is a Song
+        """
+        if isinstance(music_data, cls):
+            return music_data
+
+        return cls([SongEnt(ent['ch'], get_delay_us(ent),
+                            get_abs_time_us(ent)) for ent in music_data])
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Parameters
+        ----------
+        rows: list of [ch, delay_us, abs_time_us]
+            ``to_rows()``
+
+        Returns
+        -------
+        song: Song
+        """
+        return cls([SongEnt(*row) for row in rows])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.__class__(self._ents[i])
+        return self._ents[i]
+
+    def __len__(self):
+        return len(self._ents)
+
+    def __iter__(self):
+        return iter(self._ents)
+
+    def __repr__(self):
+        return '%s(%s entries)' % (self.__class__.__name__, len(self))
+
+    def to_music_data(self):
+        """
+        Returns
+        -------
+        music_data: list of dict
+        """
+        return [ent.to_dict() for ent in self._ents]
+
+    def to_rows(self):
+        """ compact form (no keys, integer usec)
+
+        Returns
+        -------
+        rows: list of [ch, delay_us, abs_time_us]
+            ch: list of int or None
+        """
+        return [[list(ent.ch) if ent.ch is not None else None,
+                 ent.delay_us, ent.abs_time_us] for ent in self._ents]
@@ -0,0 +1,318 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Live note stream with a jitter buffer
+
+A client sends batches of notes, tagged with its own clock,
+over one websocket connection:
+
+```
+{"cmd": "stream", "sent": 12.350,
+ "notes": [{"t": 12.300, "ch": [0, 4]}, {"t": 12.340, "ch": [7]}]}
+```
+
+The clock offset (client -> local) is the minimum of
+``recv_time - sent`` in a sliding window (the fastest batch),
+so it includes the minimum network delay.
+Each note is played at
+
+    t + offset + buffer
+
+``buffer`` follows the delay of the recent notes
+(``recv_time - t - offset``: network jitter and batching),
+quantile + margin: it goes up at once, and down slowly.
+
+Notes with a time (or a batch with a ``sent``) that is not a finite
+number, or channels that are not a list of int, are dropped
+(``invalid``): they would spoil the offset and the buffer.
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import math
+import heapq
+import threading
+from collections import deque
+from .clock import RealClock
+from .rt import LatenessHistogram
+from .my_logger import get_logger
+
+
+class NoteStream:
+    """
+    Jitter buffer and scheduler for live notes
+
+    ```python3
+    stream = NoteStream(player.movement(), player.clock())
+    stream.add([{'t': 12.3, 'ch': [0, 4]}], sent=12.35)
+    stream.stats()
+    stream.end()
+    ```
+    """
+    WINDOW = 64            # number of batches (notes) for offset (buffer)
+    QUANTILE = 0.95
+    MARGIN_SEC = 0.005
+    BUF_MIN_SEC = 0.01
+    BUF_MAX_SEC = 0.5
+    BUF_DECAY = 0.05       # ratio of the excess to go down per batch
+    LATE_SEC = 0.05        # later than this: dropped
+    STATS_N = 4096         # number of samples for statistics
+
+    def __init__(self, movement, clock=None, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        movement: Movement
+            ``single_play_at()`` and ``max_lead()``
+        clock: RealClock or SimClock
+            real time (``SimClock(realtime=True)``)
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+
+        self._movement = movement
+        self._clock = clock
+        if self._clock is None:
+            self._clock = RealClock()
+
+        self._samples = deque(maxlen=self.WINDOW)  # recv_time - sent
+        self._delays = deque(maxlen=self.WINDOW)   # of notes
+        self._offset = None
+        self._buf = self.BUF_MIN_SEC
+
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._active = True
+
+        self.reset_stats()
+
+        self._th = threading.Thread(target=self._play_th, daemon=True)
+        self._th.start()
+
+    def end(self):
+        """ stop (notes in the buffer are discarded) """
+        self._log.debug('')
+
+        with self._cond:
+            self._active = False
+            self._heap = []
+            self._cond.notify()
+
+        self._th.join()
+
+    def reset_stats(self):
+        """ reset statistics """
+        self._stat = {
+            'batches': 0,
+            'notes': 0,
+            'played': 0,
+            'late': 0,
+            'dropped': 0,
+            'invalid': 0,
+            'failed': 0,
+        }
+        self._jitter = deque(maxlen=self.STATS_N)
+        self._latency = deque(maxlen=self.STATS_N)
+        self._lateness = LatenessHistogram()
+
+    @staticmethod
+    def valid_time(t):
+        """
+        Returns
+        -------
+        ok: bool
+            a finite number
+        """
+        return (isinstance(t, (int, float)) and not isinstance(t, bool)
+                and math.isfinite(t))
+
+    @classmethod
+    def valid_note(cls, note):
+        """
+        Parameters
+        ----------
+        note: {'t': float, 'ch': list of int}
+
+        Returns
+        -------
+        ok: bool
+        """
+        if not isinstance(note, dict) or not cls.valid_time(note.get('t')):
+            return False
+
+        ch_list = note.get('ch')
+        return isinstance(ch_list, list) and all(
+            [isinstance(ch, int) and not isinstance(ch, bool)
+             for ch in ch_list])
+
+    def add(self, notes, sent=None, recv_time=None):
+        """
+        add a batch of notes
+
+        Parameters
+        ----------
+        notes: list of {'t': float, 'ch': list of int}
+            t: client time (sec)
+        sent: float
+            client time of sending, None: ``t`` of the last note
+        recv_time: float
+            None: now
+
+        Returns
+        -------
+        n: int
+            number of notes accepted
+
+        Raises
+        ------
+        TypeError
+            ``notes`` is not a list
+        """
+        if recv_time is None:
+            recv_time = self._clock.monotonic()
+
+        if not isinstance(notes, list):
+            raise TypeError('notes: %s' % type(notes).__name__)
+
+        valid = [n for n in notes if self.valid_note(n)]
+        if sent is not None and not self.valid_time(sent):
+            valid = []
+        if len(valid) < len(notes):
+            self._log.warning('%s invalid notes (sent=%s) .. dropped',
+                              len(notes) - len(valid), sent)
+            self._stat['invalid'] += len(notes) - len(valid)
+        notes = valid
+
+        if not notes:
+            return 0
+
+        if sent is None:
+            sent = max([n['t'] for n in notes])
+
+        self._samples.append(recv_time - sent)
+        self._offset = min(self._samples)
+
+        for note in notes:
+            delay = recv_time - note['t'] - self._offset
+            self._delays.append(delay)
+            self._jitter.append(delay)
+        self.update_buffer()
+
+        self._stat['batches'] += 1
+
+        n = 0
+        with self._cond:
+            for note in notes:
+                self._stat['notes'] += 1
+                play_time = note['t'] + self._offset + self._buf
+                late = recv_time - play_time
+                if late > self.LATE_SEC:
+                    self._stat['dropped'] += 1
+                    continue
+                if late > 0:
+                    self._stat['late'] += 1
+
+                heapq.heappush(self._heap, (play_time, self._seq,
+                                            note['t'], note['ch']))
+                self._seq += 1
+                n += 1
+
+            self._cond.notify()
+
+        return n
+
+    def update_buffer(self):
+        """ buffer size from the delay of the recent notes """
+        delays = sorted(self._delays)
+        target = delays[int((len(delays) - 1) * self.QUANTILE)]
+        target = min(max(target + self.MARGIN_SEC, self.BUF_MIN_SEC),
+                     self.BUF_MAX_SEC)
+
+        if target >= self._buf:
+            self._buf = target
+        else:
+            self._buf -= (self._buf - target) * self.BUF_DECAY
+
+    def _play_th(self):
+        """ play notes at their time """
+        self._log.debug('start')
+
+        lead = self._movement.max_lead()
+        monotonic = self._clock.monotonic
+
+        while True:
+            with self._cond:
+                while self._active:
+                    if self._heap:
+                        wait_sec = self._heap[0][0] - lead - monotonic()
+                        if wait_sec <= 0:
+                            break
+                        self._cond.wait(wait_sec)
+                    else:
+                        self._cond.wait()
+
+                if not self._active:
+                    break
+
+                play_time, _, t, ch_list = heapq.heappop(self._heap)
+
+            now = monotonic()
+            self._lateness.add(now - (play_time - lead))
+
+            try:
+                self._movement.single_play_at(ch_list, play_time)
+            except (IndexError, KeyError, TypeError, ValueError) as ex:
+                # ex. no such channel: the stream goes on
+                self._log.error('ch=%s: %s: %s', ch_list,
+                                type(ex).__name__, ex)
+                self._stat['failed'] += 1
+                continue
+            self._stat['played'] += 1
+            self._latency.append(max(play_time, now) - (t + self._offset))
+
+        self._log.debug('done')
+
+    @staticmethod
+    def summary(values):
+        """
+        Returns
+        -------
+        summary: dict
+            min, mean, p95, max (msec)
+        """
+        if not values:
+            return {}
+
+        values = sorted(values)
+        return {
+            'min': round(values[0] * 1000, 3),
+            'mean': round(sum(values) / len(values) * 1000, 3),
+            'p95': round(values[int((len(values) - 1) * 0.95)] * 1000, 3),
+            'max': round(values[-1] * 1000, 3),
+        }
+
+    def stats(self):
+        """
+        Returns
+        -------
+        stats: dict
+            batches, notes, played,
+            late: arrived after the play time (played at once),
+            dropped: arrived too late,
+            invalid: not a finite time or not a list of int channels,
+            failed: error in playing (ex. no such channel),
+            offset_sec, buffer_msec,
+            jitter_msec: delay of notes (network jitter, batching),
+            latency_msec: from note time (+ offset) to play time,
+            lateness: how late the play thread woke up
+        """
+        stats = dict(self._stat)
+        stats['offset_sec'] = self._offset
+        stats['buffer_msec'] = round(self._buf * 1000, 3)
+        stats['jitter_msec'] = self.summary(self._jitter)
+        stats['latency_msec'] = self.summary(self._latency)
+        stats['lateness'] = self._lateness.to_dict()
+        return stats
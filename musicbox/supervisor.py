@@ -0,0 +1,460 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+Supervisor: boot the Music Box and keep it running (``MusicBox up``)
+
+```
+pigpiod  .. checked (started if it is not listening)
+webapp   .. child: ready when its port accepts connections
+server   .. child: ready when every endpoint answers ``status``
+             (a server listens after its hardware is initialized)
+chime    .. the first note, when the server is ready
+```
+
+The steps wait for these readiness signals, not for fixed sleeps.
+A child that exits is restarted with exponential backoff
+(``BACKOFF_MIN`` .. ``BACKOFF_MAX`` sec, reset after ``STABLE_SEC``).
+On ``end()``, all children are stopped at once:
+SIGINT (their ``finally:`` clean up the hardware),
+then SIGKILL for the ones still alive after ``STOP_TIMEOUT``.
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021/02'
+
+import os
+import sys
+import time
+import signal
+import socket
+import subprocess
+import threading
+from .my_logger import get_logger
+
+PIGPIOD_PORT = int(os.environ.get('PIGPIO_PORT', 8888))
+
+
+def port_open(port, host='localhost', timeout=0.5):
+    """ readiness probe: the port accepts connections
+
+    Parameters
+    ----------
+    port: int
+    host: str
+    timeout: float
+        sec
+
+    Returns
+    -------
+    ok: bool
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def ws_ready(port, host='localhost', timeout=1.0):
+    """ readiness probe: the Music Box server answers ``status``
+
+    Parameters
+    ----------
+    port: int
+    host: str
+    timeout: float
+        sec, a busy server is not ready
+        (the supervisor loop must not be blocked)
+
+    Returns
+    -------
+    ok: bool
+    """
+    from websocket import WebSocketException
+    from .wsclient import WsClientHostPort
+
+    if not port_open(port, host, timeout):
+        return False
+    try:
+        WsClientHostPort(host, port, timeout=timeout).request(
+            {'cmd': 'status'})
+        return True
+    except (OSError, ValueError, WebSocketException):
+        return False
+
+
+def uptime():
+    """ time since the system boot (sec), None if unknown """
+    try:
+        with open('/proc/uptime') as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Child:
+    """
+    a supervised child process
+
+    Attributes
+    ----------
+    name: str
+    proc: subprocess.Popen
+        None: not running
+    ready: bool
+    restarts: int
+    ready_sec: float
+        time from the last start to ready
+    """
+    BACKOFF_MIN = 1.0  # sec
+    BACKOFF_MAX = 30.0  # sec
+    STABLE_SEC = 60.0  # sec
+
+    def __init__(self, name, argv, probe, prepare=None, log_file=None,
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        name: str
+        argv: list of str
+        probe: function() -> bool
+            readiness probe
+        prepare: function() -> None
+            called before each (re)start (ex. check pigpiod)
+        log_file: str
+            stdout and stderr are appended, None: inherited
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('name=%s, argv=%s', name, argv)
+
+        self.name = name
+        self._argv = argv
+        self._probe = probe
+        self._prepare = prepare
+        self._log_file = log_file
+
+        self.proc = None
+        self.ready = False
+        self.restarts = 0
+        self.ready_sec = None
+        self._start_time = None
+        self._backoff = self.BACKOFF_MIN
+        self._restart_at = None
+
+    def start(self):
+        """ start the process (not ready yet) """
+        if self._prepare is not None:
+            self._prepare()
+
+        out = None
+        if self._log_file is not None:
+            out = open(self._log_file, 'a')
+
+        # own session: SIGINT of the terminal goes to the supervisor,
+        # that stops the children in parallel
+        self.proc = subprocess.Popen(self._argv, stdout=out,
+                                     stderr=subprocess.STDOUT,
+                                     start_new_session=True)
+        if out is not None:
+            out.close()
+
+        self._start_time = time.monotonic()
+        self._restart_at = None
+        self.ready = False
+        self._log.info('%s: started (pid %s)', self.name, self.proc.pid)
+
+    def try_start(self):
+        """ ``start()``, or retry it after the backoff if it fails
+        (ex. pigpiod is not ready)
+
+        Returns
+        -------
+        started: bool
+        """
+        try:
+            self.start()
+        except (OSError, RuntimeError) as ex:
+            self._log.error('%s: %s: %s, retry in %.1f sec', self.name,
+                            type(ex).__name__, ex, self._backoff)
+            self._restart_at = time.monotonic() + self._backoff
+            self._backoff = min(self._backoff * 2, self.BACKOFF_MAX)
+            return False
+
+        return True
+
+    def poll(self):
+        """ check the state, restart if the backoff has passed
+
+        Returns
+        -------
+        ready_now: bool
+            True: became ready in this call
+        """
+        now = time.monotonic()
+
+        if self.proc is None:
+            if self._restart_at is not None and now >= self._restart_at:
+                self.restarts += 1
+                self.try_start()
+            return False
+
+        rc = self.proc.poll()
+        if rc is not None:
+            run_sec = now - self._start_time
+            if run_sec >= self.STABLE_SEC:
+                self._backoff = self.BACKOFF_MIN
+
+            self._log.warning('%s: exited (rc=%s) after %.1f sec,'
+                              ' restart in %.1f sec',
+                              self.name, rc, run_sec, self._backoff)
+            self.proc = None
+            self.ready = False
+            self._restart_at = now + self._backoff
+            self._backoff = min(self._backoff * 2, self.BACKOFF_MAX)
+            return False
+
+        if self.ready or not self._probe():
+            return False
+
+        self.ready = True
+        self.ready_sec = time.monotonic() - self._start_time
+        self._log.info('%s: ready in %.3f sec', self.name, self.ready_sec)
+        return True
+
+    def signal(self, sig):
+        """ send a signal (if running) """
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.send_signal(sig)
+
+    def wait(self, timeout):
+        """ wait for the exit, SIGKILL after timeout
+
+        Returns
+        -------
+        rc: int
+            None: was not running
+        """
+        if self.proc is None:
+            return None
+
+        try:
+            rc = self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self._log.warning('%s: not stopped in %.1f sec, kill',
+                              self.name, timeout)
+            self.proc.kill()
+            rc = self.proc.wait()
+
+        self.proc = None
+        return rc
+
+
+class Supervisor:
+    """
+    ```python3
+    sv = Supervisor(['8880:0', '8881:1', '8882:2', '8883:3'])
+    try:
+        sv.main()     # until SIGTERM or KeyboardInterrupt
+    finally:
+        sv.end()
+    ```
+    """
+    POLL_SEC = 0.05
+    STOP_TIMEOUT = 5.0  # sec
+    BOOT_TIMEOUT = 120.0  # sec
+
+    CHIME = [[69], [73], [76], [69, 73, 76]]
+    CHIME_INTERVAL = 0.2  # sec
+    CHIME_TIMEOUT = 1.0  # sec
+
+    def __init__(self, endpoints, server_args=(), web_port=None,
+                 web_args=(), chime_port=None, pigpiod=True,
+                 log_dir=None, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        endpoints: list of str
+            'port:wav_mode' of the server
+        server_args: list of str
+            other options of ``MusicBox server``
+        web_port: int
+            None: no web application
+        web_args: list of str
+            other options of ``MusicBox webapp``
+        chime_port: int
+            play ``CHIME`` on this endpoint when it is ready,
+            None: no chime (the first note is logged when
+            the server is ready)
+        pigpiod: bool
+            check (and start) pigpiod before the server
+        log_dir: str
+            log files of the children (webapp.log, server.log),
+            None: inherited stdout
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+        self._log.debug('endpoints=%s, web_port=%s, chime_port=%s',
+                        endpoints, web_port, chime_port)
+
+        self._up_time = time.monotonic()
+        self._boot_uptime = uptime()
+
+        self._ports = [int(ep.split(':')[0]) for ep in endpoints]
+        self._chime_port = chime_port
+        if chime_port is not None and chime_port not in self._ports:
+            self._log.warning('chime port %s: not an endpoint, no chime',
+                              chime_port)
+            self._chime_port = None
+        self._pigpiod = pigpiod
+
+        self._stop = threading.Event()
+        self.first_note_sec = None
+
+        cmd = [sys.executable, '-m', 'musicbox']
+        dbg = ['-d'] if self._dbg else []
+
+        def log_file(name):
+            if log_dir is None:
+                return None
+            return os.path.join(log_dir, '%s.log' % (name))
+
+        self.children = []
+        if web_port is not None:
+            self.children.append(Child(
+                'webapp',
+                cmd + ['webapp', '-p', str(web_port)] + list(web_args) + dbg,
+                lambda: port_open(web_port),
+                log_file=log_file('webapp'), debug=self._dbg))
+
+        server_argv = cmd + ['server']
+        for ep in endpoints:
+            server_argv += ['-e', ep]
+        self.children.append(Child(
+            'server', server_argv + list(server_args) + dbg,
+            lambda: all([ws_ready(p) for p in self._ports]),
+            prepare=self.check_pigpiod if pigpiod else None,
+            log_file=log_file('server'), debug=self._dbg))
+
+    def check_pigpiod(self, timeout=10.0):
+        """ start pigpiod if it is not listening, and wait for it """
+        if port_open(PIGPIOD_PORT):
+            self._log.debug('pigpiod: ok')
+            return
+
+        t0 = time.monotonic()
+        self._log.info('pigpiod: starting')
+        cmd = ['pigpiod'] if os.geteuid() == 0 else ['sudo', 'pigpiod']
+        subprocess.call(cmd)
+
+        while not port_open(PIGPIOD_PORT):
+            if time.monotonic() - t0 > timeout:
+                raise RuntimeError('pigpiod: not ready in %s sec' % timeout)
+            time.sleep(self.POLL_SEC)
+
+        self._log.info('pigpiod: ready in %.3f sec', time.monotonic() - t0)
+
+    def first_note(self):
+        """ play ``CHIME`` (if a chime port is given),
+        and log the time from the start and from the system boot
+        """
+        if self._chime_port is not None:
+            from websocket import WebSocketException
+            from .wsclient import WsClientHostPort
+
+            client = WsClientHostPort('localhost', self._chime_port,
+                                      timeout=self.CHIME_TIMEOUT,
+                                      debug=self._dbg)
+            try:
+                client.send({'cmd': 'single_play', 'ch': self.CHIME[0]})
+            except (OSError, WebSocketException) as ex:
+                self._log.warning('chime: %s: %s', type(ex).__name__, ex)
+                return
+
+        self.first_note_sec = time.monotonic() - self._up_time
+        boot = ''
+        if self._boot_uptime is not None:
+            boot = ', %.3f sec from the system boot' % (
+                self._boot_uptime + self.first_note_sec)
+        self._log.info('first note: %.3f sec from start%s',
+                       self.first_note_sec, boot)
+
+        if self._chime_port is None:
+            return
+        try:
+            for ch in self.CHIME[1:]:
+                time.sleep(self.CHIME_INTERVAL)
+                client.send({'cmd': 'single_play', 'ch': ch})
+        except (OSError, WebSocketException) as ex:
+            self._log.warning('chime: %s: %s', type(ex).__name__, ex)
+
+    def status(self):
+        """
+        Returns
+        -------
+        status: list of dict
+            name, pid, ready, ready_sec, restarts
+        """
+        return [{'name': c.name,
+                 'pid': c.proc.pid if c.proc is not None else None,
+                 'ready': c.ready, 'ready_sec': c.ready_sec,
+                 'restarts': c.restarts} for c in self.children]
+
+    def main(self):
+        """ boot, and supervise until SIGTERM (or KeyboardInterrupt) """
+        self._log.debug('')
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._stop.set())
+        # SIGINT may be ignored (started in background by a shell),
+        # the children must not inherit it: ``end()`` uses it
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+        # the webapp doesn't wait for pigpiod,
+        # a child that fails to start is retried by ``poll()``
+        for c in self.children:
+            c.try_start()
+
+        server = self.children[-1]
+        booting = True
+        while not self._stop.wait(self.POLL_SEC):
+            for c in self.children:
+                c.poll()
+
+            # the music doesn't wait for the webapp
+            if self.first_note_sec is None and server.ready:
+                self.first_note()
+
+            if not booting:
+                continue
+
+            if all([c.ready for c in self.children]):
+                booting = False
+                self._log.info('up: %.3f sec',
+                               time.monotonic() - self._up_time)
+
+            elif time.monotonic() - self._up_time > self.BOOT_TIMEOUT:
+                booting = False
+                self._log.error('not ready in %s sec: %s', self.BOOT_TIMEOUT,
+                                [c.name for c in self.children
+                                 if not c.ready])
+
+        self._log.debug('stop')
+
+    def end(self):
+        """ stop all children in parallel """
+        self._log.debug('')
+        t0 = time.monotonic()
+
+        for c in self.children:
+            c.signal(signal.SIGINT)
+
+        th = [threading.Thread(target=c.wait, args=(self.STOP_TIMEOUT,))
+              for c in self.children]
+        for t in th:
+            t.start()
+        for t in th:
+            t.join()
+
+        self._log.info('down: %.3f sec', time.monotonic() - t0)
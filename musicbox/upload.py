@@ -67,6 +67,32 @@ class UploadWebHandler(tornado.web.RequestHandler):
                     svr_list=self.SVR_LIST,
                     msg=msg )
 
+    def server_ch_n(self, ws):
+        """
+        number of channels of the Music Box server
+        (all the servo boards: ``status``)
+
+        Parameters
+        ----------
+        ws: WsClient
+
+        Returns
+        -------
+        ch_n: int
+            ``Midi.CH_N``: unknown
+        """
+        from websocket import WebSocketException
+
+        try:
+            ch_n = ws.request({'cmd': 'status'}).get('ch_n')
+        except (OSError, ValueError, WebSocketException) as ex:
+            self._mylog.warning('status: %s: %s', type(ex).__name__, ex)
+            return Midi.CH_N
+
+        if not isinstance(ch_n, int) or ch_n < 1:
+            return Midi.CH_N
+        return ch_n
+
     def post(self):
         """
         [TBD] ``wav_mode``の判断
@@ -93,12 +119,21 @@ class UploadWebHandler(tornado.web.RequestHandler):
         self._mylog.debug('upfilename=%s, upfile_ext=%s',
                           upfilename, upfile_ext)
 
-        upload_path_name = '%s/%s' % (self._upload_dir, upfilename)
-        musicdata_path = '%s/%s-%s.%s' % (
-            self._musicdata_dir, upfilename, svr_port, 'json')
-
         ws = WsClient(url=ws_url, debug=self._dbg)
 
+        # MIDI notes are fitted to all the boards of the server
+        ch_n = Midi.CH_N
+        if svr_port not in (8882, 8883):
+            ch_n = self.server_ch_n(ws)
+        self._mylog.debug('ch_n=%s', ch_n)
+
+        upload_path_name = '%s/%s' % (self._upload_dir, upfilename)
+        musicdata_name = '%s-%s' % (upfilename, svr_port)
+        if ch_n != Midi.CH_N:
+            musicdata_name += '-%sch' % (ch_n)
+        musicdata_path = '%s/%s.%s' % (
+            self._musicdata_dir, musicdata_name, 'json')
+
         parsed_data = None
 
         if os.path.exists(musicdata_path):
@@ -113,10 +148,10 @@ class UploadWebHandler(tornado.web.RequestHandler):
                 f.write(upfile['body'])
 
             if upfile_ext in ('mid', 'midi'):
-                parser = Midi(debug=self._dbg)
+                parser = Midi(ch_n=ch_n, debug=self._dbg)
 
                 note_origin = -1
-                note_offset = Midi.NOTE_OFFSET
+                note_offset = parser.note_offset
 
                 if svr_port in (8882, 8883):
                     note_origin = 0
@@ -9,10 +9,6 @@ __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021/01'
 
 import os
-import tornado.ioloop
-import tornado.web
-from .calibration import CalibrationWebHandler
-from .upload import UploadWebHandler
 from .my_logger import get_logger
 
 
@@ -46,6 +42,10 @@ class WebServer:
         self._upload_dir = upload_dir
         self._musicdata_dir = musicdata_dir
 
+        import tornado.web
+        from .calibration import CalibrationWebHandler
+        from .upload import UploadWebHandler
+
         self._app = tornado.web.Application(
             [
                 (r"/", CalibrationWebHandler),
@@ -71,6 +71,8 @@ class WebServer:
         """ main """
         self._log.debug('')
 
+        import tornado.ioloop
+
         self._app.listen(self._port)
         self._log.info('start server: run forever ..')
         tornado.ioloop.IOLoop.current().start()
@@ -5,6 +5,7 @@
 Music Box websocket client
 """
 import json
+import time
 from websocket import create_connection
 from . import WsServer
 from .my_logger import get_logger
@@ -19,13 +20,22 @@ class WsClient:
 
     DEF_URL = 'ws://%s:%d/' % (DEF_HOST, DEF_PORT)
 
-    def __init__(self, url=DEF_URL, debug=False) -> None:
-        """ Constructor """
+    def __init__(self, url=DEF_URL, timeout=None, debug=False) -> None:
+        """ Constructor
+
+        Parameters
+        ----------
+        url: str
+        timeout: float
+            sec, for connecting, sending and receiving,
+            None: no timeout
+        """
         self._dbg = debug
         self._log = get_logger(self.__class__.__name__, self._dbg)
-        self._log.debug('url=%s', url)
+        self._log.debug('url=%s, timeout=%s', url, timeout)
 
         self._url = url
+        self._timeout = timeout
 
     def ws_url(self, host_or_ip, port):
         """
@@ -48,10 +58,29 @@ class WsClient:
 
         msg_json = json.dumps(msg)
 
-        ws = create_connection(self._url)
+        ws = create_connection(self._url, timeout=self._timeout)
         ws.send(msg_json)
         ws.close()
 
+    def request(self, msg):
+        """
+        send and wait for the reply (ex. ``status``)
+
+        Parameters
+        ----------
+        msg: object
+
+        Returns
+        -------
+        reply: object
+        """
+        ws = create_connection(self._url, timeout=self._timeout)
+        try:
+            ws.send(json.dumps(msg))
+            return json.loads(ws.recv())
+        finally:
+            ws.close()
+
     def send_music(self, music_data):
         """
         Parameters
@@ -82,9 +111,110 @@ class WsClientHostPort(WsClient):
     DEF_HOST = 'localhost'
     DEF_PORT = WsServer.DEF_PORT
 
-    def __init__(self, host=DEF_HOST, port=DEF_PORT, debug=False) -> None:
-        """ Constructor """
+    def __init__(self, host=DEF_HOST, port=DEF_PORT, timeout=None,
+                 debug=False) -> None:
+        """ Constructor
+
+        Parameters
+        ----------
+        host: str
+        port: int
+        timeout: float
+            sec, None: no timeout
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+
+        super().__init__(self.ws_url(host, port), timeout=timeout,
+                         debug=self._dbg)
+
+
+class WsStreamClient(WsClient):
+    """
+    websocket client for live streaming (one persistent connection)
+
+    ```python3
+    client = WsStreamClient('ws://musicbox:8880/')
+    client.send_notes([{'t': time.monotonic(), 'ch': [0, 4]}])
+    client.sync()      # (offset, rtt)
+    client.stats()
+    client.close()
+    ```
+    """
+    def __init__(self, url=WsClient.DEF_URL, clock=time.monotonic,
+                 debug=False) -> None:
+        """ Constructor
+
+        Parameters
+        ----------
+        url: str
+        clock: function
+            client clock for the timestamps of notes (sec)
+        """
         self._dbg = debug
         self._log = get_logger(self.__class__.__name__, self._dbg)
 
-        super().__init__(self.ws_url(host, port), debug=self._dbg)
+        super().__init__(url, debug=self._dbg)
+
+        self._clock = clock
+        self._ws = create_connection(self._url)
+
+    def close(self):
+        """ close the connection """
+        self._ws.close()
+
+    def send(self, msg):
+        """
+        Parameters
+        ----------
+        msg: object
+        """
+        self._ws.send(json.dumps(msg))
+
+    def request(self, msg):
+        """
+        send and wait for the reply
+
+        Returns
+        -------
+        reply: object
+        """
+        self.send(msg)
+        return json.loads(self._ws.recv())
+
+    def send_notes(self, notes):
+        """
+        Parameters
+        ----------
+        notes: list of {'t': float, 'ch': list of int}
+            t: client clock
+        """
+        self.send({'cmd': 'stream', 'sent': self._clock(), 'notes': notes})
+
+    def sync(self):
+        """
+        NTP style clock offset
+
+        Returns
+        -------
+        offset: float
+            server clock - client clock (sec)
+        rtt: float
+            round trip time (sec)
+        """
+        t0 = self._clock()
+        reply = self.request({'cmd': 'stream_sync', 't0': t0})
+        t3 = self._clock()
+
+        offset = ((reply['t1'] - t0) + (reply['t2'] - t3)) / 2
+        rtt = (t3 - t0) - (reply['t2'] - reply['t1'])
+        return offset, rtt
+
+    def stats(self, reset=False):
+        """
+        Returns
+        -------
+        stats: dict
+            see ``NoteStream.stats()``
+        """
+        return self.request({'cmd': 'stream_stats', 'reset': reset})
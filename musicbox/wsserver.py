@@ -20,14 +20,30 @@ This -->|                  WsServer                  |
         | pigpioPCA9685 |   StepMtr     |            |
          --------------------------------------------
 
+### Several endpoints in one process (``MultiWsServer``)
+
+``MusicBox server -e 8880:0 -e 8881:1 -e 8882:2 -e 8883:3``
+
+One interpreter, one event loop, one ``Player`` per (port, wav_mode).
+The wav files are loaded once (wav_mode 1 and 2 use the same files).
+
+Blocking calls of a player (load, compile, ``music_wait``, ..)
+run in a worker thread of its endpoint (``run_blocking()``),
+not on the event loop: one client doesn't stop the other endpoints.
+
 """
 __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021/01'
 
+import os
 import json
-import asyncio
-import websockets
+import math
+import time
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from . import Player
+from .stream import NoteStream
 from .my_logger import get_logger
 
 
@@ -39,7 +55,9 @@ class WsServer:
     {"cmd": "single_play", "ch": [0,2,4]}  # single play
 
     {"cmd": "music_load",                 # load music and play
-     "music_data": [ {"ch": null,"delay": 500},.. ]
+     "music_data": [ {"ch": null,"delay": 500},.. ],
+     "coalesce": 15 }                     # (optional) merge window (msec)
+                                          # the plan is cached in plan_dir
 
 
     {"cmd": "music_play"}                 # (re)start music
@@ -47,6 +65,40 @@ class WsServer:
     {"cmd": "music_pause"}
     {"cmd": "music_seek", "pos": 30.5}
     {"cmd": "music_rewind"}
+    {"cmd": "music_tempo", "rate": 0.5}   # 0.25 .. 4.0, or "auto"
+
+    {"cmd": "playlist_add",               # add to playlist (gapless)
+     "music_data": [ .. ],                # or "music_file": "x.mid"
+                                          # (in music_dir of the server)
+     "name": "song1",                     # (optional)
+     "play": true }                       # (optional) start playing
+    {"cmd": "playlist_next"}              # skip to the next track
+    {"cmd": "playlist_shuffle", "on": true}
+    {"cmd": "playlist_loop", "on": true}
+    {"cmd": "playlist_clear"}
+    {"cmd": "playlist"}                   # reply: {"current":.., "queue":..}
+
+    # live streaming (on one connection, see ``musicbox.stream``)
+    {"cmd": "stream",                     # notes with the client's clock
+     "sent": 12.35,                       # client time of sending (sec)
+     "notes": [ {"t": 12.3, "ch": [0,4]},.. ]}
+    {"cmd": "stream_sync", "t0": 12.36}   # reply: {"t0":.., "t1":.., "t2":..}
+    {"cmd": "stream_stats", "reset": false}  # reply: latency, jitter, ..
+
+    # ensemble (see ``musicbox.ensemble``)
+    {"cmd": "ensemble_start",             # start at the leader's time
+     "leader": "ws://box1:8880/",         # null: this server is the leader
+     "start": 12345.678,                  # leader's clock (sec)
+     "music_data": [ .. ],                # (optional)
+     "repeat": false }
+    {"cmd": "ensemble_status"}            # reply: offset, rtt, drift, ..
+
+    {"cmd": "status"}                     # reply: this endpoint
+    {"cmd": "endpoints"}                  # reply: all endpoints
+                                          #        of the process
+
+    {"cmd": "rotation_speed", "speed": 7.5}   # 0.0 .. 10.0
+    {"cmd": "rotation_tempo", "on": true}     # speed follows tempo
 
     {"cmd": "calibrate",                # change servo param
      "ch": 5,
@@ -54,6 +106,15 @@ class WsServer:
      "pw_diff": -10,
      "tap": ture }
 
+    {"cmd": "set_interval",             # push/pull interval of servo
+     "ch": 5,
+     "push": 0.08,                      # sec (optional)
+     "pull": 0.1 }                      # sec (optional)
+
+    # remote board (see ``musicbox.channel_map``)
+    {"cmd": "servo_pw",                 # write pulse widths as they are
+     "pw": [ [0, 1500], [3, 1020],.. ]} # [ch, pw],..
+
 
     Simple client example(1)
     ---------------------------------------
@@ -90,6 +151,18 @@ class WsServer:
                  wav_mode=Player.WAVMODE_NONE,
                  host="0.0.0.0", port=DEF_PORT,
                  wavdir='wav',
+                 rotation_backend=Player.ROTATION_BACKEND,
+                 rotation_tempo=False,
+                 push_budget=Player.PUSH_BUDGET,
+                 actuator_proc=False,
+                 realtime=False,
+                 rt_cpu=None,
+                 coalesce_msec=0,
+                 coalesce_mode='first',
+                 boards=None,
+                 snapshot_dir=None,
+                 plan_dir=None,
+                 music_dir=None,
                  debug=False):
         """ Constructor
 
@@ -103,7 +176,37 @@ class WsServer:
             port number
         wavdir: str
             wav file directory
+        rotation_backend: str
+            'thread' or 'wave'
+        rotation_tempo: bool
+            tie rotation speed to the tempo of the song
+        push_budget: int
+            max number of servos that start a push at once
+        actuator_proc: bool
+            servo writes run in a child process
+        realtime: bool
+            real-time priority for the music thread
+        rt_cpu: int
+            CPU for the music thread
+        coalesce_msec: float
+            notes within this window are merged into one chord
+        coalesce_mode: str
+            'first', 'mean' or 'grid'
+        boards: str
+            servo channels over several boards (``musicbox.channel_map``)
+        snapshot_dir: str
+            the state is saved to 'musicbox-<port>.snapshot' in it,
+            and resumed at the next start (``musicbox.snapshot``),
+            None: disabled
+        plan_dir: str
+            cache directory of the actuation plans, None: no cache
+            (the clients can't give the path of a cache file)
+        music_dir: str
+            "music_file" of ``playlist_add`` must be in it,
+            None: "music_file" is not accepted
         """
+        init_start = time.monotonic()
+
         self._dbg = debug
         self._log = get_logger(self.__class__.__name__, self._dbg)
         self._log.debug('wav_mode=%s', wav_mode)
@@ -114,37 +217,183 @@ class WsServer:
         self._port = port
         self._host = host
         self._wavdir = wavdir
+        self._rotation_backend = rotation_backend
+        self._music_dir = music_dir
+
+        self._ensemble = None
+
+        # blocking calls of the player: one at a time, in order
+        self._worker = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='WsServer-%s' % (port))
 
         self._player = Player(wav_mode=self._wav_mode,
-                              wavdir=self._wavdir, debug=self._dbg)
+                              wavdir=self._wavdir,
+                              rotation_backend=self._rotation_backend,
+                              rotation_tempo=rotation_tempo,
+                              push_budget=push_budget,
+                              actuator_proc=actuator_proc,
+                              realtime=realtime,
+                              rt_cpu=rt_cpu,
+                              coalesce_msec=coalesce_msec,
+                              coalesce_mode=coalesce_mode,
+                              boards=boards,
+                              plan_dir=plan_dir,
+                              debug=self._dbg)
+
+        # warm restart: resume before listening
+        self._snapshot = None
+        if snapshot_dir is not None:
+            from .snapshot import Snapshot
+
+            self._snapshot = Snapshot(
+                self._player,
+                os.path.join(snapshot_dir, 'musicbox-%s.snapshot' % (port)),
+                debug=self._dbg)
+            self._snapshot.restore()
+            self._snapshot.start()
+
+        self.group = None   # MultiWsServer
+        self._conn_n = 0
+        self.init_sec = time.monotonic() - init_start
+        self._log.info('port %s: ready in %.3f sec', port, self.init_sec)
+
+    def start(self):
+        """ start listening (on the event loop of this thread) """
+        self._log.debug('start server ..')
+
+        import asyncio
+        import websockets
 
-        self._start_svr = websockets.serve(self.handle, host, port)
         self._loop = asyncio.get_event_loop()
+        self._loop.run_until_complete(
+            websockets.serve(self.handle, self._host, self._port))
 
     def main(self):
         """ main
         """
         self._log.debug('')
 
-        self._log.debug('start server ..')
-        self._loop.run_until_complete(self._start_svr)
+        self.start()
 
         self._log.info('run_forever() ..')
         self._loop.run_forever()
 
+    def status(self):
+        """
+        Returns
+        -------
+        status: dict
+            port, wav_mode, ch_n, playing, current (track),
+            connections, init_sec,
+            hw_start_sec: hardware bring-up (``Movement.start_sec``),
+            snapshot: ``Snapshot.status()`` (None: disabled)
+        """
+        return {
+            'port': self._port,
+            'wav_mode': self._wav_mode,
+            'ch_n': self._player.ch_n,
+            'playing': self._player.is_playing(),
+            'current': self._player.playlist_status()['current'],
+            'connections': self._conn_n,
+            'init_sec': round(self.init_sec, 3),
+            'hw_start_sec': self._player.movement().start_sec,
+            'snapshot': (self._snapshot.status()
+                         if self._snapshot is not None else None),
+        }
+
     def end(self):
         """ Call at the end of program
         """
         self._log.debug('doing ..')
 
+        if self._ensemble is not None:
+            self._ensemble.end()
+        self._worker.shutdown(wait=False)
+        if self._snapshot is not None:
+            # before the player is stopped (resume playing)
+            self._snapshot.end()
         self._player.end()
 
         self._log.debug('done')
 
+    @staticmethod
+    def coalesce_msec(data):
+        """ "coalesce" of a command
+
+        Parameters
+        ----------
+        data: dict
+
+        Returns
+        -------
+        coalesce_msec: float or None
+            None: not given
+
+        Raises
+        ------
+        ValueError, TypeError
+            not a number, negative or not finite
+        """
+        coalesce = data.get('coalesce')
+        if coalesce is None:
+            return None
+
+        coalesce = float(coalesce)
+        if not math.isfinite(coalesce) or coalesce < 0:
+            raise ValueError('coalesce: %s' % coalesce)
+        return coalesce
+
+    def music_path(self, music_file):
+        """ path of a music file given by a client
+
+        Parameters
+        ----------
+        music_file: str
+            relative to ``music_dir``, or an absolute path in it
+
+        Returns
+        -------
+        path: str or None
+            None: not in ``music_dir`` (or no ``music_dir``)
+        """
+        if self._music_dir is None or not isinstance(music_file, str):
+            return None
+
+        top = os.path.realpath(self._music_dir)
+        path = os.path.realpath(os.path.join(top, music_file))
+        if os.path.commonpath([top, path]) != top:
+            return None
+
+        return path
+
+    async def run_blocking(self, func, *args, **kw):
+        """ run a blocking call of the player in the worker thread
+        of this endpoint, not to stop the event loop
+        (the other connections and endpoints)
+
+        Parameters
+        ----------
+        func: function
+        args, kw:
+            arguments of ``func``
+
+        Returns
+        -------
+        ret:
+            the return value of ``func``
+        """
+        import asyncio
+
+        return await asyncio.get_event_loop().run_in_executor(
+            self._worker, functools.partial(func, *args, **kw))
+
     async def handle(self, websock, path):
         """
         request handler
 
+        All messages on the connection are handled,
+        until the client closes it.
+
         Parameters
         ----------
         websock: dict
@@ -153,7 +402,34 @@ class WsServer:
         self._log.debug('websock=%s:%s, path=%s',
                         websock.local_address, websock.host, path)
 
-        msg = await websock.recv()
+        from websockets.exceptions import ConnectionClosed
+
+        conn = {}  # state of this connection
+        self._conn_n += 1
+        try:
+            async for msg in websock:
+                conn['recv_time'] = self._player.clock().monotonic()
+                await self.handle_msg(websock, msg, conn)
+        except ConnectionClosed as ex:
+            self._log.debug('%s: %s', type(ex).__name__, ex)
+        finally:
+            if 'stream' in conn:
+                conn['stream'].end()
+            self._conn_n -= 1
+
+        self._log.debug('closed')
+
+    async def handle_msg(self, websock, msg, conn):
+        """
+        handle one message
+
+        Parameters
+        ----------
+        websock: dict
+        msg: str
+        conn: dict
+            state of the connection
+        """
         self._log.info('msg=%s', msg)
 
         try:
@@ -163,15 +439,14 @@ class WsServer:
             self._log.error('%s: %s. msg=%s', type(ex), ex, msg)
             return
 
-        self._log.debug('received command: %a', data['cmd'])
-        self._log.debug('data=%s', data)
-
         try:
             cmd = data['cmd']
         except KeyError as ex:
             self._log.error('%s: %s. data=%s', type(ex), ex, data)
             return
 
+        self._log.debug('received command: %a', cmd)
+
         if cmd in ('single_play', 'single', 'play', 'P'):
             try:
                 ch_list = data['ch']
@@ -185,11 +460,15 @@ class WsServer:
         if cmd in ('music_load', 'music', 'load', 'l'):
             try:
                 music_data = data['music_data']
-            except KeyError as ex:
+                coalesce_msec = self.coalesce_msec(data)
+            except (KeyError, ValueError, TypeError) as ex:
                 self._log.error('%s: %s. data=%s', type(ex), ex, data)
                 return
 
-            self._player.music_load(music_data)
+            # decoded just now: nobody else has it
+            await self.run_blocking(self._player.music_load, music_data,
+                                    coalesce_msec=coalesce_msec,
+                                    copy=False)
             return
 
         if cmd in ('music_play', 'start', 's'):
@@ -210,15 +489,56 @@ class WsServer:
 
         if cmd in ('music_shift', 'shift'):
             self._player.music_shift_percent(data['pos'])
-            print('AAA')
             return
 
         if cmd in ('music_stop', 'stop', 'S'):
-            self._player.music_stop()
+            await self.run_blocking(self._player.music_stop)
             return
 
         if cmd in ('music_wait', 'wait', 'w'):
-            self._player.music_wait()
+            # for the whole song: not in the worker of this endpoint
+            import asyncio
+
+            await asyncio.get_event_loop().run_in_executor(
+                None, self._player.music_wait)
+            return
+
+        if cmd in ('music_tempo', 'tempo'):
+            try:
+                rate = data['rate']
+                if rate != 'auto':
+                    rate = float(rate)
+            except (KeyError, ValueError, TypeError) as ex:
+                self._log.error('%s: %s. data=%s', type(ex), ex, data)
+                return
+
+            await self.run_blocking(self._player.music_tempo, rate)
+            return
+
+        if cmd in ('servo_pw',):
+            try:
+                writes = [(int(ch), int(pw)) for ch, pw in data['pw']]
+            except (KeyError, TypeError, ValueError) as ex:
+                self._log.error('%s: %s. data=%s', type(ex), ex, data)
+                return
+
+            self._player.write_pw(writes)
+            return
+
+        if cmd in ('rotation_speed', 'speed'):
+            try:
+                speed = float(data['speed'])
+                if not math.isfinite(speed):
+                    raise ValueError('speed: %s' % speed)
+            except (KeyError, ValueError, TypeError) as ex:
+                self._log.error('%s: %s. data=%s', type(ex), ex, data)
+                return
+
+            self._player.rotation_speed(speed)
+            return
+
+        if cmd in ('rotation_tempo', 'tempo_rotation'):
+            self._player.rotation_tempo(bool(data.get('on', True)))
             return
 
         if cmd in ('calibrate',):
@@ -227,8 +547,273 @@ class WsServer:
                 on = data['on']
                 pw_diff = data['pw_diff']
                 tap = data['tap']
-            except KeyError as ex:
+            except (KeyError, ValueError, TypeError) as ex:
+                self._log.error('%s: %s. data=%s', type(ex), ex, data)
+                return
+
+            await self.run_blocking(self._player.calibrate,
+                                    ch, on, pw_diff, tap)
+            return
+
+        if cmd in ('set_interval', 'interval'):
+            try:
+                ch = int(data['ch'])
+                push = data.get('push')
+                pull = data.get('pull')
+                push = None if push is None else float(push)
+                pull = None if pull is None else float(pull)
+                await self.run_blocking(self._player.set_interval,
+                                        ch, push, pull)
+            except (KeyError, ValueError, TypeError) as ex:
+                self._log.error('%s: %s. data=%s', type(ex), ex, data)
+            return
+
+        if cmd in ('playlist_add', 'enqueue'):
+            music_data = data.get('music_data')
+            music_file = data.get('music_file')
+            if music_data is None and music_file is None:
+                self._log.error('music_data or music_file: data=%s', data)
+                return
+
+            try:
+                coalesce_msec = self.coalesce_msec(data)
+            except (ValueError, TypeError) as ex:
+                self._log.error('%s: %s. data=%s', type(ex), ex, data)
+                return
+
+            if music_data is None:
+                music_file = self.music_path(music_file)
+                if music_file is None:
+                    self._log.error('music_file: not in music_dir (%s):'
+                                    ' data=%s', self._music_dir, data)
+                    return
+
+            # decoded just now: nobody else has it
+            self._player.playlist_add(music_data, music_file,
+                                      name=data.get('name'),
+                                      coalesce_msec=coalesce_msec,
+                                      copy=False)
+            if data.get('play', False):
+                self._player.music_play()
+            return
+
+        if cmd in ('playlist_next', 'next'):
+            self._player.playlist_next()
+            return
+
+        if cmd in ('playlist_shuffle', 'shuffle'):
+            self._player.playlist_shuffle(bool(data.get('on', True)))
+            return
+
+        if cmd in ('playlist_loop', 'loop'):
+            self._player.playlist_loop(bool(data.get('on', True)))
+            return
+
+        if cmd in ('playlist_clear',):
+            self._player.playlist_clear()
+            return
+
+        if cmd in ('playlist', 'playlist_status'):
+            await websock.send(json.dumps(self._player.playlist_status()))
+            return
+
+        if cmd in ('stream',):
+            if 'stream' not in conn:
+                conn['stream'] = NoteStream(self._player.movement(),
+                                            self._player.clock(),
+                                            debug=self._dbg)
+            try:
+                conn['stream'].add(data['notes'], data.get('sent'),
+                                   conn['recv_time'])
+            except (KeyError, TypeError) as ex:
+                self._log.error('%s: %s. data=%s', type(ex), ex, data)
+            return
+
+        if cmd in ('stream_sync',):
+            reply = {'cmd': cmd, 't0': data.get('t0'),
+                     't1': conn['recv_time'],
+                     't2': self._player.clock().monotonic()}
+            await websock.send(json.dumps(reply))
+            return
+
+        if cmd in ('ensemble_start',):
+            try:
+                start = float(data['start'])
+                coalesce_msec = self.coalesce_msec(data)
+            except (KeyError, ValueError, TypeError) as ex:
                 self._log.error('%s: %s. data=%s', type(ex), ex, data)
+                return
+
+            from .ensemble import Ensemble
+
+            if self._ensemble is not None:
+                self._ensemble.end()
+                self._ensemble = None
 
-            self._player.calibrate(ch, on, pw_diff, tap)
+            if data.get('music_data') is not None:
+                # decoded just now: nobody else has it
+                await self.run_blocking(self._player.music_load,
+                                        data['music_data'],
+                                        start_flag=False,
+                                        coalesce_msec=coalesce_msec,
+                                        copy=False)
+
+            self._ensemble = Ensemble(self._player, data.get('leader'),
+                                      start, bool(data.get('repeat', False)),
+                                      debug=self._dbg)
+            return
+
+        if cmd in ('status',):
+            await websock.send(json.dumps(self.status()))
+            return
+
+        if cmd in ('endpoints',):
+            status = {'endpoints': [self.status()]}
+            if self.group is not None:
+                status = self.group.status()
+            await websock.send(json.dumps(status))
             return
+
+        if cmd in ('ensemble_status',):
+            status = {}
+            if self._ensemble is not None:
+                status = self._ensemble.status()
+            await websock.send(json.dumps(status))
+            return
+
+        if cmd in ('stream_stats',):
+            stats = {}
+            if 'stream' in conn:
+                stats = conn['stream'].stats()
+                if data.get('reset', False):
+                    conn['stream'].reset_stats()
+            await websock.send(json.dumps(stats))
+            return
+
+
+class MultiWsServer:
+    """ several (port, wav_mode) endpoints in one process
+
+    Each endpoint has its own ``Player``, and all of them are served
+    on one asyncio event loop. The players are created in parallel,
+    and the wav files are loaded once for all of them
+    (``movement.load_sound()``).
+
+    ```python3
+    svr = MultiWsServer(['8880:0', '8881:1', '8882:2', '8883:3'])
+    try:
+        svr.main()
+    finally:
+        svr.end()
+    ```
+    """
+    def __init__(self, endpoints, debug=False, **kw):
+        """ Constructor
+
+        Parameters
+        ----------
+        endpoints: list of str or (int, int)
+            'port:wav_mode' or (port, wav_mode)
+        kw: dict
+            other keyword arguments of ``WsServer()`` (for all endpoints)
+        """
+        self._dbg = debug
+        self._log = get_logger(self.__class__.__name__, self._dbg)
+
+        start = time.monotonic()
+
+        self._endpoints = [self.parse_endpoint(e) for e in endpoints]
+        self._log.info('endpoints=%s', self._endpoints)
+
+        self._svr = [None] * len(self._endpoints)
+        errors = []
+
+        def _init(i, port, wav_mode):
+            try:
+                self._svr[i] = WsServer(wav_mode=wav_mode, port=port,
+                                        debug=self._dbg, **kw)
+                self._svr[i].group = self
+            except Exception as ex:
+                errors.append('%s: %s: %s' % (port, type(ex).__name__, ex))
+
+        th = [threading.Thread(target=_init, args=(i, port, wav_mode),
+                               daemon=True)
+              for i, (port, wav_mode) in enumerate(self._endpoints)]
+        for t in th:
+            t.start()
+        for t in th:
+            t.join()
+
+        if errors:
+            self._log.error('%s', errors)
+            self.end()
+            raise RuntimeError('; '.join(errors))
+
+        self.boot_sec = time.monotonic() - start
+        self._log.info('%s endpoints: ready in %.3f sec',
+                       len(self._svr), self.boot_sec)
+
+    @staticmethod
+    def parse_endpoint(endpoint):
+        """
+        Parameters
+        ----------
+        endpoint: str or (int, int)
+            'port:wav_mode'
+
+        Returns
+        -------
+        (port, wav_mode): (int, int)
+        """
+        if isinstance(endpoint, str):
+            port, _, wav_mode = endpoint.partition(':')
+            return int(port), int(wav_mode or Player.WAVMODE_NONE)
+
+        port, wav_mode = endpoint
+        return int(port), int(wav_mode)
+
+    def main(self):
+        """ main """
+        self._log.debug('')
+
+        import asyncio
+
+        for svr in self._svr:
+            svr.start()
+
+        self._log.info('run_forever() ..')
+        asyncio.get_event_loop().run_forever()
+
+    def end(self):
+        """ Call at the end of program (all endpoints in parallel) """
+        self._log.debug('doing ..')
+
+        th = [threading.Thread(target=svr.end, daemon=True)
+              for svr in self._svr if svr is not None]
+        for t in th:
+            t.start()
+        for t in th:
+            t.join()
+
+        self._log.debug('done')
+
+    def status(self):
+        """
+        Returns
+        -------
+        status: dict
+            endpoints: list of ``WsServer.status()``
+            boot_sec: time to create all the endpoints
+            max_rss_kb: memory of the process
+            sound_bank: wav files loaded (shared by the endpoints)
+        """
+        import resource
+        from .movement import sound_bank_info
+
+        return {
+            'endpoints': [svr.status() for svr in self._svr],
+            'boot_sec': round(self.boot_sec, 3),
+            'max_rss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+            'sound_bank': sound_bank_info(),
+        }